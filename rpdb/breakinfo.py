@@ -1,9 +1,26 @@
-import copy
-
-from rpdb.source_provider import MODULE_SCOPE, MODULE_SCOPE2, get_source, SCOPE_SEP
-from rpdb.utils import as_string, as_unicode, print_debug
+import hashlib
+import importlib.util
+import json
+import marshal
+import os
+import random
+import stat
+from bisect import bisect_right
+
+from rpdb.const import RPDB_BREAKINFO_FOLDER, BREAKINFO_FILE_EXT, MAX_BREAKINFO_FILES, BREAKINFO_CACHE_MIN_SIZE
+from rpdb.source_provider import MODULE_SCOPE, MODULE_SCOPE2, get_source_file, SCOPE_SEP
+from rpdb.utils import as_string, as_unicode, as_bytes, print_debug, print_debug_exception
 from rpdb.exceptions import InvalidScopeName
 
+#
+# Changes with the layout of cached break info.
+#
+BREAKINFO_FORMAT = 1
+
+BREAKINFO_FIRST_LINE = 'first_line'
+BREAKINFO_LAST_LINE = 'last_line'
+BREAKINFO_SCOPES = 'scopes'
+
 def myord(c):
     try:
         return ord(c)
@@ -21,15 +38,13 @@ class CScopeBreakInfo:
 
 
     def CalcScopeLine(self, lineno):
-        rvl = copy.copy(self.m_valid_lines)
-        rvl.reverse()
+        """
+        Return the last valid line up to lineno or the first valid line
+        if there is none.
+        """
 
-        l = ''
-        for l in rvl:
-            if lineno >= l:
-                break
-
-        return l
+        i = bisect_right(self.m_valid_lines, lineno)
+        return self.m_valid_lines[max(i - 1, 0)]
 
 
     def __str__(self):
@@ -41,75 +56,133 @@ class CFileBreakInfo:
     Break info structure for a source file.
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, folder = None):
         self.m_filename = filename
+        self.m_folder = folder
         self.m_first_line = 0
         self.m_last_line = 0
         self.m_scope_break_info = []
 
+        #
+        # Lookup index, see __build_index().
+        #
+        self.m_interval_starts = []
+        self.m_interval_scopes = []
+        self.m_scopes_by_last_line = []
+        self.m_scopes_by_name = {}
+
 
     def CalcBreakInfo(self):
-        (source, encoding) = get_source(self.m_filename)
-        _source = as_string(source + as_unicode('\n'), encoding)
+        """
+        Calc the break info from the code of the file. The code is taken
+        from the bytecode cache of the import system if it is up to date
+        and compiled otherwise. Break info of large files is stored on
+        disk by the hash of their source.
+        """
 
-        code = compile(_source, self.m_filename, "exec")
+        sf = get_source_file(self.m_filename)
+
+        key = None
+        if len(sf.m_source) >= BREAKINFO_CACHE_MIN_SIZE:
+            key = calc_break_info_key(sf.m_source)
+            info = load_break_info(key, self.m_folder)
+            if info is not None:
+                self.__set_break_info(info)
+                return
+
+        code = None
+        if sf.m_ffilesystem:
+            code = load_compiled_code(self.m_filename, sf.m_signature)
+
+        if code is None:
+            _source = as_string(sf.m_source + as_unicode('\n'), sf.m_encoding)
+            code = compile(_source, self.m_filename, "exec")
+
+        info = calc_break_info(code)
+        self.__set_break_info(info)
+
+        if key is not None:
+            save_break_info(key, info, self.m_folder)
 
-        self.m_scope_break_info = []
-        self.m_first_line = code.co_firstlineno
-        self.m_last_line = 0
 
-        fqn = []
-        t = [code]
+    def __set_break_info(self, info):
+        self.m_first_line = info[BREAKINFO_FIRST_LINE]
+        self.m_last_line = info[BREAKINFO_LAST_LINE]
+        self.m_scope_break_info = [CScopeBreakInfo(fqn, valid_lines) for (fqn, valid_lines) in info[BREAKINFO_SCOPES]]
 
-        while len(t) > 0:
-            c = t.pop(0)
+        self.__build_index()
 
-            if type(c) == tuple:
-                self.m_scope_break_info.append(CScopeBreakInfo(*c))
-                fqn.pop()
+
+    def __build_index(self):
+        """
+        Index the scopes for lookups by line and by name.
+
+        Scopes are listed children first, so the scope of a line is the
+        first one in the list whose lines span it. The lines of the file
+        are split into intervals at the first and past the last line of
+        every scope and each interval is mapped to the index of its scope,
+        or -1 for none.
+        """
+
+        sbil = self.m_scope_break_info
+
+        starts = sorted(set([sbi.m_first_line for sbi in sbil] + [sbi.m_last_line + 1 for sbi in sbil]))
+        scopes = [-1] * len(starts)
+
+        for i in range(len(sbil) - 1, -1, -1):
+            sbi = sbil[i]
+
+            j = bisect_right(starts, sbi.m_first_line) - 1
+            while j < len(starts) and starts[j] <= sbi.m_last_line:
+                scopes[j] = i
+                j += 1
+
+        self.m_interval_starts = []
+        self.m_interval_scopes = []
+
+        for (start, i) in zip(starts, scopes):
+            if len(self.m_interval_scopes) > 0 and self.m_interval_scopes[-1] == i:
                 continue
 
-            fqn = fqn + [c.co_name]
-            valid_lines = CalcValidLines(c)
-            self.m_last_line = max(self.m_last_line, valid_lines[-1])
-            _fqn = as_unicode('.'.join(fqn), encoding)
-            si = (_fqn, valid_lines)
-            subcodeslist = self.__CalcSubCodesList(c)
-            t = subcodeslist + [si] + t
+            self.m_interval_starts.append(start)
+            self.m_interval_scopes.append(i)
 
+        self.m_scopes_by_last_line = sorted([(sbi.m_last_line, i) for (i, sbi) in enumerate(sbil)])
 
-    def __CalcSubCodesList(self, code):
-        tc = type(code)
-        t = [(c.co_firstlineno, c) for c in code.co_consts if type(c) == tc]
-        t.sort()
-        scl = [c[1] for c in t]
-        return scl
+        self.m_scopes_by_name = {}
+        for (i, sbi) in enumerate(sbil):
+            self.m_scopes_by_name.setdefault(sbi.m_fqn, i)
 
 
     def FindScopeByLineno(self, lineno):
         lineno = max(min(lineno, self.m_last_line), self.m_first_line)
 
-        smaller_element = None
-        exact_element = None
+        j = bisect_right(self.m_interval_starts, lineno) - 1
+        exact_index = [-1, self.m_interval_scopes[j]][j >= 0]
 
-        for sbi in self.m_scope_break_info:
-            if lineno > sbi.m_last_line:
-                if (smaller_element is None) or (sbi.m_last_line >= smaller_element.m_last_line):
-                    smaller_element = sbi
-                continue
+        assert(exact_index >= 0)
 
-            if (lineno >= sbi.m_first_line) and (lineno <= sbi.m_last_line):
-                exact_element = sbi
-                break
+        scope = self.m_scope_break_info[exact_index]
+        l = scope.CalcScopeLine(lineno)
 
-        assert(exact_element is not None)
+        #
+        # A line past the end of a scope that precedes the scope of the
+        # line in the list, and that ends after the valid line found, is
+        # taken to belong to the end of that scope. Of such scopes, the
+        # one that ends last is taken, and of these the last in the list.
+        #
+        k = bisect_right(self.m_scopes_by_last_line, (lineno - 1, len(self.m_scope_break_info))) - 1
 
-        scope = exact_element
-        l = exact_element.CalcScopeLine(lineno)
+        while k >= 0:
+            (last_line, i) = self.m_scopes_by_last_line[k]
+            if i < exact_index:
+                if l <= last_line:
+                    scope = self.m_scope_break_info[i]
+                    l = scope.CalcScopeLine(lineno)
 
-        if (smaller_element is not None) and (l <= smaller_element.m_last_line):
-            scope = smaller_element
-            l = smaller_element.CalcScopeLine(lineno)
+                break
+
+            k -= 1
 
         return (scope, l)
 
@@ -122,14 +195,16 @@ class CFileBreakInfo:
         else:
             return self.FindScopeByName(MODULE_SCOPE2 + SCOPE_SEP + name, offset)
 
-        for sbi in self.m_scope_break_info:
-            if sbi.m_fqn in [name, alt_scope]:
-                l = sbi.CalcScopeLine(sbi.m_first_line + offset)
-                return (sbi, l)
+        il = [self.m_scopes_by_name[n] for n in [name, alt_scope] if n in self.m_scopes_by_name]
+        if len(il) == 0:
+            print_debug('Invalid scope: %s' % repr(name))
+
+            raise InvalidScopeName
 
-        print_debug('Invalid scope: %s' % repr(name))
+        sbi = self.m_scope_break_info[min(il)]
+        l = sbi.CalcScopeLine(sbi.m_first_line + offset)
 
-        raise InvalidScopeName
+        return (sbi, l)
 
 
 class CBreakInfoManager:
@@ -137,12 +212,13 @@ class CBreakInfoManager:
     Manage break info dictionary per filename.
     """
 
-    def __init__(self):
+    def __init__(self, folder = None):
+        self.m_folder = folder
         self.m_file_info_dic = {}
 
 
     def addFile(self, filename):
-        mbi = CFileBreakInfo(filename)
+        mbi = CFileBreakInfo(filename, self.m_folder)
         mbi.CalcBreakInfo()
         self.m_file_info_dic[filename] = mbi
 
@@ -154,7 +230,58 @@ class CBreakInfoManager:
         return self.m_file_info_dic[filename]
 
 
+def calc_break_info(code):
+    """
+    Return the break info of module code as a dictionary with the
+    BREAKINFO_* keys. Scopes are listed depth first in the order of
+    their first lines, each as a (fqn, valid_lines) pair.
+    """
+
+    scopes = []
+    last_line = 0
+
+    fqn = []
+    t = [code]
+
+    while len(t) > 0:
+        c = t.pop(0)
+
+        if type(c) == tuple:
+            scopes.append(c)
+            fqn.pop()
+            continue
+
+        fqn = fqn + [c.co_name]
+        valid_lines = CalcValidLines(c)
+        last_line = max(last_line, valid_lines[-1])
+        si = (as_unicode('.'.join(fqn)), valid_lines)
+        t = calc_sub_codes_list(c) + [si] + t
+
+    return {BREAKINFO_FIRST_LINE: code.co_firstlineno, BREAKINFO_LAST_LINE: last_line, BREAKINFO_SCOPES: scopes}
+
+
+def calc_sub_codes_list(code):
+    tc = type(code)
+    t = [(c.co_firstlineno, c) for c in code.co_consts if type(c) == tc]
+    t.sort(key = lambda x: x[0])
+    scl = [c[1] for c in t]
+    return scl
+
+
 def CalcValidLines(code):
+    """
+    Return the sorted list of lines of code on which execution may stop.
+    """
+
+    if hasattr(code, 'co_lines'):
+        lines = set([l for (start, end, l) in code.co_lines() if l is not None and l > 0])
+        lines.add(code.co_firstlineno)
+
+        return sorted(lines)
+
+    #
+    # Python versions before 3.10 have no co_lines().
+    #
     l = code.co_firstlineno
     vl = [l]
 
@@ -176,4 +303,158 @@ def CalcValidLines(code):
         if l != vl[-1]:
             vl.append(l)
 
-    return vl
\ No newline at end of file
+    return vl
+
+
+def load_compiled_code(filename, signature):
+    """
+    Return the module code of filename from the bytecode cache of the
+    import system, or None if it is missing or out of date. signature is
+    the (mtime, size, inode) of the source the code must match.
+    """
+
+    if signature is None:
+        return None
+
+    try:
+        path = importlib.util.cache_from_source(filename)
+
+        f = open(path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+    except (EnvironmentError, NotImplementedError, ValueError):
+        return None
+
+    if data[:4] != importlib.util.MAGIC_NUMBER:
+        return None
+
+    #
+    # Hash based bytecode files are not validated here.
+    #
+    if int.from_bytes(data[4:8], 'little') != 0:
+        return None
+
+    (mtime, size, inode) = signature
+    if int.from_bytes(data[8:12], 'little') != int(mtime) & 0xFFFFFFFF:
+        return None
+
+    if int.from_bytes(data[12:16], 'little') != size & 0xFFFFFFFF:
+        return None
+
+    try:
+        return marshal.loads(data[16:])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def calc_break_info_folder():
+    """
+    Calc the folder of the break info cache:
+    '~/.rpdb2_settings/breakinfo'
+    """
+
+    home = os.path.expanduser('~')
+    return os.path.join(home, RPDB_BREAKINFO_FOLDER)
+
+
+def calc_break_info_key(source):
+    """
+    Break info depends only on the source and on the compiler, so files
+    with the same source share an entry.
+    """
+
+    h = hashlib.sha256(importlib.util.MAGIC_NUMBER + as_bytes(str(BREAKINFO_FORMAT)))
+    h.update(source.encode('utf-8', 'surrogatepass'))
+
+    return h.hexdigest()
+
+
+def calc_break_info_path(key, folder = None):
+    if folder is None:
+        folder = calc_break_info_folder()
+
+    return os.path.join(folder, key + BREAKINFO_FILE_EXT)
+
+
+def load_break_info(key, folder = None):
+    try:
+        f = open(calc_break_info_path(key, folder), 'r')
+        try:
+            info = json.load(f)
+        finally:
+            f.close()
+
+        first_line = int(info[BREAKINFO_FIRST_LINE])
+        last_line = int(info[BREAKINFO_LAST_LINE])
+        scopes = [(as_unicode(fqn), [int(l) for l in valid_lines]) for (fqn, valid_lines) in info[BREAKINFO_SCOPES]]
+
+    except (EnvironmentError, ValueError, KeyError, TypeError):
+        return None
+
+    if len(scopes) == 0 or [] in [valid_lines for (fqn, valid_lines) in scopes]:
+        return None
+
+    return {BREAKINFO_FIRST_LINE: first_line, BREAKINFO_LAST_LINE: last_line, BREAKINFO_SCOPES: scopes}
+
+
+def save_break_info(key, info, folder = None):
+    if folder is None:
+        folder = calc_break_info_folder()
+
+    path = calc_break_info_path(key, folder)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+
+    try:
+        if not os.path.exists(folder):
+            os.makedirs(folder, int('0700', 8))
+
+        f = open(tmp_path, 'w')
+        try:
+            json.dump(info, f)
+        finally:
+            f.close()
+
+        os.replace(tmp_path, path)
+
+    except EnvironmentError:
+        print_debug_exception()
+
+        try:
+            os.remove(tmp_path)
+        except EnvironmentError:
+            pass
+
+        return
+
+    cleanup_break_info_folder(folder)
+
+
+def cleanup_break_info_folder(folder):
+    """
+    Occasionally remove the least recently used entries above
+    MAX_BREAKINFO_FILES.
+    """
+
+    if random.randint(0, 10) > 0:
+        return
+
+    try:
+        l = os.listdir(folder)
+        if len(l) <= MAX_BREAKINFO_FILES:
+            return
+
+        ll = [(os.stat(os.path.join(folder, f))[stat.ST_ATIME], f) for f in l]
+
+    except EnvironmentError:
+        return
+
+    ll.sort()
+
+    for (t, f) in ll[: -MAX_BREAKINFO_FILES]:
+        try:
+            os.remove(os.path.join(folder, f))
+        except EnvironmentError:
+            pass
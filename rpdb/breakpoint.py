@@ -1,7 +1,9 @@
 import copyreg as copy_reg
+import random
 import threading
 
 from rpdb.events import CEventBreakpoint
+from rpdb.exceptions import InvalidScopeName, BadArgument
 from rpdb.utils import as_bytes, as_unicode, print_debug, winlower
 from rpdb.source_provider import  ENCODING_SOURCE, MODULE_SCOPE, MODULE_SCOPE2, SCOPE_SEP
 from rpdb.breakinfo import CBreakInfoManager
@@ -9,11 +11,13 @@ from rpdb.breakinfo import CBreakInfoManager
 
 
 class CBreakPoint(object):
-    def __init__(self, filename, scope_fqn, scope_first_line, lineno, fEnabled, expr, encoding, fTemporary = False):
+    def __init__(self, filename, scope_fqn, scope_first_line, lineno, fEnabled, expr, encoding, fTemporary = False, log_exprs = None):
         """
         Breakpoint constructor.
 
         scope_fqn - scope fully qualified name. e.g: module.class.method
+        log_exprs - list of expressions, makes the breakpoint a logpoint
+                    which records their values instead of breaking.
         """
 
         self.m_id = None
@@ -29,18 +33,30 @@ class CBreakPoint(object):
         self.m_code = None
         self.m_fTemporary = fTemporary
 
+        self.m_hit_count = 0
+        self.m_ignore_count = 0
+        self.m_every = 0
+        self.m_probability = 1.0
+
+        self.m_log_exprs = None
+        self.m_log_codes = None
+
         if (expr is not None) and (expr != ''):
             _expr = as_bytes(ENCODING_SOURCE % encoding + expr, encoding)
             print_debug('Breakpoint expression: %s' % repr(_expr))
             self.m_code = compile(_expr, '<string>', 'eval')
 
+        if log_exprs:
+            self.m_log_exprs = list(log_exprs)
+            self.m_log_codes = [compile(as_bytes(ENCODING_SOURCE % encoding + e, encoding), '<string>', 'eval') for e in log_exprs]
+
 
     def __reduce__(self):
         rv = (copy_reg.__newobj__, (type(self), ), vars(self), None, None)
         return rv
 
 
-    def calc_enclosing_scope_name(self):
+    def calc_enclosing_scope_fqn(self):
         if self.m_scope_offset != 0:
             return None
 
@@ -48,9 +64,9 @@ class CBreakPoint(object):
             return None
 
         scope_name_list = self.m_scope_fqn.split(SCOPE_SEP)
-        enclosing_scope_name = scope_name_list[-2]
+        enclosing_scope_fqn = SCOPE_SEP.join(scope_name_list[:-1])
 
-        return enclosing_scope_name
+        return enclosing_scope_fqn
 
 
     def enable(self):
@@ -65,6 +81,50 @@ class CBreakPoint(object):
         return self.m_fEnabled
 
 
+    def is_logpoint(self):
+        return self.m_log_exprs is not None
+
+
+    def set_filter(self, ignore_count, every, probability):
+        """
+        Set the hit filters and reset the hit count.
+
+        ignore_count - number of hits to ignore.
+        every        - break only on every Nth hit (0 or 1 for every hit).
+        probability  - break with this probability.
+        """
+
+        self.m_hit_count = 0
+        self.m_ignore_count = ignore_count
+        self.m_every = every
+        self.m_probability = probability
+
+
+    def has_filter(self):
+        return self.m_ignore_count > 0 or self.m_every > 1 or self.m_probability < 1.0
+
+
+    def count_hit(self):
+        """
+        Count a hit and return True if it passes the hit filters.
+        The filters are cheap and are checked before the condition.
+        """
+
+        self.m_hit_count += 1
+
+        if self.m_ignore_count > 0:
+            self.m_ignore_count -= 1
+            return False
+
+        if self.m_every > 1 and self.m_hit_count % self.m_every != 0:
+            return False
+
+        if self.m_probability < 1.0 and random.random() >= self.m_probability:
+            return False
+
+        return True
+
+
     def __str__(self):
         return "('" + self.m_filename + "', '" + self.m_scope_fqn + "', " + str(self.m_scope_first_line) + ', ' + str(self.m_scope_offset) + ', ' + str(self.m_lineno) + ')'
 
@@ -149,7 +209,12 @@ class CBreakPointsManagerProxy:
             self.m_session_manager.m_event_dispatcher.fire_event(event)
 
 
-    def sync(self):
+    def sync(self, break_points_by_id = None):
+        """
+        Reload the breakpoints from the debuggee, or from the result of a
+        get_breakpoints() call made by the caller.
+        """
+
         try:
             self.m_lock.acquire()
 
@@ -159,7 +224,8 @@ class CBreakPointsManagerProxy:
         finally:
             self.m_lock.release()
 
-        break_points_by_id = self.m_session_manager.getSession().getProxy().get_breakpoints()
+        if break_points_by_id is None:
+            break_points_by_id = self.m_session_manager.getSession().getProxy().get_breakpoints()
 
         try:
             self.m_lock.acquire()
@@ -199,7 +265,7 @@ class CBreakPointsManager:
     def __init__(self):
         self.m_break_info_manager = CBreakInfoManager()
         self.m_active_break_points_by_file = {}
-        self.m_break_points_by_function = {}
+        self.m_break_points_by_code = {}
         self.m_break_points_by_file = {}
         self.m_break_points_by_id = {}
         self.m_lock = threading.Lock()
@@ -232,16 +298,14 @@ class CBreakPointsManager:
             bpmpt[tbp.m_lineno] = tbp
 
 
-    def __remove_from_function_list(self, bp):
-        function_name = bp.m_scope_name
+    def __calc_code_keys(self, bp):
+        """
+        Return the identities of the code objects a breakpoint belongs to.
+        A code object is identified by its file name and first line, which
+        is the first line of the matching scope in the break info of the file.
+        """
 
-        try:
-            bpf = self.m_break_points_by_function[function_name]
-            del bpf[bp]
-            if len(bpf) == 0:
-                del self.m_break_points_by_function[function_name]
-        except KeyError:
-            pass
+        code_keys = [(bp.m_filename, bp.m_scope_first_line)]
 
         #
         # In some cases a breakpoint belongs to two scopes at the
@@ -249,37 +313,36 @@ class CBreakPointsManager:
         # of a function.
         #
 
-        _function_name = bp.calc_enclosing_scope_name()
-        if _function_name is None:
-            return
+        enclosing_scope_fqn = bp.calc_enclosing_scope_fqn()
+        if enclosing_scope_fqn is None:
+            return code_keys
 
         try:
-            _bpf = self.m_break_points_by_function[_function_name]
-            del _bpf[bp]
-            if len(_bpf) == 0:
-                del self.m_break_points_by_function[_function_name]
-        except KeyError:
-            pass
+            mbi = self.m_break_info_manager.getFile(bp.m_filename)
+            (s, l) = mbi.FindScopeByName(enclosing_scope_fqn, 0)
+        except (IOError, InvalidScopeName):
+            return code_keys
 
+        code_keys.append((bp.m_filename, s.m_first_line))
 
-    def __add_to_function_list(self, bp):
-        function_name = bp.m_scope_name
+        return code_keys
 
-        bpf = self.m_break_points_by_function.setdefault(function_name, {})
-        bpf[bp] = True
 
-        #
-        # In some cases a breakpoint belongs to two scopes at the
-        # same time. For example a breakpoint on the declaration line
-        # of a function.
-        #
+    def __remove_from_code_list(self, bp):
+        for code_key in self.__calc_code_keys(bp):
+            try:
+                bpc = self.m_break_points_by_code[code_key]
+                del bpc[bp]
+                if len(bpc) == 0:
+                    del self.m_break_points_by_code[code_key]
+            except KeyError:
+                pass
 
-        _function_name = bp.calc_enclosing_scope_name()
-        if _function_name is None:
-            return
 
-        _bpf = self.m_break_points_by_function.setdefault(_function_name, {})
-        _bpf[bp] = True
+    def __add_to_code_list(self, bp):
+        for code_key in self.__calc_code_keys(bp):
+            bpc = self.m_break_points_by_code.setdefault(code_key, {})
+            bpc[bp] = True
 
 
     def get_breakpoint(self, filename, lineno):
@@ -292,6 +355,18 @@ class CBreakPointsManager:
         return bp
 
 
+    def get_file_breakpoints(self, filename, lineno, nlines):
+        """
+        Get a dict of the breakpoints of a file in nlines lines from line
+        lineno, by line number.
+        """
+
+        bpm = self.m_break_points_by_file.get(filename, {})
+        end = lineno + nlines
+
+        return dict([(l, bp) for (l, bp) in list(bpm.items()) if lineno <= l < end])
+
+
     def del_temp_breakpoint(self, fLock = True, breakpoint = None):
         """
         Delete a temoporary breakpoint.
@@ -316,7 +391,7 @@ class CBreakPointsManager:
             self.m_temp_bp = None
             self.m_fhard_tbp = False
 
-            self.__remove_from_function_list(bp)
+            self.__remove_from_code_list(bp)
             self.__calc_active_break_points_by_file(bp.m_filename)
 
         finally:
@@ -351,14 +426,14 @@ class CBreakPointsManager:
             self.m_fhard_tbp = fhard
             self.m_temp_bp = bp
 
-            self.__add_to_function_list(bp)
+            self.__add_to_code_list(bp)
             self.__calc_active_break_points_by_file(bp.m_filename)
 
         finally:
             self.m_lock.release()
 
 
-    def set_breakpoint(self, filename, scope, lineno, fEnabled, expr, encoding):
+    def set_breakpoint(self, filename, scope, lineno, fEnabled, expr, encoding, log_exprs = None):
         """
         Set breakpoint.
 
@@ -369,6 +444,10 @@ class CBreakPointsManager:
                that will be evaluated at the scope of the breakpoint.
                The breakpoint will be hit if the expression evaluates
                to True.
+
+        log_exprs - (Optional) list of python expressions. If given the
+               breakpoint is a logpoint, which records the values of the
+               expressions when it is hit and does not break.
         """
 
         _filename = winlower(filename)
@@ -380,7 +459,7 @@ class CBreakPointsManager:
         else:
             (s, l) = mbi.FindScopeByLineno(lineno)
 
-        bp = CBreakPoint(_filename, s.m_fqn, s.m_first_line, l, fEnabled, expr, encoding)
+        bp = CBreakPoint(_filename, s.m_fqn, s.m_first_line, l, fEnabled, expr, encoding, log_exprs = log_exprs)
 
         try:
             self.m_lock.acquire()
@@ -396,7 +475,7 @@ class CBreakPointsManager:
             try:
                 old_bp = bpm[l]
                 id = old_bp.m_id
-                self.__remove_from_function_list(old_bp)
+                self.__remove_from_code_list(old_bp)
             except KeyError:
                 #
                 # Find the smallest available ID.
@@ -416,7 +495,7 @@ class CBreakPointsManager:
             self.m_break_points_by_id[id] = bp
             bpm[l] = bp
             if fEnabled:
-                self.__add_to_function_list(bp)
+                self.__add_to_code_list(bp)
 
             self.__calc_active_break_points_by_file(bp.m_filename)
 
@@ -444,7 +523,7 @@ class CBreakPointsManager:
                     continue
 
                 bp.disable()
-                self.__remove_from_function_list(bp)
+                self.__remove_from_code_list(bp)
                 self.__calc_active_break_points_by_file(bp.m_filename)
 
         finally:
@@ -469,13 +548,52 @@ class CBreakPointsManager:
                     continue
 
                 bp.enable()
-                self.__add_to_function_list(bp)
+                self.__add_to_code_list(bp)
                 self.__calc_active_break_points_by_file(bp.m_filename)
 
         finally:
             self.m_lock.release()
 
 
+    def set_breakpoint_filter(self, id_list, fAll, ignore_count, every, probability):
+        """
+        Set the hit filters of breakpoints.
+        Return the list of breakpoints that changed.
+        """
+
+        try:
+            ignore_count = int(ignore_count)
+            every = int(every)
+            probability = float(probability)
+        except (TypeError, ValueError):
+            raise BadArgument
+
+        if ignore_count < 0 or every < 0 or not (0.0 < probability <= 1.0):
+            raise BadArgument
+
+        try:
+            self.m_lock.acquire()
+
+            if fAll:
+                id_list = list(self.m_break_points_by_id.keys())
+
+            bpl = []
+
+            for id in id_list:
+                try:
+                    bp = self.m_break_points_by_id[id]
+                except KeyError:
+                    continue
+
+                bp.set_filter(ignore_count, every, probability)
+                bpl.append(bp)
+
+            return bpl
+
+        finally:
+            self.m_lock.release()
+
+
     def delete_breakpoint(self, id_list, fAll):
         """
         Delete breakpoint.
@@ -503,7 +621,7 @@ class CBreakPointsManager:
                 if len(bpm) == 0:
                     del self.m_break_points_by_file[filename]
 
-                self.__remove_from_function_list(bp)
+                self.__remove_from_code_list(bp)
                 self.__calc_active_break_points_by_file(bp.m_filename)
 
                 del self.m_break_points_by_id[id]
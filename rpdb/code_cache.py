@@ -0,0 +1,159 @@
+import threading
+import operator
+import weakref
+
+from rpdb.const import MAX_CODE_CONTEXTS
+
+
+class CKeyRef(weakref.ref):
+    """
+    Weak reference to a cache key which remembers the id of the key,
+    so its entry can be found after the key is garbage collected.
+    """
+
+    __slots__ = ('m_key_id', )
+
+
+
+class CWeakKeyCache:
+    """
+    Cache keyed by weak references, with a size cap.
+
+    Entries are stored by the id of their key together with a weak
+    reference that tells if the key is still the same object, so lookups
+    do not allocate. An entry is released when its key is garbage
+    collected and the oldest entries are evicted when the cache is full.
+    Lookups do not take a lock since they are on the tracing hot path,
+    inserts and iteration do. Values must not reference their key, or
+    the key is never released, and should not hold state that can not
+    be rebuilt since they may be evicted.
+    """
+
+    def __init__(self, max_size = MAX_CODE_CONTEXTS):
+        self.m_max_size = max_size
+
+        self.m_data = {}
+
+        #
+        # Code run while the lock is held may be traced, and the trace
+        # function looks up the cache again from the same thread.
+        #
+        self.m_lock = threading.RLock()
+
+        #
+        # Weak reference callbacks may run in any thread at any time,
+        # including during iteration and while the lock is held, so they
+        # only queue the removal. The callback is a builtin method since
+        # a Python function would be traced and could call back into
+        # the cache.
+        #
+        self.m_pending_removals = []
+        self.m_remove = self.m_pending_removals.append
+
+        self.m_hits = 0
+        self.m_misses = 0
+        self.m_evictions = 0
+        self.m_releases = 0
+
+
+    def __getitem__(self, key):
+        (ref, value) = self.m_data[id(key)]
+        if ref() is not key:
+            raise KeyError(key)
+
+        self.m_hits += 1
+
+        return value
+
+
+    def __contains__(self, key):
+        entry = self.m_data.get(id(key), None)
+        return entry is not None and entry[0]() is key
+
+
+    def __len__(self):
+        return len(self.m_data) - len(self.m_pending_removals)
+
+
+    def setdefault(self, key, value):
+        """
+        Insert value unless key is already cached and return the cached
+        value. Every insert counts as a miss.
+        """
+
+        ref = CKeyRef(key, self.m_remove)
+        ref.m_key_id = id(key)
+
+        #
+        # Values dropped from the cache are released after the lock is
+        # released, since their destruction may run arbitrary code.
+        #
+        dropped = []
+
+        try:
+            self.m_lock.acquire()
+
+            self.__purge(dropped)
+
+            entry = self.m_data.get(ref.m_key_id, None)
+            if entry is not None:
+                if entry[0]() is key:
+                    return entry[1]
+
+                #
+                # The key of the entry was released and its id reused.
+                #
+                dropped.append(self.m_data.pop(ref.m_key_id))
+                self.m_releases += 1
+
+            self.m_misses += 1
+
+            while len(self.m_data) >= self.m_max_size:
+                dropped.append(self.m_data.pop(next(iter(self.m_data))))
+                self.m_evictions += 1
+
+            self.m_data[ref.m_key_id] = (ref, value)
+            return value
+
+        finally:
+            self.m_lock.release()
+            del dropped
+
+
+    def values(self):
+        dropped = []
+
+        try:
+            self.m_lock.acquire()
+
+            self.__purge(dropped)
+            return list(map(operator.itemgetter(1), list(self.m_data.values())))
+
+        finally:
+            self.m_lock.release()
+            del dropped
+
+
+    def get_stats(self):
+        return {
+            'size': len(self),
+            'max_size': self.m_max_size,
+            'hits': self.m_hits,
+            'misses': self.m_misses,
+            'evictions': self.m_evictions,
+            'releases': self.m_releases
+            }
+
+
+    def __purge(self, dropped):
+        while self.m_pending_removals:
+            ref = self.m_pending_removals.pop()
+
+            #
+            # The id of a released key may already be reused by a newer
+            # entry, which must be kept.
+            #
+            entry = self.m_data.get(ref.m_key_id, None)
+            if entry is not None and entry[0] is ref:
+                dropped.append(self.m_data.pop(ref.m_key_id))
+                self.m_releases += 1
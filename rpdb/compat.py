@@ -1,4 +1,7 @@
 import base64
+import importlib.machinery
+import importlib.util
+import sys
 
 # TODO py3k
 import hashlib
@@ -40,3 +43,20 @@ if not hasattr(g_builtins_module, 'str8'):
 base64_encodestring = base64.encodebytes
 base64_decodestring = base64.decodebytes
 
+
+
+
+def load_source(name, path):
+    """
+    Replacement for imp.load_source() which is gone in Python 3.12.
+    Load the source file at path as module name and register it
+    in sys.modules.
+    """
+
+    loader = importlib.machinery.SourceFileLoader(name, path)
+    spec = importlib.util.spec_from_file_location(name, path, loader = loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    return module
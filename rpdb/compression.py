@@ -0,0 +1,207 @@
+import pickle
+import threading
+import zlib
+
+from rpdb.const import DICT_KEY_TID, DICT_KEY_STACK, DICT_KEY_CODE_LIST, DICT_KEY_CURRENT_TID, DICT_KEY_BROKEN, \
+    DICT_KEY_EVENT, DICT_KEY_BREAKPOINTS, DICT_KEY_LINES, DICT_KEY_FILENAME, DICT_KEY_FIRST_LINENO, \
+    DICT_KEY_FRAME_LINENO, DICT_KEY_EXPR, DICT_KEY_NAME, DICT_KEY_REPR, DICT_KEY_IS_VALID, DICT_KEY_TYPE, \
+    DICT_KEY_SUBNODES, DICT_KEY_N_SUBNODES, COMPRESSION_MIN_SIZE, COMPRESSION_MAX_RATIO, FAST_LINK_MIN_SIZE, \
+    FAST_LINK_SPEED, SLOW_LINK_SPEED
+from rpdb.utils import as_unicode
+
+
+def calc_preset_dictionary():
+    """
+    Return the preset dictionary of compressed messages, the pickles of
+    typical source, stack and namespace payloads. Later parts of the
+    dictionary are cheaper to refer to, so the most frequent payloads,
+    namespaces, come last.
+    """
+
+    filename = as_unicode('/usr/lib/python3/site-packages/package/module.py')
+
+    source = {
+        DICT_KEY_LINES: [as_unicode('    def method(self, value):\n'), as_unicode('        if value is None:\n'), as_unicode('            return self.m_value\n')],
+        DICT_KEY_FILENAME: filename,
+        DICT_KEY_FIRST_LINENO: 1,
+        DICT_KEY_FRAME_LINENO: 2,
+        DICT_KEY_BREAKPOINTS: {},
+        DICT_KEY_EVENT: as_unicode('line'),
+        DICT_KEY_BROKEN: True,
+        DICT_KEY_TID: 140000000000000
+        }
+
+    stack = {
+        DICT_KEY_STACK: [(filename, 1, as_unicode('<module>'), as_unicode('main()')), (filename, 2, as_unicode('method'), as_unicode('return self.m_value'))],
+        DICT_KEY_CODE_LIST: [as_unicode('0x7f0000000000'), as_unicode('0x7f0000000001')],
+        DICT_KEY_TID: 140000000000000,
+        DICT_KEY_BROKEN: True,
+        DICT_KEY_EVENT: as_unicode('line'),
+        DICT_KEY_CURRENT_TID: True
+        }
+
+    node = {
+        DICT_KEY_EXPR: as_unicode('(locals())["self"]'),
+        DICT_KEY_NAME: as_unicode('self'),
+        DICT_KEY_REPR: as_unicode('<__main__.CClass object at 0x7f0000000000>'),
+        DICT_KEY_IS_VALID: True,
+        DICT_KEY_TYPE: as_unicode('instance'),
+        DICT_KEY_N_SUBNODES: 0
+        }
+
+    namespace = dict(node)
+    namespace.update({DICT_KEY_EXPR: as_unicode('locals()'), DICT_KEY_NAME: as_unicode('locals()'), DICT_KEY_TYPE: as_unicode('dict'), DICT_KEY_N_SUBNODES: 2})
+    namespace[DICT_KEY_SUBNODES] = [node, dict(node, **{DICT_KEY_NAME: as_unicode('value'), DICT_KEY_REPR: as_unicode("'text'"), DICT_KEY_TYPE: as_unicode('str')})]
+
+    return b''.join([pickle.dumps((0, 0, as_unicode('0'), (0, r, None)), 2) for r in [source, stack, [namespace]]])
+
+
+COMPRESSION_DICT = calc_preset_dictionary()
+
+
+def calc_compression_level(size, link_speed):
+    """
+    Return the zlib level to compress a payload of size bytes with over
+    a link of link_speed bytes per second, None if unknown, or 0 to send
+    it as is. Fast links only pay off for large payloads.
+    """
+
+    if size < COMPRESSION_MIN_SIZE:
+        return 0
+
+    if link_speed is None:
+        return 1
+
+    if link_speed >= FAST_LINK_SPEED:
+        return [0, 1][size >= FAST_LINK_MIN_SIZE]
+
+    if link_speed >= SLOW_LINK_SPEED:
+        return 6
+
+    return 9
+
+
+class CCompressor:
+    """
+    Compress messages with zlib and a preset dictionary of typical
+    payloads, so small namespace and stack payloads compress as well.
+    Keeps the estimated link speed and byte counts of a session.
+    """
+
+    def __init__(self):
+        self.m_lock = threading.Lock()
+
+        self.m_link_speed = None
+
+        self.m_n_sent = 0
+        self.m_n_sent_compressed = 0
+        self.m_sent_bytes = 0
+        self.m_sent_wire_bytes = 0
+
+        self.m_n_received = 0
+        self.m_n_received_compressed = 0
+        self.m_received_bytes = 0
+        self.m_received_wire_bytes = 0
+
+
+    def get_link_speed(self):
+        return self.m_link_speed
+
+
+    def record_transfer(self, size, duration):
+        """
+        Update the link speed estimate with a call that transferred size
+        bytes in duration seconds.
+        """
+
+        if duration <= 0:
+            return
+
+        speed = size / duration
+
+        try:
+            self.m_lock.acquire()
+
+            if self.m_link_speed is None:
+                self.m_link_speed = speed
+            else:
+                self.m_link_speed = 0.7 * self.m_link_speed + 0.3 * speed
+
+        finally:
+            self.m_lock.release()
+
+
+    def compress(self, s, link_speed = None):
+        """
+        Return (fcompress, data) where data is s compressed if that is
+        worth it on a link of link_speed bytes per second, or of the
+        estimated speed if link_speed is None.
+        """
+
+        if link_speed is None:
+            link_speed = self.m_link_speed
+
+        level = calc_compression_level(len(s), link_speed)
+
+        fcompress = False
+        data = s
+
+        if level > 0:
+            c = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 8, zlib.Z_DEFAULT_STRATEGY, COMPRESSION_DICT)
+            _s = c.compress(s) + c.flush()
+
+            if len(_s) < len(s) * COMPRESSION_MAX_RATIO:
+                fcompress = True
+                data = _s
+
+        try:
+            self.m_lock.acquire()
+
+            self.m_n_sent += 1
+            self.m_n_sent_compressed += fcompress
+            self.m_sent_bytes += len(s)
+            self.m_sent_wire_bytes += len(data)
+
+        finally:
+            self.m_lock.release()
+
+        return (fcompress, data)
+
+
+    def decompress(self, fcompress, data):
+        s = data
+
+        if fcompress:
+            d = zlib.decompressobj(zlib.MAX_WBITS, COMPRESSION_DICT)
+            s = d.decompress(data) + d.flush()
+
+        try:
+            self.m_lock.acquire()
+
+            self.m_n_received += 1
+            self.m_n_received_compressed += fcompress
+            self.m_received_bytes += len(s)
+            self.m_received_wire_bytes += len(data)
+
+        finally:
+            self.m_lock.release()
+
+        return s
+
+
+    def get_stats(self):
+        """
+        Return (link_speed, sent, received) where sent and received are
+        (messages, compressed messages, bytes, bytes after compression).
+        """
+
+        try:
+            self.m_lock.acquire()
+
+            sent = (self.m_n_sent, self.m_n_sent_compressed, self.m_sent_bytes, self.m_sent_wire_bytes)
+            received = (self.m_n_received, self.m_n_received_compressed, self.m_received_bytes, self.m_received_wire_bytes)
+
+            return (self.m_link_speed, sent, received)
+
+        finally:
+            self.m_lock.release()
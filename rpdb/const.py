@@ -265,19 +265,54 @@ TIMEOUT_FIVE_MINUTES = 5 * 60.0
 VERSION = (1, 5, 0, 0, 'Tychod')
 RPDB_TITLE = "RPDB 1.5.0 - Tychod"
 RPDB_VERSION = "RPDB_1_5_0"
-RPDB_COMPATIBILITY_VERSION = "RPDB_1_5_0"
+#
+# Version of the protocol between clients and debuggees. Peers with
+# another version are rejected with BadVersion before anything is
+# authenticated, so it must change whenever the key derivation or the
+# format of the messages changes.
+#
+RPDB_COMPATIBILITY_VERSION = "RPDB_1_5_1"
 PYTHON_TAB_WIDTH = 4
 RPDB_SETTINGS_FOLDER = '.rpdb2_settings'
 RPDB_PWD_FOLDER = os.path.join(RPDB_SETTINGS_FOLDER, 'passwords')
 RPDB_BPL_FOLDER = os.path.join(RPDB_SETTINGS_FOLDER, 'breakpoints')
+RPDB_REGISTRY_FOLDER = os.path.join(RPDB_SETTINGS_FOLDER, 'servers')
+REGISTRY_FILE_EXT = '.srv'
+SOCKET_FILE_EXT = '.sock'
+RPDB_KEYS_FILE = os.path.join(RPDB_SETTINGS_FOLDER, 'keys')
+RPDB_BREAKINFO_FOLDER = os.path.join(RPDB_SETTINGS_FOLDER, 'breakinfo')
+BREAKINFO_FILE_EXT = '.json'
+MAX_BREAKINFO_FILES = 1000
+BREAKINFO_CACHE_MIN_SIZE = 16384
 RPDB_BPL_FOLDER_NT = 'rpdb2_breakpoints'
 MAX_BPL_FILES = 100
+MAX_CODE_CONTEXTS = 10000
+PROFILE_INTERVAL = 10.0
+MAX_PROFILE_DEPTH = 128
+MAX_PROFILE_NODES = 100000
+MAX_LOG_RECORDS = 10000
+SOURCE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+PATH_CACHE_NEGATIVE_TTL = 5.0
+LOG_RECORDS_BATCH = 1000
+LOG_VALUE_LENGTH = 128
 EMBEDDED_SYNC_THRESHOLD = 1.0
 EMBEDDED_SYNC_TIMEOUT = 5.0
 HEARTBEAT_TIMEOUT = 16
 IDLE_MAX_RATE = 2.0
 PING_TIMEOUT = 4.0
 LOCAL_TIMEOUT = 1.0
+RPC_POOL_SIZE = 4
+RPC_POOL_IDLE_TIMEOUT = 30.0
+RPC_POOL_RETRIES = 1
+RPC_KEEPALIVE_TIMEOUT = 60.0
+EVENT_PUSH_WINDOW = 100
+SNAPSHOT_REPR_LIMIT = 128
+COMPRESSION_MIN_SIZE = 256
+COMPRESSION_MAX_RATIO = 0.9
+FAST_LINK_MIN_SIZE = 65536
+FAST_LINK_SPEED = 32 * 1024 * 1024
+SLOW_LINK_SPEED = 1024 * 1024
+LINK_SAMPLE_MIN_SIZE = 16384
 COMMUNICATION_RETRIES = 5
 WAIT_FOR_BREAK_TIMEOUT = 3.0
 SHUTDOWN_TIMEOUT = 4.0
@@ -380,6 +415,8 @@ STR_ACCESS_DENIED = "While attempting to find debuggee, at least one debuggee de
 STR_ACCESS_DENIED2 = "Communication is denied because of un-matching passwords."
 STR_ENCRYPTION_EXPECTED = "While attempting to find debuggee, at least one debuggee denied connection since it accepts encrypted connections only."
 STR_ENCRYPTION_EXPECTED2 = "Debuggee will only talk over an encrypted channel."
+STR_ENCRYPTION_DOWNGRADE = "Warning: The debuggee does not accept cipher %s, falling back to cipher %s."
+STR_ENCRYPTION_DOWNGRADE_NONE = "Warning: The debuggee does not accept cipher %s, falling back to an unencrypted channel."
 STR_DECRYPTION_FAILURE = "Bad packet was received by the debuggee."
 STR_DEBUGGEE_NO_ENCRYPTION = "Debuggee does not support encrypted mode. Either install the python-crypto package on the debuggee machine or allow unencrypted connections."
 STR_RANDOM_PASSWORD = "Password has been set to a random password."
@@ -421,12 +458,16 @@ STR_ACTIVE_THREADS = """List of active threads known to the debugger:
 -----------------------------------------------"""
 STR_BREAKPOINTS_LIST = """List of breakpoints:
 
- Id  State      Line  Filename-Scope-Condition-Encoding
+ Id  State      Line    Hits  Filename-Scope-Condition-Encoding
 ------------------------------------------------------------------------------"""
-STR_BREAKPOINTS_TEMPLATE = """ %2d  %-8s  %5d  %s
-                      %s
-                      %s
-                      %s"""
+STR_BREAKPOINTS_TEMPLATE = """ %2d  %-8s  %5d  %6d  %s
+                              %s
+                              %s
+                              %s"""
+STR_BREAKPOINT_FILTER = "[ignore %d, every %d, probability %g]"
+STR_LOGPOINT = "log: %s"
+STR_LOG_RECORD = "%s.%03d log %d, tid %d, line %d: %s"
+STR_LOG_RECORDS_DROPPED = "%d logpoint records were dropped since the log buffer was full."
 STR_ENCRYPTION_SUPPORT_ERROR = "Encryption is not supported since the python-crypto package was not found. Either install the python-crypto package or allow unencrypted connections."
 STR_PASSWORD_NOT_SET = 'Password is not set.'
 STR_PASSWORD_SET = 'Password is set to: "%s"'
@@ -443,6 +484,19 @@ STR_SYNCHRONICITY_MODE = 'The synchronicity mode is set to: %s'
 STR_BREAKONEXIT_MODE = 'The break-on-exit mode is set to: %s'
 STR_TRAP_MODE = 'Trap unhandled exceptions mode is set to: %s'
 STR_TRAP_MODE_SET = "Trap unhandled exceptions mode was set to: %s."
+STR_TRACE_FILTER = 'Trace filter rules (the last matching rule wins):'
+STR_TRACE_FILTER_EMPTY = 'No trace filter rules are set, all code is traced.'
+STR_THREAD_FILTER = 'Traced threads: %s'
+STR_THREAD_FILTER_ALL = 'All threads are traced.'
+STR_STATE_UNTRACED = 'untraced'
+STR_PROFILER_STATE = 'Profiler is %s, interval %g ms, %d samples (%d dropped).'
+STR_PROFILER_RUNNING = 'running'
+STR_PROFILER_STOPPED = 'stopped'
+STR_PROFILE_SAVED = "Profile was saved to '%s'."
+STR_COMPRESSION_STATS = 'Sent %d messages, %d of them compressed, %d bytes as %d bytes (%d%% saved).\nReceived %d messages, %d of them compressed, %d bytes as %d bytes (%d%% saved).'
+STR_COMPRESSION_LINK_SPEED = 'Measured link speed: %s.'
+STR_COMPRESSION_LINK_UNKNOWN = 'not measured yet'
+STR_CODE_CACHE_STATS = 'Code contexts: %(size)d of at most %(max_size)d.\nHits: %(hits)d, misses: %(misses)d, evictions: %(evictions)d, releases: %(releases)d.'
 STR_FORK_MODE = "Fork mode is set to: %s, %s."
 STR_FORK_MODE_SET = "Fork mode was set to: %s, %s."
 STR_LOCAL_NAMESPACE_WARNING = 'Debugger modifications to the original bindings of the local namespace of this frame will be committed before the execution of the next statement of the frame. Any code using these variables executed before that point will see the original values.'
@@ -483,6 +537,7 @@ DICT_KEY_STACK = 'stack'
 DICT_KEY_CODE_LIST = 'code_list'
 DICT_KEY_CURRENT_TID = 'current tid'
 DICT_KEY_BROKEN = 'broken'
+DICT_KEY_TRACED = 'traced'
 DICT_KEY_BREAKPOINTS = 'breakpoints'
 DICT_KEY_LINES = 'lines'
 DICT_KEY_FILENAME = 'filename'
@@ -497,6 +552,17 @@ DICT_KEY_TYPE = 'type'
 DICT_KEY_SUBNODES = 'subnodes'
 DICT_KEY_N_SUBNODES = 'n_subnodes'
 DICT_KEY_ERROR = 'error'
+DICT_KEY_SPEC = 'spec'
+DICT_KEY_MAX_DEPTH = 'max_depth'
+DICT_KEY_NLINES = 'nlines'
+DICT_KEY_EXPR_LIST = 'expr_list'
+DICT_KEY_FILTER_LEVEL = 'filter_level'
+DICT_KEY_REPR_LIMIT = 'repr_limit'
+DICT_KEY_FRAME_INDEX = 'frame_index'
+DICT_KEY_EXCEPTION = 'exception'
+DICT_KEY_SOURCE = 'source'
+DICT_KEY_THREADS = 'threads'
+DICT_KEY_NAMESPACE = 'namespace'
 BREAKPOINTS_FILE_EXT = '.bpl'
 PYTHON_FILE_EXTENSION = '.py'
 PYTHONW_FILE_EXTENSION = '.pyw'
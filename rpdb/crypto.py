@@ -1,28 +1,319 @@
+import hashlib
 import hmac
+import json
+import os
 import pickle
 import random
 import threading
 import time
-import zlib
 
 try:
     from Crypto.Cipher import DES
 except ImportError:
     pass
 
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    pass
+
+try:
+    from Crypto.Cipher import ChaCha20_Poly1305
+except ImportError:
+    pass
+
 from rpdb.compat import _md5, base64_encodestring, base64_decodestring
+from rpdb.compression import CCompressor
+from rpdb.const import RPDB_KEYS_FILE, POSIX
 from rpdb.exceptions import EncryptionExpected, EncryptionNotSupported, DecryptionFailure, AuthenticationFailure, \
     AuthenticationBadData, AuthenticationBadIndex
-from rpdb.utils import is_unicode, as_bytes, as_unicode, print_debug_exception
+from rpdb.utils import is_unicode, as_bytes, as_unicode, print_debug, print_debug_exception
 
 INDEX_TABLE_SIZE = 100
 
+#
+# Ciphers of encrypted messages. The fencrypt argument of pack_message()
+# and unpack_message() is one of these or False, and True stands for
+# the legacy CIPHER_DES_CBC which signs messages with HMAC-MD5 and
+# encrypts them with single DES in CBC mode.
+#
+# The AEAD ciphers encrypt and authenticate in one pass with a key
+# derived from the password key and a random session salt of the
+# sender. An AEAD message is the salt, the nonce, the ciphertext and
+# the tag. The salt and the compression flag are authenticated as
+# associated data. Messages carry no separate digest.
+#
+CIPHER_DES_CBC = 1
+CIPHER_AES_GCM = 2
+CIPHER_CHACHA20_POLY1305 = 3
+
+#
+# Ciphers in order of preference.
+#
+CIPHERS = [CIPHER_AES_GCM, CIPHER_CHACHA20_POLY1305, CIPHER_DES_CBC]
+
+CIPHER_NAMES = {
+    CIPHER_DES_CBC: 'DES-CBC',
+    CIPHER_AES_GCM: 'AES-GCM',
+    CIPHER_CHACHA20_POLY1305: 'ChaCha20-Poly1305'
+    }
+
+AEAD_KEY_LABEL = as_bytes('rpdb2 aead key')
+AEAD_SALT_SIZE = 16
+AEAD_NONCE_SIZE = 12
+AEAD_TAG_SIZE = 16
+AEAD_DIGEST = as_unicode('')
+MAX_SESSION_KEYS = 256
+
+#
+# Derivation of the key from the password. Both sides must derive the
+# same key before they can authenticate anything, so the parameters are
+# part of the protocol. They are also part of the id of a key in the key
+# cache, so keys derived with other parameters are not used.
+#
+# Ids of cached keys are keyed with a random secret of the user, which
+# is kept in its own file, so the key cache alone is no fast way to
+# check a guessed password.
+#
+KDF_NAME = 'pbkdf2_hmac_sha256'
+KDF_HASH = 'sha256'
+KDF_SALT = as_bytes('rpdb2 password key')
+KDF_ITERATIONS = 2 ** 18
+MAX_CACHED_KEYS = 16
+KEY_SECRET_EXT = '.secret'
+KEY_SECRET_SIZE = 32
+
+
+def is_cipher_supported(cipher):
+    if cipher == CIPHER_DES_CBC:
+        return 'DES' in globals()
+
+    if cipher == CIPHER_AES_GCM:
+        return 'AES' in globals() and hasattr(AES, 'MODE_GCM')
+
+    if cipher == CIPHER_CHACHA20_POLY1305:
+        return 'ChaCha20_Poly1305' in globals()
+
+    return False
+
+
+def get_supported_ciphers():
+    return [c for c in CIPHERS if is_cipher_supported(c)]
+
+
 def is_encryption_supported():
     """
     Is the Crypto module imported/available.
     """
 
-    return 'DES' in globals()
+    return len(get_supported_ciphers()) > 0
+
+
+def calc_key_cache_path():
+    """
+    Calc the path of the key cache:
+    '~/.rpdb2_settings/keys'
+    """
+
+    home = os.path.expanduser('~')
+    return os.path.join(home, RPDB_KEYS_FILE)
+
+
+def calc_key_id(_rpdb2_pwd, secret):
+    s = '%s:%d:' % (KDF_NAME, KDF_ITERATIONS)
+    return hmac.new(secret, as_bytes(s) + KDF_SALT + as_bytes(_rpdb2_pwd), hashlib.sha256).hexdigest()
+
+
+def read_private_file(path, mode = 'r'):
+    """
+    Return the content of a file only its owner may access, or None if
+    it does not exist or its permissions are unsafe.
+    """
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+
+    except EnvironmentError:
+        return None
+
+    try:
+        st = os.fstat(fd)
+        if st.st_uid != os.getuid() or st.st_mode & int('077', 8):
+            print_debug('Ignoring %s with unsafe permissions.' % path)
+            return None
+
+        f = os.fdopen(fd, mode)
+        fd = None
+
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    except EnvironmentError:
+        return None
+
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def load_key_secret(path = None):
+    """
+    Return (secret, fcreated) where secret is the secret of the ids of
+    the key cache at path, created if it does not exist yet, or None if
+    it is not available.
+    """
+
+    if os.name != POSIX:
+        return (None, False)
+
+    if path is None:
+        path = calc_key_cache_path()
+
+    secret_path = path + KEY_SECRET_EXT
+
+    secret = read_private_file(secret_path, 'rb')
+    if secret is not None:
+        return ([secret, None][len(secret) != KEY_SECRET_SIZE], False)
+
+    if os.path.exists(secret_path):
+        return (None, False)
+
+    secret = os.urandom(KEY_SECRET_SIZE)
+
+    try:
+        folder = os.path.dirname(secret_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder, int('0700', 8))
+
+        fd = os.open(secret_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, int('0600', 8))
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(secret)
+        finally:
+            f.close()
+
+    except EnvironmentError:
+        #
+        # Another process may have created the secret in the meantime.
+        #
+        secret = read_private_file(secret_path, 'rb')
+        if secret is None or len(secret) != KEY_SECRET_SIZE:
+            return (None, False)
+
+        return (secret, False)
+
+    return (secret, True)
+
+
+def load_key_cache(path = None):
+    """
+    Return the key cache, a dict of hex keys by their id, or an empty
+    dict if it does not exist or anyone but its owner may access it.
+    The cache is only kept on Posix systems.
+    """
+
+    if os.name != POSIX:
+        return {}
+
+    if path is None:
+        path = calc_key_cache_path()
+
+    s = read_private_file(path)
+    if s is None:
+        return {}
+
+    try:
+        cache = json.loads(s)
+    except ValueError:
+        return {}
+
+    if not isinstance(cache, dict):
+        return {}
+
+    return cache
+
+
+def save_key_cache(cache, path = None):
+    if os.name != POSIX:
+        return
+
+    if path is None:
+        path = calc_key_cache_path()
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+
+    try:
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder, int('0700', 8))
+
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, int('0600', 8))
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(cache, f)
+        finally:
+            f.close()
+
+        os.replace(tmp_path, path)
+
+    except EnvironmentError:
+        print_debug_exception()
+
+        try:
+            os.remove(tmp_path)
+        except EnvironmentError:
+            pass
+
+
+def derive_key(_rpdb2_pwd, path = None):
+    """
+    Derive the key of a password, or take it from the key cache where
+    it was stored by an earlier derivation in any process of the user.
+    """
+
+    (secret, fcreated) = load_key_secret(path)
+    if secret is None:
+        return hashlib.pbkdf2_hmac(KDF_HASH, as_bytes(_rpdb2_pwd), KDF_SALT, KDF_ITERATIONS)
+
+    key_id = calc_key_id(_rpdb2_pwd, secret)
+
+    #
+    # Ids in a cache older than the secret can not be matched, and
+    # they may be plain hashes of passwords, so the cache is dropped.
+    #
+    cache = [load_key_cache(path), {}][fcreated]
+    if key_id in cache:
+        try:
+            return bytes.fromhex(cache[key_id])
+        except (TypeError, ValueError):
+            pass
+
+    key = hashlib.pbkdf2_hmac(KDF_HASH, as_bytes(_rpdb2_pwd), KDF_SALT, KDF_ITERATIONS)
+
+    #
+    # The oldest keys are dropped first.
+    #
+    cache.pop(key_id, None)
+    while len(cache) >= MAX_CACHED_KEYS:
+        del cache[next(iter(cache))]
+
+    cache[key_id] = key.hex()
+    save_key_cache(cache, path)
+
+    return key
+
+
+def is_aead_cipher(cipher):
+    return cipher in [CIPHER_AES_GCM, CIPHER_CHACHA20_POLY1305]
+
+
+def new_aead_cipher(cipher, key, nonce):
+    if cipher == CIPHER_AES_GCM:
+        return AES.new(key, AES.MODE_GCM, nonce = nonce, mac_len = AEAD_TAG_SIZE)
+
+    return ChaCha20_Poly1305.new(key = key, nonce = nonce)
 
 class CCrypto:
     """
@@ -53,6 +344,16 @@ class CCrypto:
         self.m_index_table_size = INDEX_TABLE_SIZE
         self.m_max_index = 0
 
+        #
+        # Key of the AEAD messages this instance sends, and keys of
+        # the peers it received AEAD messages from, by their salt.
+        #
+        self.m_session_salt = os.urandom(AEAD_SALT_SIZE)
+        self.m_session_key = self.__calc_session_key(self.m_session_salt)
+        self.m_session_keys = {}
+
+        self.m_compressor = CCompressor()
+
 
     def __calc_key(self, _rpdb2_pwd):
         """
@@ -63,26 +364,43 @@ class CCrypto:
         if _rpdb2_pwd in CCrypto.m_keys:
             return CCrypto.m_keys[_rpdb2_pwd]
 
-        key = as_bytes(_rpdb2_pwd)
-        suffix = key[:16]
-
-        d = hmac.new(key, digestmod = _md5)
-
         #
-        # The following loop takes around a second to complete
-        # and should strengthen the password by ~12 bits.
+        # The derivation strengthens the password by ~18 bits.
         # a good password is ~30 bits strong so we are looking
-        # at ~42 bits strong key
+        # at ~48 bits strong key
         #
-        for i in range(2 ** 12):
-            d.update((key + suffix) * 16)
-            key = d.digest()
+        key = derive_key(_rpdb2_pwd)
 
         CCrypto.m_keys[_rpdb2_pwd] = key
 
         return key
 
 
+    def __calc_session_key(self, salt):
+        return hmac.new(self.m_key, AEAD_KEY_LABEL + salt, digestmod = hashlib.sha256).digest()
+
+
+    def __get_session_key(self, salt):
+        try:
+            self.m_lock.acquire()
+
+            key = self.m_session_keys.get(salt, None)
+            if key is None:
+                if len(self.m_session_keys) >= MAX_SESSION_KEYS:
+                    self.m_session_keys.clear()
+
+                key = self.m_session_keys[salt] = self.__calc_session_key(salt)
+
+            return key
+
+        finally:
+            self.m_lock.release()
+
+
+    def get_compressor(self):
+        return self.m_compressor
+
+
     def set_index(self, i, anchor):
         try:
             self.m_lock.acquire()
@@ -104,58 +422,126 @@ class CCrypto:
         Return signed/encrypted string.
         """
 
+        (fcompress, digest, s) = self.pack_message(args, fencrypt)
+
+        s = base64_encodestring(s)
+        u = as_unicode(s)
+
+        return (fcompress, digest, u)
+
+
+    def undo_crypto(self, fencrypt, fcompress, digest, msg, fVerifyIndex = True):
+        """
+        Take crypto string, verify its signature and decrypt it, if
+        needed.
+        """
+
+        s = as_bytes(msg)
+        s = base64_decodestring(s)
+
+        return self.unpack_message(fencrypt, fcompress, digest, s, fVerifyIndex)
+
+
+    def pack_message(self, args, fencrypt, link_speed = None):
+        """
+        Sign args and possibly compress and encrypt.
+        Return the signed/encrypted bytes, without text encoding, for
+        transports that can carry binary data.
+        The compression level depends on link_speed, the speed of the
+        link to the receiver in bytes per second, or on the estimated
+        speed if it is None, see get_compressor().
+        """
+
         if not fencrypt and not self.m_fAllowUnencrypted:
             raise EncryptionExpected
 
-        if fencrypt and not is_encryption_supported():
+        if fencrypt and not is_cipher_supported(fencrypt):
             raise EncryptionNotSupported
 
-        (digest, s) = self.__sign(args)
-
-        fcompress = False
+        if is_aead_cipher(fencrypt):
+            (digest, s) = (AEAD_DIGEST, self.__pickle(args))
+        else:
+            (digest, s) = self.__sign(args)
 
-        if len(s) > 50000:
-            _s = zlib.compress(s)
+        (fcompress, s) = self.m_compressor.compress(s, link_speed)
 
-            if len(_s) < len(s) * 0.4:
-                s = _s
-                fcompress = True
+        if is_aead_cipher(fencrypt):
+            s = self.__encrypt_aead(fencrypt, fcompress, s)
 
-        if fencrypt:
+        elif fencrypt:
             s = self.__encrypt(s)
 
-        s = base64_encodestring(s)
-        u = as_unicode(s)
+        return (fcompress, digest, s)
 
-        return (fcompress, digest, u)
 
-
-    def undo_crypto(self, fencrypt, fcompress, digest, msg, fVerifyIndex = True):
+    def unpack_message(self, fencrypt, fcompress, digest, s, fVerifyIndex = True):
         """
-        Take crypto string, verify its signature and decrypt it, if
-        needed.
+        Take bytes created by pack_message(), verify their signature and
+        decrypt them, if needed.
         """
 
         if not fencrypt and not self.m_fAllowUnencrypted:
             raise EncryptionExpected
 
-        if fencrypt and not is_encryption_supported():
+        if fencrypt and not is_cipher_supported(fencrypt):
             raise EncryptionNotSupported
 
-        s = as_bytes(msg)
-        s = base64_decodestring(s)
+        if is_aead_cipher(fencrypt):
+            s = self.__decrypt_aead(fencrypt, fcompress, s)
+
+            s = self.m_compressor.decompress(fcompress, s)
+
+            args, id = self.__unpickle(s, fVerifyIndex)
+
+            return (args, id)
 
         if fencrypt:
             s = self.__decrypt(s)
 
-        if fcompress:
-            s = zlib.decompress(s)
+        s = self.m_compressor.decompress(fcompress, s)
 
         args, id = self.__verify_signature(digest, s, fVerifyIndex)
 
         return (args, id)
 
 
+    def __encrypt_aead(self, cipher, fcompress, s):
+        nonce = os.urandom(AEAD_NONCE_SIZE)
+
+        c = new_aead_cipher(cipher, self.m_session_key, nonce)
+        c.update(self.m_session_salt + bytes([int(fcompress)]))
+        (r, tag) = c.encrypt_and_digest(s)
+
+        return b''.join([self.m_session_salt, nonce, r, tag])
+
+
+    def __decrypt_aead(self, cipher, fcompress, s):
+        try:
+            if len(s) < AEAD_SALT_SIZE + AEAD_NONCE_SIZE + AEAD_TAG_SIZE:
+                raise ValueError
+
+            view = memoryview(s)
+            salt = bytes(view[:AEAD_SALT_SIZE])
+            nonce = bytes(view[AEAD_SALT_SIZE:AEAD_SALT_SIZE + AEAD_NONCE_SIZE])
+
+            c = new_aead_cipher(cipher, self.__get_session_key(salt), nonce)
+            c.update(salt + bytes([int(fcompress)]))
+
+        except:
+            self.__wait_a_little()
+            raise DecryptionFailure
+
+        try:
+            return c.decrypt_and_verify(view[AEAD_SALT_SIZE + AEAD_NONCE_SIZE:-AEAD_TAG_SIZE], bytes(view[-AEAD_TAG_SIZE:]))
+
+        except ValueError:
+            #
+            # The tag does not match, as with a different password.
+            #
+            self.__wait_a_little()
+            raise AuthenticationFailure
+
+
     def __encrypt(self, s):
         s_padded = s + as_bytes('\x00') * (DES.block_size - (len(s) % DES.block_size))
 
@@ -183,12 +569,16 @@ class CCrypto:
             raise DecryptionFailure
 
 
-    def __sign(self, args):
+    def __pickle(self, args):
         i = self.__get_next_index()
         pack = (self.m_index_anchor_ex, i, self.m_rid, args)
 
+        return pickle.dumps(pack, 2)
+
+
+    def __sign(self, args):
         #print_debug('***** 1' + repr(args)[:50])
-        s = pickle.dumps(pack, 2)
+        s = self.__pickle(args)
         #print_debug('***** 2' + repr(args)[:50])
 
         h = hmac.new(self.m_key, s, digestmod = _md5)
@@ -223,9 +613,6 @@ class CCrypto:
                 self.__wait_a_little()
                 raise AuthenticationFailure
 
-            pack = pickle.loads(s)
-            (anchor, i, id, args) = pack
-
         except AuthenticationFailure:
             raise
 
@@ -234,6 +621,23 @@ class CCrypto:
             self.__wait_a_little()
             raise AuthenticationBadData
 
+        return self.__unpickle(s, fVerifyIndex)
+
+
+    def __unpickle(self, s, fVerifyIndex):
+        """
+        Load a message whose authenticity was verified.
+        """
+
+        try:
+            pack = pickle.loads(s)
+            (anchor, i, id, args) = pack
+
+        except:
+            print_debug_exception()
+            self.__wait_a_little()
+            raise AuthenticationBadData
+
         if fVerifyIndex:
             self.__verify_index(anchor, i, id)
 
@@ -2,16 +2,25 @@ import copyreg as copy_reg
 import errno
 import socket
 import sys
+import threading
 import time
 import os
 
 from rpdb.const import LOOPBACK, get_interface_compatibility_version, get_version, SERVER_PORT_RANGE_START, \
     SERVER_PORT_RANGE_LENGTH, PYTHON_EXT_LIST
-from rpdb.exceptions import CException, BadVersion, AuthenticationBadIndex, NotAttached
+from rpdb.exceptions import CException, BadVersion, AuthenticationBadIndex, NotAttached, BadArgument
 from rpdb.utils import is_unicode, thread_set_daemon, print_debug, thread_is_alive, as_unicode, print_debug_exception, \
-    generate_rid, _getpid, calcURL
+    generate_rid, _getpid, calcURL, as_bytes
+from rpdb.compat import base64_encodestring, base64_decodestring
 from rpdb.crypto import CCrypto
-from rpdb.rpc import CThread, CPwdServerProxy, CLocalTimeoutTransport, CWorkQueue, CXMLRPCServer
+from rpdb.event_stream import CEventPusher
+from rpdb.events import CEventState
+from rpdb.registry import register_server, unregister_server, calc_socket_path, create_registry_folder, \
+    get_process_start_time, RECORD_PID, RECORD_PORT, RECORD_RID, RECORD_FILENAME, RECORD_STATE, RECORD_TIME, \
+    RECORD_EMBEDDED, RECORD_SOCKET, RECORD_START_TIME
+from rpdb.rpc import CThread, CPwdServerProxy, CLocalTimeoutTransport, CWorkQueue, CXMLRPCServer, CUnixXMLRPCServer, \
+    FRAMES_MAGIC, FRAME_COMPRESSED, FRAME_ERROR, FRAME_PUSH, MAX_UNAUTHENTICATED_FRAME_SIZE, send_frame, recv_frame, \
+    recv_exact, calc_frame_flags, calc_frame_encryption, calc_frame_error, set_nodelay
 
 def GetSocketError(e):
     if (not isinstance(e.args, tuple)) or (len(e.args) == 0):
@@ -49,8 +58,17 @@ class CIOServer:
         self.m_stop = False
         self.m_server = None
 
+        self.m_unix_server = None
+        self.m_unix_thread = None
+        self.m_socket_path = None
+
         self.m_work_queue = None
 
+        #
+        # Context of the framed call a worker thread is dispatching.
+        #
+        self.m_frames_context = threading.local()
+
 
     def shutdown(self):
         self.stop()
@@ -86,6 +104,16 @@ class CIOServer:
 
         self.m_thread = None
 
+        #
+        # The record outlives the socket so a killed process leaves no
+        # socket file without a record, see list_servers().
+        #
+        self.__stop_unix_server()
+
+        self.unregister_server()
+
+        self.m_server.close_connections()
+
         self.m_work_queue.shutdown()
 
         #try:
@@ -100,20 +128,111 @@ class CIOServer:
         return 0
 
 
+    def export_multicall(self, calls):
+        """
+        Call the methods in calls, a list of (name, params) tuples, in
+        order and return the list of their (result, exception) tuples.
+        """
+
+        rl = []
+
+        for (name, params) in calls:
+            r = None
+            e = None
+
+            try:
+                if name == 'multicall':
+                    raise BadArgument
+
+                try:
+                    func = getattr(self, 'export_' + name)
+                except AttributeError:
+                    raise Exception('method "%s" is not supported' % ('export_' + name))
+
+                r = func(*params)
+
+            except Exception:
+                e = sys.exc_info()[1]
+                print_debug_exception()
+
+            rl.append((r, e))
+
+        return rl
+
+
     def run(self):
         if self.m_server == None:
             (self.m_port, self.m_server) = self.__StartXMLRPCServer()
 
         self.m_work_queue = CWorkQueue()
         self.m_server.register_function(self.dispatcher_method)
+        self.m_server.m_frames_handler = self.handle_frames
+        self.m_server.allow_connections()
+
+        if self.m_unix_server is None:
+            self.__start_unix_server()
+
+        self.register_server()
 
         while not self.m_stop:
             self.m_server.handle_request()
 
 
+    def __start_unix_server(self):
+        """
+        Also listen on a Unix domain socket in the registry folder, which
+        local clients prefer over TCP. The socket is named after the pid
+        since the server is restarted in the child after a fork.
+        """
+
+        if not hasattr(socket, 'AF_UNIX'):
+            return
+
+        path = calc_socket_path(_getpid())
+
+        try:
+            create_registry_folder()
+            server = CUnixXMLRPCServer(path, logRequests = False)
+
+        except (socket.error, EnvironmentError):
+            print_debug_exception()
+            return
+
+        server.register_function(self.dispatcher_method)
+        server.m_frames_handler = self.handle_frames
+
+        self.m_unix_server = server
+        self.m_socket_path = path
+
+        self.m_unix_thread = CThread(name = 'ioserver_unix', target = server.serve_forever, shutdown = self.shutdown)
+        thread_set_daemon(self.m_unix_thread, True)
+        self.m_unix_thread.start()
+
+
+    def __stop_unix_server(self):
+        server = self.m_unix_server
+        if server is None:
+            return
+
+        if thread_is_alive(self.m_unix_thread):
+            server.shutdown()
+
+        server.close_connections()
+        server.server_close()
+
+        try:
+            os.remove(self.m_socket_path)
+        except EnvironmentError:
+            pass
+
+        self.m_unix_server = None
+        self.m_unix_thread = None
+        self.m_socket_path = None
+
+
     def dispatcher_method(self, rpdb_version, fencrypt, fcompress, digest, msg):
         """
-        Process RPC call.
+        Process XML-RPC call.
         """
 
         #print_debug('dispatcher_method() called with: %s, %s, %s, %s' % (rpdb_version, fencrypt, digest, msg[:100]))
@@ -121,24 +240,179 @@ class CIOServer:
         if rpdb_version != as_unicode(get_interface_compatibility_version()):
             raise BadVersion(as_unicode(get_version()))
 
+        s = base64_decodestring(as_bytes(msg))
+        (fcompress, digest, s) = self.__dispatch(fencrypt, fcompress, digest, s)
+
+        return (fencrypt, fcompress, digest, as_unicode(base64_encodestring(s)))
+
+
+    def handle_frames(self, sock, client_address):
+        """
+        Serve a persistent framed RPC connection until it is closed.
+        Each call is dispatched on the work queue so calls that block,
+        such as wait_for_event(), do not hold up the calls behind them.
+        """
+
+        send_lock = threading.Lock()
+
+        try:
+            sock.settimeout(None)
+            set_nodelay(sock)
+
+            recv_exact(sock, len(FRAMES_MAGIC))
+            (call_id, flags, digest, version) = recv_frame(sock, MAX_UNAUTHENTICATED_FRAME_SIZE)
+
+            sock.sendall(FRAMES_MAGIC)
+
+            if as_unicode(version) != as_unicode(get_interface_compatibility_version()):
+                send_frame(sock, 0, FRAME_ERROR, None, as_bytes(get_version()))
+                return
+
+            send_frame(sock, 0, 0, None, as_bytes(get_interface_compatibility_version()))
+
+        except socket.error:
+            return
+
+        print_debug('Framed RPC connection from %s.' % repr(client_address))
+
+        authenticated = threading.Event()
+
+        try:
+            while not self.m_stop:
+                if authenticated.is_set():
+                    frame = recv_frame(sock)
+                    self.m_work_queue.post_work_item(target = self.__dispatch_frame, args = (sock, send_lock, frame), name = 'dispatch_frame')
+                    continue
+
+                #
+                # Until a frame of the connection is authenticated, frames
+                # are small and dispatched one at a time, so a peer that
+                # does not know the password can not make the debuggee
+                # hold large amounts of data.
+                #
+                frame = recv_frame(sock, MAX_UNAUTHENTICATED_FRAME_SIZE)
+                released = threading.Event()
+                self.m_work_queue.post_work_item(target = self.__dispatch_frame, args = (sock, send_lock, frame, authenticated, released), name = 'dispatch_frame')
+
+                while not released.wait(1.0):
+                    if self.m_stop:
+                        return
+
+        except socket.error:
+            pass
+
+
+    def __dispatch_frame(self, sock, send_lock, frame, authenticated = None, released = None):
+        (call_id, flags, digest, payload) = frame
+
+        fencrypt = calc_frame_encryption(flags)
+        self.m_frames_context.frame = (sock, send_lock, call_id, fencrypt)
+        self.m_frames_context.authenticated = (authenticated, released)
+
+        try:
+            (fcompress, digest, payload) = self.__dispatch(fencrypt, bool(flags & FRAME_COMPRESSED), digest, payload)
+            flags = calc_frame_flags(fencrypt, fcompress)
+
+        except Exception:
+            e = sys.exc_info()[1]
+            (flags, digest, payload) = (FRAME_ERROR, None, calc_frame_error(e))
+
+        self.m_frames_context.frame = None
+        self.m_frames_context.authenticated = None
+
+        try:
+            try:
+                send_lock.acquire()
+                send_frame(sock, call_id, flags, digest, payload)
+
+            finally:
+                send_lock.release()
+
+        except socket.error:
+            pass
+
+        if released is not None:
+            released.set()
+
+
+    def __set_authenticated(self):
+        """
+        Let the framed connection of the call being dispatched, if any,
+        read full size frames once the call is authenticated.
+        """
+
+        events = getattr(self.m_frames_context, 'authenticated', None)
+        if events is None or events[0] is None:
+            return
+
+        (authenticated, released) = events
+        authenticated.set()
+        released.set()
+
+
+    def __push_frame(self, sock, send_lock, call_id, fencrypt, link_speed, r):
+        max_index = self.m_crypto.get_max_index()
+        (fcompress, digest, payload) = self.m_crypto.pack_message((max_index, r, None), fencrypt, link_speed)
+
+        try:
+            send_lock.acquire()
+            send_frame(sock, call_id, calc_frame_flags(fencrypt, fcompress) | FRAME_PUSH, digest, payload)
+
+        finally:
+            send_lock.release()
+
+
+    def get_push_callback(self):
+        """
+        Return a callable that pushes data to the client over the framed
+        connection of the call being dispatched, or None if the call did
+        not arrive over a framed connection. The callable raises
+        socket.error when the connection is closed.
+        """
+
+        frame = getattr(self.m_frames_context, 'frame', None)
+        if frame is None:
+            return None
+
+        (sock, send_lock, call_id, fencrypt) = frame
+        link_speed = self.m_frames_context.link_speed
+
+        return lambda r: self.__push_frame(sock, send_lock, call_id, fencrypt, link_speed, r)
+
+
+    def __dispatch(self, fencrypt, fcompress, digest, s):
+        """
+        Process RPC call given as bytes created by CCrypto.pack_message()
+        and return the result in the same form.
+        """
+
+        t0 = time.time()
+
         try:
             try:
                 #
                 # Decrypt parameters.
                 #
-                ((name, __params, target_rid), client_id) = self.m_crypto.undo_crypto(fencrypt, fcompress, digest, msg)
+                ((name, __params, target_rid, link_speed), client_id) = self.m_crypto.unpack_message(fencrypt, fcompress, digest, s)
+                self.m_frames_context.link_speed = link_speed
+                self.__set_authenticated()
 
             except AuthenticationBadIndex:
                 e = sys.exc_info()[1]
                 #print_debug_exception()
 
                 #
-                # Notify the caller on the expected index.
+                # The signature was verified before the index.
+                #
+                self.__set_authenticated()
+
+                #
+                # Notify the caller on the expected index. The time spent
+                # includes the delay on authentication failures.
                 #
                 max_index = self.m_crypto.get_max_index()
-                args = (max_index, None, e)
-                (fcompress, digest, msg) = self.m_crypto.do_crypto(args, fencrypt)
-                return (fencrypt, fcompress, digest, msg)
+                args = (max_index, None, e, time.time() - t0)
+                return self.m_crypto.pack_message(args, fencrypt)
 
             r = None
             e = None
@@ -146,7 +420,7 @@ class CIOServer:
             try:
                 #
                 # We are forcing the 'export_' prefix on methods that are
-                # callable through XML-RPC to prevent potential security
+                # callable through RPC to prevent potential security
                 # problems
                 #
                 func = getattr(self, 'export_' + name)
@@ -170,12 +444,12 @@ class CIOServer:
                 e = _e
 
             #
-            # Send the encrypted result.
+            # Send the encrypted result, with the time spent in the call
+            # which the caller leaves out of its link speed estimate.
             #
             max_index = self.m_crypto.get_max_index()
-            args = (max_index, r, e)
-            (fcompress, digest, msg) = self.m_crypto.do_crypto(args, fencrypt)
-            return (fencrypt, fcompress, digest, msg)
+            args = (max_index, r, e, time.time() - t0)
+            return self.m_crypto.pack_message(args, fencrypt, link_speed)
 
         except:
             print_debug_exception()
@@ -201,8 +475,14 @@ class CIOServer:
                 if GetSocketError(e) != errno.EADDRINUSE:
                     raise
 
+                #
+                # Beyond the port range servers can only be found in the
+                # local registry.
+                #
                 if port >= SERVER_PORT_RANGE_START + SERVER_PORT_RANGE_LENGTH - 1:
-                    raise
+                    print_debug('Port range is exhausted, listening on a port chosen by the system.')
+                    server = CXMLRPCServer((host, 0), logRequests = False)
+                    return (server.server_address[1], server)
 
                 port += 1
                 continue
@@ -212,6 +492,14 @@ class CIOServer:
         pass
 
 
+    def register_server(self):
+        pass
+
+
+    def unregister_server(self):
+        pass
+
+
 class CDebuggeeServer(CIOServer):
     """
     The debuggee XML RPC server class.
@@ -232,8 +520,119 @@ class CDebuggeeServer(CIOServer):
         self.m_debugger = debugger
         self.m_rid = rid
 
+        self.m_event_pusher = CEventPusher(debugger.wait_for_event, debugger.notify_event_waiters)
+
+        self.m_fregistered = False
+        self.m_start_time = None
+        self.m_record_lock = threading.Lock()
+        self.m_record_state = None
+        self.m_frecord_pending = False
+
+        event_type_dict = {CEventState: {}}
+        debugger.m_event_dispatcher.register_callback(self.__on_state, event_type_dict, fSingleUse = False)
+
+
+    def register_server(self):
+        """
+        Add this debuggee to the local registry so clients on this host
+        find it without scanning ports.
+        """
+
+        try:
+            self.m_record_lock.acquire()
+
+            #
+            # The server is restarted in the child after a fork.
+            #
+            self.m_pid = _getpid()
+            self.m_start_time = get_process_start_time(self.m_pid)
+            self.m_fregistered = True
+
+            self.__write_record()
+
+        finally:
+            self.m_record_lock.release()
+
+
+    def unregister_server(self):
+        try:
+            self.m_record_lock.acquire()
+
+            if not self.m_fregistered:
+                return
+
+            self.m_fregistered = False
+            unregister_server(self.m_pid)
+
+        finally:
+            self.m_record_lock.release()
+
+
+    def __write_record(self):
+        self.m_record_state = as_unicode(self.m_debugger.get_state())
+
+        record = {
+            RECORD_PID: self.m_pid,
+            RECORD_PORT: self.m_port,
+            RECORD_RID: self.m_rid,
+            RECORD_FILENAME: as_unicode(self.m_filename, sys.getfilesystemencoding()),
+            RECORD_STATE: self.m_record_state,
+            RECORD_TIME: self.m_time,
+            RECORD_EMBEDDED: self.m_debugger.is_embedded(),
+            RECORD_SOCKET: self.m_socket_path,
+            RECORD_START_TIME: self.m_start_time
+            }
+
+        register_server(record)
+
+
+    def __on_state(self, event):
+        """
+        State events fire on every step and break, in the thread that
+        breaks, so the record is updated later by a worker thread and
+        pending updates are merged.
+        """
+
+        if not self.m_fregistered or self.m_pid != _getpid():
+            return
+
+        if event.m_state == self.m_record_state:
+            return
+
+        try:
+            self.m_record_lock.acquire()
+
+            if self.m_frecord_pending:
+                return
+
+            self.m_frecord_pending = True
+
+        finally:
+            self.m_record_lock.release()
+
+        self.m_work_queue.post_work_item(target = self.__update_record, args = (), name = 'update_record')
+
+
+    def __update_record(self):
+        try:
+            self.m_record_lock.acquire()
+
+            self.m_frecord_pending = False
+
+            if not self.m_fregistered:
+                return
+
+            if as_unicode(self.m_debugger.get_state()) == self.m_record_state:
+                return
+
+            self.__write_record()
+
+        finally:
+            self.m_record_lock.release()
+
 
     def shutdown(self):
+        self.m_event_pusher.stop()
         CIOServer.shutdown(self)
 
 
@@ -253,7 +652,7 @@ class CDebuggeeServer(CIOServer):
         state = self.m_debugger.get_state()
         fembedded = self.m_debugger.is_embedded()
 
-        si = CServerInfo(age, self.m_port, self.m_pid, self.m_filename, self.m_rid, state, fembedded)
+        si = CServerInfo(age, self.m_port, self.m_pid, self.m_filename, self.m_rid, state, fembedded, self.m_socket_path)
         return si
 
 
@@ -267,11 +666,28 @@ class CDebuggeeServer(CIOServer):
         return (new_event_index, s)
 
 
+    def export_subscribe_events(self, event_index):
+        push = self.get_push_callback()
+        if push is None:
+            raise CException('Pushing events requires a framed connection.')
+
+        return self.m_event_pusher.subscribe(push, event_index)
+
+
+    def export_ack_events(self, subscription_id, event_index):
+        return self.m_event_pusher.ack(subscription_id, event_index)
+
+
     def export_set_breakpoint(self, filename, scope, lineno, fEnabled, expr, frame_index, fException, encoding):
         self.m_debugger.set_breakpoint(filename, scope, lineno, fEnabled, expr, frame_index, fException, encoding)
         return 0
 
 
+    def export_set_logpoint(self, filename, scope, lineno, fEnabled, expr, log_exprs, frame_index, fException, encoding):
+        self.m_debugger.set_breakpoint(filename, scope, lineno, fEnabled, expr, frame_index, fException, encoding, log_exprs)
+        return 0
+
+
     def export_disable_breakpoint(self, id_list, fAll):
         self.m_debugger.disable_breakpoint(id_list, fAll)
         return 0
@@ -282,6 +698,11 @@ class CDebuggeeServer(CIOServer):
         return 0
 
 
+    def export_set_breakpoint_filter(self, id_list, fAll, ignore_count, every, probability):
+        self.m_debugger.set_breakpoint_filter(id_list, fAll, ignore_count, every, probability)
+        return 0
+
+
     def export_delete_breakpoint(self, id_list, fAll):
         self.m_debugger.delete_breakpoint(id_list, fAll)
         return 0
@@ -347,6 +768,16 @@ class CDebuggeeServer(CIOServer):
         return r
 
 
+    def export_get_break_snapshot(self, spec, frame_index, fException, encoding, fraw):
+        r = self.m_debugger.get_break_snapshot(spec, frame_index, fException, encoding, fraw)
+        return r
+
+
+    def export_set_break_snapshot(self, spec, encoding, fraw):
+        self.m_debugger.set_break_snapshot(spec, encoding, fraw)
+        return 0
+
+
     def export_set_thread(self, tid):
         self.m_debugger.set_thread(tid)
         return 0
@@ -385,6 +816,42 @@ class CDebuggeeServer(CIOServer):
         return 0
 
 
+    def export_set_trace_filter(self, rules):
+        self.m_debugger.set_trace_filter(rules)
+        return 0
+
+
+    def export_get_trace_filter(self):
+        return self.m_debugger.get_trace_filter()
+
+
+    def export_get_code_cache_stats(self):
+        return self.m_debugger.get_code_cache_stats()
+
+
+    def export_set_thread_filter(self, names, tids):
+        self.m_debugger.set_thread_filter(names, tids)
+        return 0
+
+
+    def export_get_thread_filter(self):
+        return self.m_debugger.get_thread_filter()
+
+
+    def export_start_profiler(self, interval):
+        self.m_debugger.start_profiler(interval)
+        return 0
+
+
+    def export_stop_profiler(self):
+        self.m_debugger.stop_profiler()
+        return 0
+
+
+    def export_get_profile(self):
+        return self.m_debugger.get_profile()
+
+
     def export_is_unhandled_exception(self):
         return self.m_debugger.is_unhandled_exception()
 
@@ -405,7 +872,7 @@ class CDebuggeeServer(CIOServer):
 
 
 class CServerInfo(object):
-    def __init__(self, age, port, pid, filename, rid, state, fembedded):
+    def __init__(self, age, port, pid, filename, rid, state, fembedded, socket_path = None):
         assert(is_unicode(rid))
 
         self.m_age = age
@@ -416,6 +883,7 @@ class CServerInfo(object):
         self.m_rid = rid
         self.m_state = as_unicode(state)
         self.m_fembedded = fembedded
+        self.m_socket_path = socket_path
 
 
     def __reduce__(self):
@@ -0,0 +1,200 @@
+import sys
+import threading
+import time
+
+from rpdb.const import PING_TIMEOUT, HEARTBEAT_TIMEOUT, EVENT_PUSH_WINDOW
+from rpdb.rpc import CThread
+from rpdb.utils import print_debug, print_debug_exception
+
+
+class CEventSubscriber:
+    def __init__(self, push, event_index):
+        self.m_push = push
+
+        #
+        # Index of the last event pushed and of the last event the
+        # client acknowledged.
+        #
+        self.m_sent = event_index
+        self.m_acked = event_index
+        self.m_t_ack = time.time()
+
+
+    def get_room(self):
+        return EVENT_PUSH_WINDOW - (self.m_sent - self.m_acked)
+
+
+class CEventPusher:
+    """
+    Push the events of the debuggee to subscribed clients.
+
+    A single debugger thread waits for events on behalf of all
+    subscribers and pushes to each one the events above the index it
+    was last sent, so idle clients do not poll. A subscriber is sent at
+    most EVENT_PUSH_WINDOW events it did not acknowledge, and is dropped
+    when it does not acknowledge for HEARTBEAT_TIMEOUT seconds. Clients
+    resume a broken stream by subscribing again with the index of the
+    last event they processed.
+    """
+
+    def __init__(self, wait_for_event, notify):
+        self.m_wait_for_event = wait_for_event
+        self.m_notify = notify
+
+        self.m_lock = threading.Lock()
+        self.m_subscribers = {}
+        self.m_id = 0
+
+        self.m_thread = None
+        self.m_fstop = False
+
+
+    def subscribe(self, push, event_index):
+        """
+        Push events above event_index by calling push((event_index, events))
+        where event_index is the index of the last event in events.
+        push() raises socket.error when the client is gone.
+        Return the subscription id.
+        """
+
+        try:
+            self.m_lock.acquire()
+
+            self.m_id += 1
+            self.m_subscribers[self.m_id] = CEventSubscriber(push, event_index)
+
+            if self.m_thread is None:
+                self.m_fstop = False
+
+                t = CThread(name = '__event_pusher', target = self.__run, shutdown = self.stop)
+                t.start()
+
+                #
+                # Threads are not started while the debugger shuts down.
+                #
+                if t.m_fstarted:
+                    self.m_thread = t
+
+            sid = self.m_id
+
+        finally:
+            self.m_lock.release()
+
+        print_debug('Event subscription %d from index %d.' % (sid, event_index))
+
+        self.m_notify()
+        return sid
+
+
+    def ack(self, sid, event_index):
+        """
+        Acknowledge the events up to event_index.
+        Return False if the subscription is unknown or was dropped.
+        """
+
+        try:
+            self.m_lock.acquire()
+
+            subscriber = self.m_subscribers.get(sid, None)
+            if subscriber is None:
+                return False
+
+            subscriber.m_acked = max(subscriber.m_acked, min(event_index, subscriber.m_sent))
+            subscriber.m_t_ack = time.time()
+
+        finally:
+            self.m_lock.release()
+
+        self.m_notify()
+        return True
+
+
+    def unsubscribe(self, sid):
+        try:
+            self.m_lock.acquire()
+            self.m_subscribers.pop(sid, None)
+
+        finally:
+            self.m_lock.release()
+
+
+    def stop(self):
+        self.m_fstop = True
+
+        t = self.m_thread
+        if t is None:
+            return
+
+        self.m_notify()
+        if t is not threading.current_thread():
+            t.join()
+
+
+    def __get_ready_subscribers(self):
+        """
+        Drop subscribers that stopped acknowledging and return the ones
+        that may be sent events.
+        """
+
+        t = time.time()
+
+        try:
+            self.m_lock.acquire()
+
+            for (sid, subscriber) in list(self.m_subscribers.items()):
+                if t > subscriber.m_t_ack + HEARTBEAT_TIMEOUT:
+                    print_debug('Event subscription %d timed out.' % sid)
+                    del self.m_subscribers[sid]
+
+            if self.m_fstop or len(self.m_subscribers) == 0:
+                self.m_thread = None
+                return None
+
+            return [(sid, s) for (sid, s) in self.m_subscribers.items() if s.get_room() > 0]
+
+        finally:
+            self.m_lock.release()
+
+
+    def __run(self):
+        while True:
+            ready = self.__get_ready_subscribers()
+            if ready is None:
+                return
+
+            #
+            # With no subscriber ready the wait only ends on timeout or
+            # notification, such as an acknowledgement.
+            #
+            index = min([s.m_sent for (sid, s) in ready] + [sys.maxsize])
+
+            try:
+                (event_index, sel) = self.m_wait_for_event(PING_TIMEOUT, index, max(1, len(self.m_subscribers)))
+            except:
+                print_debug_exception()
+                time.sleep(PING_TIMEOUT)
+                continue
+
+            for (sid, subscriber) in ready:
+                self.__push(sid, subscriber, event_index, sel)
+
+
+    def __push(self, sid, subscriber, event_index, sel):
+        if event_index <= subscriber.m_sent:
+            return
+
+        #
+        # Events that dropped out of the event queue are skipped.
+        #
+        base = event_index - len(sel)
+        start = max(subscriber.m_sent, base)
+        events = sel[start - base:][:subscriber.get_room()]
+
+        subscriber.m_sent = start + len(events)
+
+        try:
+            subscriber.m_push((subscriber.m_sent, events))
+
+        except:
+            print_debug('Event subscription %d closed.' % sid)
+            self.unsubscribe(sid)
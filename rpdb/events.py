@@ -28,6 +28,7 @@ def breakpoint_copy(bp):
 
     _bp.m_filename = as_unicode(bp.m_filename, sys.getfilesystemencoding())
     _bp.m_code = None
+    _bp.m_log_codes = None
 
     return _bp
 
@@ -81,6 +82,17 @@ class CEventSignalIntercepted(CEvent):
         self.m_signame = calc_signame(signum)
 
 
+class CEventLogRecords(CEvent):
+    """
+    A batch of logpoint records. Each record is a (timestamp, thread id,
+    breakpoint id, line number, values) tuple.
+    """
+
+    def __init__(self, records, dropped):
+        self.m_records = records
+        self.m_dropped = dropped
+
+
 class CEventSignalException(CEvent):
     """
     This event is sent when the handler of a previously intercepted signal
@@ -275,6 +287,16 @@ class CEventStack(CEvent):
         self.m_stack = stack
 
 
+class CEventBreakSnapshot(CEvent):
+    """
+    Snapshot of the current thread requested with set_break_snapshot().
+    Sent after a break, with the stack and thread events.
+    """
+
+    def __init__(self, snapshot):
+        self.m_snapshot = snapshot
+
+
 class CEventStackFrameChange(CEvent):
     """
     Stack frame has changed.
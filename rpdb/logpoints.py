@@ -0,0 +1,72 @@
+import collections
+import threading
+
+from rpdb.const import MAX_LOG_RECORDS
+
+
+class CLogBuffer:
+    """
+    Bounded ring buffer of logpoint records.
+
+    A record is a (timestamp, thread id, breakpoint id, line number,
+    values) tuple where values is a list of repr-limited strings.
+    When the buffer is full the oldest records are dropped and counted.
+    """
+
+    def __init__(self, max_records = MAX_LOG_RECORDS):
+        self.m_records = collections.deque(maxlen = max_records)
+        self.m_lock = threading.Lock()
+        self.m_dropped = 0
+        self.m_notify = None
+
+
+    def set_notify(self, notify):
+        """
+        Set a callable that is called when a record is added to an
+        empty buffer.
+        """
+
+        self.m_notify = notify
+
+
+    def append(self, record):
+        try:
+            self.m_lock.acquire()
+
+            fempty = (len(self.m_records) == 0)
+
+            if len(self.m_records) == self.m_records.maxlen:
+                self.m_dropped += 1
+
+            self.m_records.append(record)
+
+        finally:
+            self.m_lock.release()
+
+        if fempty and self.m_notify is not None:
+            self.m_notify()
+
+
+    def pop_records(self, max_count):
+        """
+        Remove and return up to max_count of the oldest records and the
+        number of records dropped since the last call.
+        """
+
+        try:
+            self.m_lock.acquire()
+
+            n = min(max_count, len(self.m_records))
+            records = [self.m_records.popleft() for i in range(n)]
+
+            dropped = self.m_dropped
+            self.m_dropped = 0
+
+            return (records, dropped)
+
+        finally:
+            self.m_lock.release()
+
+
+    def __len__(self):
+        return len(self.m_records)
@@ -0,0 +1,207 @@
+import _thread as thread
+import sys
+import threading
+
+from rpdb.code_cache import CWeakKeyCache
+from rpdb.const import PROFILE_INTERVAL, MAX_PROFILE_DEPTH, MAX_PROFILE_NODES
+from rpdb.exceptions import BadArgument
+from rpdb.rpc import CThread
+from rpdb.utils import print_debug, print_debug_exception
+
+COLLAPSED_SEP = ';'
+TRUNCATED_LABEL = '[truncated]'
+
+
+class CSamplingProfiler:
+    """
+    Timer driven sampling profiler.
+
+    A debugger thread, which is not traced, walks the stacks of all other
+    threads with sys._current_frames() every interval and aggregates them
+    into a trie of frame labels. The profile is returned as collapsed
+    stacks, the text format of flamegraph.pl and compatible tools.
+    """
+
+    def __init__(self, calc_frame_path):
+        self.m_calc_frame_path = calc_frame_path
+
+        self.m_lock = threading.Lock()
+        self.m_thread = None
+        self.m_stop_event = threading.Event()
+        self.m_interval = PROFILE_INTERVAL
+
+        self.m_labels = CWeakKeyCache()
+
+        self.__reset()
+
+
+    def __reset(self):
+        #
+        # A trie node maps a frame label to a [samples, children] pair,
+        # where samples counts the stacks that end at that node.
+        #
+        self.m_root = {}
+        self.m_n_nodes = 0
+        self.m_n_samples = 0
+        self.m_n_dropped = 0
+
+
+    def is_running(self):
+        return self.m_thread is not None
+
+
+    def start(self, interval):
+        """
+        Start a new profile, sampling every interval milliseconds.
+        """
+
+        try:
+            interval = float(interval)
+        except (TypeError, ValueError):
+            raise BadArgument
+
+        if interval < 1:
+            raise BadArgument
+
+        self.stop()
+
+        try:
+            self.m_lock.acquire()
+
+            self.__reset()
+            self.m_interval = interval
+            self.m_stop_event.clear()
+
+            self.m_thread = CThread(name = '__profiler', target = self.__run, shutdown = self.stop)
+            self.m_thread.start()
+
+        finally:
+            self.m_lock.release()
+
+        print_debug('Profiler started, interval = %g ms' % interval)
+
+
+    def stop(self):
+        t = self.m_thread
+        if t is None:
+            return
+
+        self.m_stop_event.set()
+        if t is not threading.current_thread():
+            t.join()
+
+        self.m_thread = None
+
+        print_debug('Profiler stopped, %d samples' % self.m_n_samples)
+
+
+    def __run(self):
+        while not self.m_stop_event.wait(self.m_interval / 1000.0):
+            try:
+                self.sample()
+            except:
+                print_debug_exception()
+
+
+    def sample(self):
+        """
+        Add the current stack of every thread except debugger threads.
+        """
+
+        #
+        # Finished debugger threads stay in CThread.m_threads while they
+        # are referenced, and their idents may be reused by user threads.
+        #
+        skip = [thread.get_ident()]
+        for w in list(CThread.m_threads.values()):
+            t = w()
+            if t is not None and t.is_alive():
+                skip.append(t.ident)
+
+        frames = sys._current_frames()
+
+        try:
+            self.m_lock.acquire()
+
+            for (tid, frame) in frames.items():
+                if not tid in skip:
+                    self.__add_stack(frame)
+
+        finally:
+            self.m_lock.release()
+
+
+    def __get_label(self, frame):
+        code = frame.f_code
+
+        try:
+            return self.m_labels[code]
+        except KeyError:
+            path = self.m_calc_frame_path(frame)
+            label = ('%s (%s:%d)' % (code.co_name, path, code.co_firstlineno)).replace(COLLAPSED_SEP, ',')
+            return self.m_labels.setdefault(code, label)
+
+
+    def __add_stack(self, frame):
+        labels = []
+        while frame is not None:
+            if len(labels) == MAX_PROFILE_DEPTH:
+                labels.append(TRUNCATED_LABEL)
+                break
+
+            labels.append(self.__get_label(frame))
+            frame = frame.f_back
+
+        labels.reverse()
+
+        node = self.m_root
+        entry = None
+
+        for label in labels:
+            entry = node.get(label, None)
+            if entry is None:
+                if self.m_n_nodes >= MAX_PROFILE_NODES:
+                    self.m_n_dropped += 1
+                    return
+
+                entry = node[label] = [0, {}]
+                self.m_n_nodes += 1
+
+            node = entry[1]
+
+        if entry is not None:
+            entry[0] += 1
+            self.m_n_samples += 1
+
+
+    def get_profile(self):
+        """
+        Return (fRunning, interval, samples, dropped, stacks) where stacks
+        is a list of collapsed stack lines: frames from the outermost to
+        the innermost separated by ';', followed by a sample count.
+        """
+
+        try:
+            self.m_lock.acquire()
+
+            stacks = []
+            pending = [([], self.m_root)]
+
+            while pending:
+                (path, node) = pending.pop()
+
+                for (label, (samples, children)) in node.items():
+                    _path = path + [label]
+
+                    if samples > 0:
+                        stacks.append('%s %d' % (COLLAPSED_SEP.join(_path), samples))
+
+                    if children:
+                        pending.append((_path, children))
+
+            stacks.sort()
+
+            return (self.is_running(), self.m_interval, self.m_n_samples, self.m_n_dropped, stacks)
+
+        finally:
+            self.m_lock.release()
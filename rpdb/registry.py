@@ -0,0 +1,275 @@
+import errno
+import json
+import os
+import sys
+
+from rpdb.const import RPDB_REGISTRY_FOLDER, REGISTRY_FILE_EXT, SOCKET_FILE_EXT, POSIX
+from rpdb.utils import print_debug, print_debug_exception
+
+#
+# Keys of a server record.
+#
+RECORD_PID = 'pid'
+RECORD_PORT = 'port'
+RECORD_RID = 'rid'
+RECORD_FILENAME = 'filename'
+RECORD_STATE = 'state'
+RECORD_TIME = 'time'
+RECORD_EMBEDDED = 'fembedded'
+RECORD_SOCKET = 'socket'
+RECORD_START_TIME = 'start_time'
+
+RECORD_KEYS = [RECORD_PID, RECORD_PORT, RECORD_RID, RECORD_FILENAME, RECORD_STATE, RECORD_TIME, RECORD_EMBEDDED,
+    RECORD_SOCKET, RECORD_START_TIME]
+
+
+def calc_registry_folder():
+    """
+    Calc the folder of the server registry:
+    '~/.rpdb2_settings/servers'
+    """
+
+    home = os.path.expanduser('~')
+    return os.path.join(home, RPDB_REGISTRY_FOLDER)
+
+
+def calc_record_path(pid, folder = None):
+    if folder is None:
+        folder = calc_registry_folder()
+
+    return os.path.join(folder, '%d%s' % (pid, REGISTRY_FILE_EXT))
+
+
+def calc_socket_path(pid, folder = None):
+    """
+    Calc the path of the Unix domain socket debuggee pid listens on.
+    """
+
+    if folder is None:
+        folder = calc_registry_folder()
+
+    return os.path.join(folder, '%d%s' % (pid, SOCKET_FILE_EXT))
+
+
+def create_registry_folder(folder = None):
+    """
+    Create the registry folder if needed. Only its owner may access it,
+    which also guards the sockets in it.
+    """
+
+    if folder is None:
+        folder = calc_registry_folder()
+
+    if not os.path.exists(folder):
+        os.makedirs(folder, int('0700', 8))
+
+
+def is_pid_alive(pid):
+    """
+    Return False if process pid is known not to exist.
+    """
+
+    if os.name == POSIX:
+        try:
+            os.kill(pid, 0)
+            return True
+
+        except OSError:
+            e = sys.exc_info()[1]
+            return e.errno != errno.ESRCH
+
+    try:
+        import ctypes
+
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+
+        try:
+            code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return True
+
+            return code.value == STILL_ACTIVE
+
+        finally:
+            kernel32.CloseHandle(handle)
+
+    except:
+        return True
+
+
+def get_process_start_time(pid):
+    """
+    Return a value that tells when process pid started, which tells it
+    apart from a later process with the same pid, or None if unknown.
+    """
+
+    if sys.platform.startswith('linux'):
+        try:
+            f = open('/proc/%d/stat' % pid, 'r')
+            try:
+                stat = f.read()
+            finally:
+                f.close()
+
+            #
+            # The start time is the 22nd field, counted in clock ticks
+            # since boot. The command name in the 2nd field is enclosed in
+            # parentheses and may contain spaces.
+            #
+            return int(stat[stat.rindex(')') + 1:].split()[19])
+
+        except (EnvironmentError, ValueError, IndexError):
+            return None
+
+    if os.name == POSIX:
+        return None
+
+    try:
+        import ctypes
+
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return None
+
+        try:
+            times = [ctypes.c_ulonglong() for i in range(4)]
+            if not kernel32.GetProcessTimes(handle, *[ctypes.byref(t) for t in times]):
+                return None
+
+            return times[0].value
+
+        finally:
+            kernel32.CloseHandle(handle)
+
+    except:
+        return None
+
+
+def is_stale_record(record):
+    """
+    Return True if the process of the record no longer exists, or if
+    its pid was reused by another process.
+    """
+
+    pid = record[RECORD_PID]
+
+    if not is_pid_alive(pid):
+        return True
+
+    start_time = record[RECORD_START_TIME]
+    if start_time is None:
+        return False
+
+    return get_process_start_time(pid) not in [None, start_time]
+
+
+def register_server(record, folder = None):
+    """
+    Write the record of a debuggee to the registry, replacing its
+    previous record. A record is a dictionary with the RECORD_* keys.
+    """
+
+    if folder is None:
+        folder = calc_registry_folder()
+
+    path = calc_record_path(record[RECORD_PID], folder)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+
+    try:
+        create_registry_folder(folder)
+
+        f = open(tmp_path, 'w')
+        try:
+            json.dump(record, f)
+        finally:
+            f.close()
+
+        #
+        # Readers never see a partial record.
+        #
+        os.replace(tmp_path, path)
+
+    except EnvironmentError:
+        print_debug_exception()
+
+        try:
+            os.remove(tmp_path)
+        except EnvironmentError:
+            pass
+
+
+def unregister_server(pid, folder = None):
+    try:
+        os.remove(calc_record_path(pid, folder))
+    except EnvironmentError:
+        pass
+
+
+def list_servers(folder = None):
+    """
+    Return the records of the debuggees in the registry.
+    Records of processes that no longer exist, or whose pid was reused,
+    are removed.
+    """
+
+    if folder is None:
+        folder = calc_registry_folder()
+
+    try:
+        names = os.listdir(folder)
+    except EnvironmentError:
+        return []
+
+    rl = []
+
+    for name in names:
+        if not name.endswith(REGISTRY_FILE_EXT):
+            continue
+
+        path = os.path.join(folder, name)
+
+        try:
+            f = open(path, 'r')
+            try:
+                record = json.load(f)
+            finally:
+                f.close()
+
+            if sorted(record.keys()) != sorted(RECORD_KEYS):
+                raise ValueError
+
+        except EnvironmentError:
+            continue
+
+        except (AttributeError, ValueError):
+            print_debug('Removing malformed server record %s.' % path)
+
+            try:
+                os.remove(path)
+            except EnvironmentError:
+                pass
+
+            continue
+
+        if is_stale_record(record):
+            print_debug('Removing stale server record %s.' % path)
+            unregister_server(record[RECORD_PID], folder)
+
+            try:
+                os.remove(calc_socket_path(record[RECORD_PID], folder))
+            except EnvironmentError:
+                pass
+            continue
+
+        rl.append(record)
+
+    return rl
@@ -1,27 +1,67 @@
+import binascii
 import os
 import socket
 import socketserver as SocketServer
+import struct
 import sys
 import threading
 import time
 import weakref
 from http import client as httplib
+from urllib.parse import urlsplit
 from xmlrpc import client as xmlrpclib, server as SimpleXMLRPCServer
 
-from rpdb.const import SHUTDOWN_TIMEOUT, POSIX, get_interface_compatibility_version, PING_TIMEOUT, LOCAL_TIMEOUT
-from rpdb.crypto import is_encryption_supported
+from rpdb.const import SHUTDOWN_TIMEOUT, POSIX, get_interface_compatibility_version, PING_TIMEOUT, LOCAL_TIMEOUT, \
+    RPC_POOL_SIZE, RPC_POOL_IDLE_TIMEOUT, RPC_POOL_RETRIES, RPC_KEEPALIVE_TIMEOUT, LINK_SAMPLE_MIN_SIZE, \
+    STR_ENCRYPTION_DOWNGRADE, STR_ENCRYPTION_DOWNGRADE_NONE
+from rpdb.crypto import is_encryption_supported, get_supported_ciphers, CIPHER_DES_CBC, CIPHER_NAMES
 from rpdb.exceptions import AuthenticationBadIndex, BadVersion, EncryptionExpected, EncryptionNotSupported, \
-    DecryptionFailure, AuthenticationBadData, AuthenticationFailure, CConnectionException
+    DecryptionFailure, AuthenticationBadData, AuthenticationFailure, CConnectionException, CException
 from rpdb.repr import class_name
 from rpdb.state_manager import lock_notify_all
 from rpdb.utils import print_debug, safe_wait, thread_set_name, current_thread, print_debug_exception, as_unicode, _print, \
-                        _getpid
+                        _getpid, as_bytes, thread_set_daemon
 import rpdb.globals
 
 N_WORK_QUEUE_THREADS = 8
 
 DISPACHER_METHOD = 'dispatcher_method'
 
+#
+# Framed RPC protocol.
+#
+# A client opens the connection with FRAMES_MAGIC followed by a hello
+# frame carrying its interface compatibility version. The server answers
+# with FRAMES_MAGIC and a hello frame carrying its own version, flagged
+# FRAME_ERROR if the versions differ. A server that does not know the
+# protocol answers with an HTTP error instead, and the client falls back
+# to XML-RPC.
+#
+# After the hello, every frame is a FRAME_HEADER (payload length, call id,
+# flags, raw HMAC digest) followed by the payload created by
+# CCrypto.pack_message(). Responses echo the call id of their request, so
+# calls from several threads share the connection and may complete out
+# of order. A FRAME_ERROR payload is the name of the exception class that
+# failed the call, a newline and its message. FRAME_PUSH frames are sent
+# by the server unsolicited and carry the id of the call that asked for
+# them, see CIOServer.get_push_callback(). The cipher of an encrypted
+# frame is in the FRAME_CIPHER_MASK bits, legacy DES if they are clear.
+#
+FRAMES_MAGIC = as_bytes('RPDB-FRAMES\r\n')
+FRAME_HEADER = struct.Struct('!IIB16s')
+FRAME_ENCRYPTED = 1
+FRAME_COMPRESSED = 2
+FRAME_ERROR = 4
+FRAME_PUSH = 8
+FRAME_CIPHER_MASK = 0x30
+FRAME_CIPHER_SHIFT = 4
+MAX_FRAME_SIZE = 1 << 28
+MAX_UNAUTHENTICATED_FRAME_SIZE = 1 << 20
+NO_DIGEST = as_bytes('\x00') * 16
+
+FRAME_ERRORS = dict([(e.__name__, e) for e in [EncryptionExpected, EncryptionNotSupported, DecryptionFailure,
+    AuthenticationBadData, AuthenticationFailure]])
+
 
 class CWorkQueue:
     """
@@ -174,6 +214,21 @@ def my_xmlrpclib_loads(data):
     return u.close(), u.getmethodname()
 
 
+class CXMLRPCRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
+    """
+    Modification of SimpleXMLRPCServer.SimpleXMLRPCRequestHandler that
+    keeps connections alive between requests for pooled clients, and
+    closes them when they are idle for RPC_KEEPALIVE_TIMEOUT seconds.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    timeout = RPC_KEEPALIVE_TIMEOUT
+
+
+    def log_error(self, format, *args):
+        print_debug(format % args)
+
+
 class CXMLRPCServer(CUnTracedThreadingMixIn, SimpleXMLRPCServer.SimpleXMLRPCServer):
     if os.name == POSIX:
         allow_reuse_address = True
@@ -185,6 +240,18 @@ class CXMLRPCServer(CUnTracedThreadingMixIn, SimpleXMLRPCServer.SimpleXMLRPCServ
     that uses my_xmlrpclib_loads(). Needed to prevent deadlocks.
     """
 
+    def __init__(self, addr, logRequests = True):
+        #
+        # Open connections, closed by close_connections() to release
+        # the worker threads that serve them.
+        #
+        self.m_connections = {}
+        self.m_connections_lock = threading.Lock()
+        self.m_fclosing = False
+
+        SimpleXMLRPCServer.SimpleXMLRPCServer.__init__(self, addr, requestHandler = CXMLRPCRequestHandler, logRequests = logRequests)
+
+
     def __marshaled_dispatch(self, data, dispatch_method = None):
         params, method = my_xmlrpclib_loads(data)
 
@@ -213,6 +280,68 @@ class CXMLRPCServer(CUnTracedThreadingMixIn, SimpleXMLRPCServer.SimpleXMLRPCServ
         _marshaled_dispatch = __marshaled_dispatch
 
 
+    #
+    # Handler of framed RPC connections, see CIOServer.handle_frames().
+    #
+    m_frames_handler = None
+
+
+    def finish_request(self, request, client_address):
+        try:
+            self.m_connections_lock.acquire()
+
+            if self.m_fclosing:
+                return
+
+            self.m_connections[id(request)] = request
+
+        finally:
+            self.m_connections_lock.release()
+
+        try:
+            if self.m_frames_handler is not None and is_frames_connection(request):
+                self.m_frames_handler(request, client_address)
+                return
+
+            SimpleXMLRPCServer.SimpleXMLRPCServer.finish_request(self, request, client_address)
+
+        finally:
+            try:
+                self.m_connections_lock.acquire()
+                self.m_connections.pop(id(request), None)
+
+            finally:
+                self.m_connections_lock.release()
+
+
+    def close_connections(self):
+        """
+        Shut down open connections, which breaks the threads that serve
+        them out of recv(). Connections accepted later are closed at once.
+        """
+
+        try:
+            self.m_connections_lock.acquire()
+
+            self.m_fclosing = True
+
+            connections = list(self.m_connections.values())
+            self.m_connections = {}
+
+        finally:
+            self.m_connections_lock.release()
+
+        for sock in connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+    def allow_connections(self):
+        self.m_fclosing = False
+
+
     #def server_activate(self):
     #    self.socket.listen(1)
 
@@ -226,21 +355,388 @@ class CXMLRPCServer(CUnTracedThreadingMixIn, SimpleXMLRPCServer.SimpleXMLRPCServ
         return SimpleXMLRPCServer.SimpleXMLRPCServer.handle_error(self, request, client_address)
 
 
+class CUnixXMLRPCServer(CXMLRPCServer):
+    """
+    CXMLRPCServer that listens on a Unix domain socket. Only the owner of
+    the debuggee may connect to it.
+    """
+
+    address_family = getattr(socket, 'AF_UNIX', None)
+    allow_reuse_address = False
+
+
+    def server_bind(self):
+        #
+        # A socket file left by a process that did not stop cleanly.
+        #
+        try:
+            os.remove(self.server_address)
+        except EnvironmentError:
+            pass
+
+        CXMLRPCServer.server_bind(self)
+
+        os.chmod(self.server_address, int('0600', 8))
+
+
+class FramesNotSupported(CException):
+    """
+    The server does not speak the framed RPC protocol.
+    """
+
+
+def recv_exact(sock, n):
+    """
+    Read exactly n bytes from sock.
+    Raise socket.error if the connection is closed before that.
+    """
+
+    b = bytearray(n)
+    view = memoryview(b)
+    i = 0
+
+    while i < n:
+        r = sock.recv_into(view[i:], n - i)
+        if r == 0:
+            raise socket.error('Connection closed.')
+
+        i += r
+
+    return bytes(b)
+
+
+def send_frame(sock, call_id, flags, digest, payload):
+    if digest is None:
+        digest = NO_DIGEST
+    else:
+        digest = binascii.unhexlify(as_bytes(digest))
+
+    header = FRAME_HEADER.pack(len(payload), call_id, flags, digest)
+
+    #
+    # Small payloads are joined to the header to save a system call,
+    # large ones are not to save a copy.
+    #
+    if len(payload) < 16384:
+        sock.sendall(header + payload)
+        return
+
+    sock.sendall(header)
+    sock.sendall(payload)
+
+
+def recv_frame(sock, max_size = MAX_FRAME_SIZE):
+    """
+    Return (call_id, flags, digest, payload) of the next frame.
+    Raise socket.error if the payload is larger than max_size bytes.
+    """
+
+    (length, call_id, flags, digest) = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))
+
+    if length > max_size:
+        raise socket.error('Frame of %d bytes exceeds the maximum size.' % length)
+
+    payload = recv_exact(sock, length)
+
+    if flags & FRAME_ERROR:
+        digest = None
+    else:
+        digest = as_unicode(binascii.hexlify(digest))
+
+    return (call_id, flags, digest, payload)
+
+
+def calc_frame_flags(fencrypt, fcompress):
+    flags = [0, FRAME_COMPRESSED][fcompress]
+
+    if fencrypt:
+        flags |= FRAME_ENCRYPTED | ((int(fencrypt) << FRAME_CIPHER_SHIFT) & FRAME_CIPHER_MASK)
+
+    return flags
+
+
+def calc_frame_encryption(flags):
+    """
+    Return the fencrypt argument of CCrypto.unpack_message() for a frame.
+    """
+
+    if not flags & FRAME_ENCRYPTED:
+        return False
+
+    return ((flags & FRAME_CIPHER_MASK) >> FRAME_CIPHER_SHIFT) or True
+
+
+def calc_frame_error(e):
+    return as_bytes('%s\n%s' % (type(e).__name__, e))
+
+
+def raise_frame_error(payload):
+    (name, msg) = (as_unicode(payload).split('\n', 1) + [''])[:2]
+
+    if name == BadVersion.__name__:
+        raise BadVersion(msg)
+
+    e = FRAME_ERRORS.get(name, None)
+    if e is not None:
+        raise e()
+
+    raise CException(msg)
+
+
+def set_nodelay(sock):
+    """
+    Send small frames at once. Only applies to TCP sockets.
+    """
+
+    if sock.family in [socket.AF_INET, socket.AF_INET6]:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def is_frames_connection(sock, timeout = LOCAL_TIMEOUT):
+    """
+    Check, without consuming it, if the data waiting on a new server
+    connection starts with FRAMES_MAGIC. A client which does not send
+    the whole magic within timeout seconds is served as XML-RPC.
+    """
+
+    t0 = time.time()
+    saved_timeout = sock.gettimeout()
+
+    try:
+        while True:
+            remaining = t0 + timeout - time.time()
+            if remaining <= 0:
+                return False
+
+            sock.settimeout(remaining)
+
+            try:
+                data = sock.recv(len(FRAMES_MAGIC), socket.MSG_PEEK)
+            except socket.timeout:
+                return False
+
+            if not data or not FRAMES_MAGIC.startswith(data):
+                return False
+
+            if len(data) == len(FRAMES_MAGIC):
+                return True
+
+            time.sleep(0.01)
+
+    finally:
+        sock.settimeout(saved_timeout)
+
+
+class CFramesConnection:
+    """
+    Client side of a persistent framed RPC connection.
+    Calls from several threads are multiplexed over the connection and
+    a reader thread hands each response to the thread that waits for it.
+    Frames pushed by the server are passed to push_handler as
+    (fencrypt, fcompress, digest, payload), and None when the connection
+    is closed. With path set, the connection is made to the Unix domain
+    socket at path instead of to host and port.
+    """
+
+    def __init__(self, host, port, timeout = PING_TIMEOUT, push_handler = None, path = None):
+        self.m_push_handler = push_handler
+
+        self.m_lock = threading.Lock()
+        self.m_send_lock = threading.Lock()
+
+        self.m_pending = {}
+        self.m_call_id = 0
+        self.m_fclosed = False
+
+        if path is None:
+            self.m_sock = socket.create_connection((host, port), timeout)
+        else:
+            self.m_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            if path is not None:
+                self.m_sock.settimeout(timeout)
+                self.m_sock.connect(path)
+
+            set_nodelay(self.m_sock)
+            self.__handshake()
+        except:
+            self.m_sock.close()
+            raise
+
+        self.m_sock.settimeout(None)
+
+        self.m_thread = threading.Thread(name = '__frames_reader', target = self.__reader)
+        thread_set_daemon(self.m_thread, True)
+        self.m_thread.start()
+
+
+    def __handshake(self):
+        version = as_bytes(get_interface_compatibility_version())
+
+        self.m_sock.sendall(FRAMES_MAGIC)
+        send_frame(self.m_sock, 0, 0, None, version)
+
+        try:
+            magic = recv_exact(self.m_sock, len(FRAMES_MAGIC))
+        except socket.error:
+            raise FramesNotSupported
+
+        if magic != FRAMES_MAGIC:
+            raise FramesNotSupported
+
+        (call_id, flags, digest, payload) = recv_frame(self.m_sock)
+
+        if flags & FRAME_ERROR:
+            raise BadVersion(as_unicode(payload))
+
+
+    def is_closed(self):
+        return self.m_fclosed
+
+
+    def close(self):
+        try:
+            self.m_lock.acquire()
+
+            if self.m_fclosed:
+                return
+
+            self.m_fclosed = True
+
+            for (event, response) in self.m_pending.values():
+                event.set()
+
+        finally:
+            self.m_lock.release()
+
+        try:
+            self.m_sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+        self.m_sock.close()
+
+        if self.m_push_handler is not None:
+            self.m_push_handler(None)
+
+
+    def call(self, fencrypt, fcompress, digest, payload):
+        """
+        Send a request and wait for its response.
+        Return (fencrypt, fcompress, digest, payload) of the response.
+        """
+
+        event = threading.Event()
+        response = []
+
+        try:
+            self.m_lock.acquire()
+
+            if self.m_fclosed:
+                raise socket.error('Connection closed.')
+
+            self.m_call_id += 1
+            call_id = self.m_call_id
+            self.m_pending[call_id] = (event, response)
+
+        finally:
+            self.m_lock.release()
+
+        try:
+            try:
+                self.m_send_lock.acquire()
+                send_frame(self.m_sock, call_id, calc_frame_flags(fencrypt, fcompress), digest, payload)
+
+            finally:
+                self.m_send_lock.release()
+
+        except socket.error:
+            self.close()
+            raise
+
+        event.wait()
+
+        try:
+            self.m_lock.acquire()
+            del self.m_pending[call_id]
+
+        finally:
+            self.m_lock.release()
+
+        if len(response) == 0:
+            raise socket.error('Connection closed.')
+
+        (flags, digest, payload) = response[0]
+
+        if flags & FRAME_ERROR:
+            raise_frame_error(payload)
+
+        return (calc_frame_encryption(flags), bool(flags & FRAME_COMPRESSED), digest, payload)
+
+
+    def __reader(self):
+        try:
+            while True:
+                (call_id, flags, digest, payload) = recv_frame(self.m_sock)
+
+                if flags & FRAME_PUSH:
+                    if self.m_push_handler is not None:
+                        self.m_push_handler((calc_frame_encryption(flags), bool(flags & FRAME_COMPRESSED), digest, payload))
+
+                    continue
+
+                try:
+                    self.m_lock.acquire()
+                    (event, response) = self.m_pending.get(call_id, (None, None))
+
+                finally:
+                    self.m_lock.release()
+
+                if event is None:
+                    continue
+
+                response.append((flags, digest, payload))
+                event.set()
+
+        except (socket.error, struct.error):
+            pass
+
+        except:
+            print_debug_exception()
+
+        self.close()
+
+
 class CPwdServerProxy:
     """
     Encrypted proxy to the debuggee.
-    Works by wrapping a xmlrpclib.ServerProxy object.
+    Works by wrapping a xmlrpclib.ServerProxy object, or with fFrames
+    set, a persistent framed connection when the debuggee supports it.
+    The framed connection is made to the Unix domain socket at path if
+    it is set and the debuggee accepts it.
     """
 
-    def __init__(self, crypto, uri, transport = None, target_rid = 0):
+    def __init__(self, crypto, uri, transport = None, target_rid = 0, fFrames = False, path = None):
         self.m_crypto = crypto
         self.m_proxy = xmlrpclib.ServerProxy(uri, transport)
 
         self.m_fEncryption = is_encryption_supported()
+        self.m_ciphers = get_supported_ciphers()
+        self.m_fcipher_pinned = False
         self.m_target_rid = target_rid
 
         self.m_method = getattr(self.m_proxy, DISPACHER_METHOD)
 
+        self.m_uri = uri
+        self.m_address = urlsplit(uri)
+        self.m_fFrames = fFrames
+        self.m_path = path
+        self.m_frames = None
+        self.m_frames_lock = threading.Lock()
+
+        self.m_push_handler = None
+
 
     def __set_encryption(self, fEncryption):
         self.m_fEncryption = fEncryption
@@ -250,6 +746,183 @@ class CPwdServerProxy:
         return self.m_fEncryption
 
 
+    def __get_cipher(self):
+        ciphers = self.m_ciphers
+        if not self.m_fEncryption or len(ciphers) == 0:
+            return False
+
+        return ciphers[0]
+
+
+    def __downgrade_encryption(self, fencrypt):
+        """
+        Fall back to the next supported cipher after the debuggee did not
+        accept the cipher fencrypt, or to no encryption if allowed.
+        Return False if there is nothing to fall back to.
+        """
+
+        if not fencrypt:
+            return False
+
+        #
+        # The refusal of a cipher is not authenticated. Once the debuggee
+        # has authenticated a reply with the cipher it is kept.
+        #
+        if self.m_fcipher_pinned:
+            print_debug('Ignoring refusal of cipher %d which the debuggee already accepted.' % fencrypt)
+            return False
+
+        ciphers = [c for c in self.m_ciphers if c != fencrypt]
+
+        #
+        # The legacy cipher is no safer than no encryption, so it is only
+        # fallen back to when unencrypted connections are allowed.
+        #
+        if not self.m_crypto.m_fAllowUnencrypted:
+            ciphers = [c for c in ciphers if c != CIPHER_DES_CBC]
+
+        self.m_ciphers = ciphers
+
+        if len(ciphers) > 0:
+            _print(STR_ENCRYPTION_DOWNGRADE % (CIPHER_NAMES[fencrypt], CIPHER_NAMES[ciphers[0]]), sys.stderr)
+            return True
+
+        if not self.m_crypto.m_fAllowUnencrypted:
+            return False
+
+        _print(STR_ENCRYPTION_DOWNGRADE_NONE % CIPHER_NAMES[fencrypt], sys.stderr)
+
+        self.__set_encryption(False)
+        return True
+
+
+    def set_push_handler(self, push_handler):
+        """
+        Set a callable that is passed the data the debuggee pushes over
+        the framed connection, and None when the connection is closed.
+        Must be set before the connection is made.
+        """
+
+        self.m_push_handler = push_handler
+
+
+    def __on_push(self, frame):
+        if frame is None:
+            self.m_push_handler(None)
+            return
+
+        try:
+            (fencrypt, fcompress, digest, s) = frame
+            ((max_index, r, e), id) = self.m_crypto.unpack_message(fencrypt, fcompress, digest, s, fVerifyIndex = False)
+
+        except:
+            print_debug_exception()
+            return
+
+        self.m_push_handler(r)
+
+
+    def get_frames_connection(self):
+        """
+        Return the framed connection to the debuggee, connecting if
+        needed, or None if the debuggee does not support it.
+        """
+
+        try:
+            self.m_frames_lock.acquire()
+
+            if not self.m_fFrames:
+                return None
+
+            if self.m_frames is not None and not self.m_frames.is_closed():
+                return self.m_frames
+
+            try:
+                push_handler = [None, self.__on_push][self.m_push_handler is not None]
+
+                if self.m_path is not None:
+                    try:
+                        self.m_frames = CFramesConnection(None, None, push_handler = push_handler, path = self.m_path)
+                        return self.m_frames
+
+                    except socket.error:
+                        print_debug('Failed to connect to %s, falling back to TCP.' % self.m_path)
+                        self.m_path = None
+
+                self.m_frames = CFramesConnection(self.m_address.hostname, self.m_address.port, push_handler = push_handler)
+                return self.m_frames
+
+            except FramesNotSupported:
+                print_debug('Debuggee does not support framed RPC, falling back to XML-RPC.')
+                self.m_fFrames = False
+                self.m_frames = None
+                return None
+
+        finally:
+            self.m_frames_lock.release()
+
+
+    def close(self):
+        try:
+            self.m_frames_lock.acquire()
+
+            if self.m_frames is not None:
+                self.m_frames.close()
+                self.m_frames = None
+
+        finally:
+            self.m_frames_lock.release()
+
+        self.m_proxy('close')()
+
+
+    def __call(self, args, fencrypt):
+        """
+        Send the signed/encrypted args and return the decrypted response.
+        """
+
+        frames = self.get_frames_connection()
+
+        if frames is not None:
+            (fcompress, digest, s) = self.m_crypto.pack_message(args, fencrypt)
+
+            t0 = time.time()
+            (fencrypt, fcompress, digest, _s) = frames.call(fencrypt, fcompress, digest, s)
+            t = time.time() - t0
+
+            size = len(s) + len(_s)
+            response = self.m_crypto.unpack_message(fencrypt, fcompress, digest, _s, fVerifyIndex = False)
+
+        else:
+            (fcompress, digest, msg) = self.m_crypto.do_crypto(args, fencrypt)
+
+            rpdb_version = as_unicode(get_interface_compatibility_version())
+
+            t0 = time.time()
+            r = self.m_method(rpdb_version, fencrypt, fcompress, digest, msg)
+            t = time.time() - t0
+
+            (fencrypt, fcompress, digest, _msg) = r
+            size = len(msg) + len(_msg)
+            response = self.m_crypto.undo_crypto(fencrypt, fcompress, digest, _msg, fVerifyIndex = False)
+
+        ((max_index, _r, _e, duration), id) = response
+        self.__record_transfer(size, t - duration)
+
+        return ((max_index, _r, _e), id)
+
+
+    def __record_transfer(self, size, duration):
+        """
+        Estimate the link speed from calls that transfer enough data for
+        the transfer time to outweigh the latency. duration leaves out
+        the time the debuggee spent in the call.
+        """
+
+        if size >= LINK_SAMPLE_MIN_SIZE:
+            self.m_crypto.get_compressor().record_transfer(size, duration)
+
+
     def __request(self, name, params):
         """
         Call debuggee method 'name' with parameters 'params'.
@@ -258,21 +931,23 @@ class CPwdServerProxy:
         while True:
             try:
                 #
-                # Encrypt method and params.
+                # Encrypt method and params, and decrypt response.
                 #
-                fencrypt = self.get_encryption()
-                args = (as_unicode(name), params, self.m_target_rid)
-                (fcompress, digest, msg) = self.m_crypto.do_crypto(args, fencrypt)
+                fencrypt = self.__get_cipher()
 
-                rpdb_version = as_unicode(get_interface_compatibility_version())
+                #
+                # The debuggee compresses the response for the link
+                # speed measured here.
+                #
+                link_speed = self.m_crypto.get_compressor().get_link_speed()
+                args = (as_unicode(name), params, self.m_target_rid, link_speed)
 
-                r = self.m_method(rpdb_version, fencrypt, fcompress, digest, msg)
-                (fencrypt, fcompress, digest, msg) = r
+                ((max_index, _r, _e), id) = self.__call(args, fencrypt)
 
                 #
-                # Decrypt response.
+                # The reply was authenticated with the cipher.
                 #
-                ((max_index, _r, _e), id) = self.m_crypto.undo_crypto(fencrypt, fcompress, digest, msg, fVerifyIndex = False)
+                self.m_fcipher_pinned = True
 
                 if _e is not None:
                     raise _e
@@ -283,6 +958,16 @@ class CPwdServerProxy:
                 self.m_crypto.set_index(e.m_max_index, e.m_anchor)
                 continue
 
+            except EncryptionNotSupported:
+                #
+                # Raised by a framed connection, XML-RPC reports it
+                # with a fault.
+                #
+                if not self.__downgrade_encryption(fencrypt):
+                    raise
+
+                continue
+
             except xmlrpclib.Fault:
                 fault = sys.exc_info()[1]
                 print_debug("Caught xmlrpclib.Fault: %s" % fault.faultString)
@@ -295,8 +980,7 @@ class CPwdServerProxy:
                     raise EncryptionExpected
 
                 elif class_name(EncryptionNotSupported) in fault.faultString:
-                    if self.m_crypto.m_fAllowUnencrypted:
-                        self.__set_encryption(False)
+                    if self.__downgrade_encryption(fencrypt):
                         continue
 
                     raise EncryptionNotSupported
@@ -326,6 +1010,60 @@ class CPwdServerProxy:
         return xmlrpclib._Method(self.__request, name)
 
 
+class CMultiCallResults:
+    """
+    Results of a CMultiCall batch. Indexing returns the result of a call
+    or raises the exception the call raised in the debuggee.
+    """
+
+    def __init__(self, results):
+        self.m_results = results
+
+
+    def __len__(self):
+        return len(self.m_results)
+
+
+    def __getitem__(self, i):
+        (r, e) = self.m_results[i]
+        if e is not None:
+            raise e
+
+        return r
+
+
+class CMultiCall:
+    """
+    Batch of calls to the debuggee sent in a single signed (and
+    encrypted) message. Calls are queued with the syntax of the proxy,
+    for example mc.set_breakpoint(...), and sent by calling the batch,
+    which returns a CMultiCallResults object.
+    """
+
+    def __init__(self, proxy):
+        self.m_proxy = proxy
+        self.m_calls = []
+
+
+    def __queue(self, name, params):
+        self.m_calls.append((as_unicode(name), params))
+
+
+    def __getattr__(self, name):
+        return xmlrpclib._Method(self.__queue, name)
+
+
+    def __call__(self):
+        calls = self.m_calls
+        self.m_calls = []
+
+        if len(calls) == 0:
+            return CMultiCallResults([])
+
+        rl = self.m_proxy.multicall(calls)
+        return CMultiCallResults(rl)
+
+
 class CTimeoutHTTPConnection(httplib.HTTPConnection):
     """
     Modification of httplib.HTTPConnection with timeout for sockets.
@@ -443,6 +1181,139 @@ class CLocalTransport(xmlrpclib.Transport):
         _parse_response = __parse_response
 
 
+class CPooledTransport(CLocalTransport):
+    """
+    Modification of xmlrpclib.Transport that keeps connections alive
+    across calls. A call takes an idle connection from the pool or opens
+    a new one, so calls from several threads run concurrently. Up to
+    pool_size idle connections are kept for idle_timeout seconds. A call
+    that fails on a reused connection, which the server may have closed
+    in the meantime, is retried on a new one up to retries times.
+    """
+
+    def __init__(self, pool_size = RPC_POOL_SIZE, idle_timeout = RPC_POOL_IDLE_TIMEOUT, retries = RPC_POOL_RETRIES):
+        CLocalTransport.__init__(self)
+
+        self.m_pool_size = pool_size
+        self.m_idle_timeout = idle_timeout
+        self.m_retries = retries
+
+        self.m_lock = threading.Lock()
+        self.m_idle = []
+
+
+    def __acquire(self, host):
+        """
+        Return (connection, fReused).
+        """
+
+        expired = []
+        connection = None
+
+        try:
+            self.m_lock.acquire()
+
+            t = time.time()
+
+            while len(self.m_idle) > 0:
+                (t_idle, _connection) = self.m_idle.pop()
+
+                if t - t_idle < self.m_idle_timeout:
+                    connection = _connection
+                    break
+
+                expired.append(_connection)
+
+        finally:
+            self.m_lock.release()
+
+        for c in expired:
+            c.close()
+
+        if connection is not None:
+            return (connection, True)
+
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        return (self._connection_class(chost), False)
+
+
+    def __release(self, connection):
+        try:
+            self.m_lock.acquire()
+
+            if len(self.m_idle) < self.m_pool_size:
+                self.m_idle.append((time.time(), connection))
+                return
+
+        finally:
+            self.m_lock.release()
+
+        connection.close()
+
+
+    def close(self):
+        try:
+            self.m_lock.acquire()
+
+            idle = self.m_idle
+            self.m_idle = []
+
+        finally:
+            self.m_lock.release()
+
+        for (t_idle, connection) in idle:
+            connection.close()
+
+
+    def request(self, host, handler, request_body, verbose = False):
+        attempt = 0
+
+        while True:
+            (connection, freused) = self.__acquire(host)
+
+            try:
+                r = self.__single_request(connection, host, handler, request_body, verbose)
+
+            except xmlrpclib.Fault:
+                #
+                # The response was read completely, the connection can
+                # be reused.
+                #
+                self.__release(connection)
+                raise
+
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+
+                if not freused or attempt >= self.m_retries:
+                    raise
+
+                print_debug('Reconnecting after failure of a pooled connection.')
+                attempt += 1
+                continue
+
+            except:
+                connection.close()
+                raise
+
+            self.__release(connection)
+            return r
+
+
+    def __single_request(self, connection, host, handler, request_body, verbose):
+        headers = {'Content-Type': 'text/xml', 'User-Agent': self.user_agent}
+        connection.request('POST', handler, request_body, headers)
+
+        response = connection.getresponse()
+
+        if response.status != 200:
+            response.read()
+            raise xmlrpclib.ProtocolError(host + handler, response.status, response.reason, response.msg)
+
+        self.verbose = verbose
+        return self.parse_response(response)
+
+
 class CTimeoutTransport(CLocalTransport):
     """
     Modification of xmlrpclib.Transport with timeout for sockets.
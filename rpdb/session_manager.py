@@ -2,6 +2,7 @@ import _thread as thread
 import hmac
 import os.path
 import pickle
+import queue
 import re
 import subprocess
 import random
@@ -22,7 +23,11 @@ from rpdb.utils import as_unicode, _print, print_debug, is_unicode, as_bytes, EN
 from rpdb.state_manager import CStateManager
 from rpdb.firewall_test import CFirewallTest
 from rpdb.crypto import CCrypto
-from rpdb.rpc import CPwdServerProxy, CTimeoutTransport, CLocalTransport
+from rpdb.rpc import CPwdServerProxy, CTimeoutTransport, CPooledTransport, CMultiCall
+from rpdb.snapshot import CBreakSnapshot, calc_snapshot_spec
+from rpdb.debugee import CServerInfo
+from rpdb.registry import list_servers, RECORD_PID, RECORD_PORT, RECORD_RID, RECORD_FILENAME, RECORD_STATE, RECORD_TIME, \
+    RECORD_EMBEDDED, RECORD_SOCKET
 
 
 g_fFirewallTest = True
@@ -336,6 +341,31 @@ class CSessionManager:
                                 )
 
 
+    def set_logpoint(self, filename, scope, lineno, fEnabled, expr, log_exprs):
+        """
+        Set a logpoint. A logpoint is a breakpoint that does not break.
+        When it is hit it records the values of log_exprs, which are
+        delivered in batches by CEventLogRecords events.
+
+            filename, scope, lineno, fEnabled, expr - see set_breakpoint()
+            log_exprs - A list of Python expressions to record.
+        """
+
+        filename = as_unicode(filename, fstrict = True)
+        scope = as_unicode(scope, fstrict = True)
+        expr = as_unicode(expr, fstrict = True)
+        log_exprs = [as_unicode(e, fstrict = True) for e in log_exprs]
+
+        return self.__smi.set_logpoint(
+                                filename,
+                                scope,
+                                lineno,
+                                fEnabled,
+                                expr,
+                                log_exprs
+                                )
+
+
     def disable_breakpoint(self, id_list, fAll):
         """
         Disable breakpoints
@@ -358,6 +388,25 @@ class CSessionManager:
         return self.__smi.enable_breakpoint(id_list, fAll)
 
 
+    def set_breakpoint_filter(self, id_list, fAll, ignore_count, every, probability):
+        """
+        Set the hit filters of breakpoints. The filters are checked before
+        the breakpoint expression is evaluated. Setting the filters resets
+        the hit count of the breakpoints.
+
+            id_list      - (Optional) A list of breakpoint ids.
+            fAll         - set the filters of all breakpoints regardless
+                           of id_list.
+            ignore_count - Number of hits to ignore.
+            every        - Break only on every Nth hit, 0 to break on
+                           every hit.
+            probability  - Break with this probability, 1.0 to always
+                           break.
+        """
+
+        return self.__smi.set_breakpoint_filter(id_list, fAll, ignore_count, every, probability)
+
+
     def delete_breakpoint(self, id_list, fAll):
         """
         Delete breakpoints
@@ -369,12 +418,15 @@ class CSessionManager:
         return self.__smi.delete_breakpoint(id_list, fAll)
 
 
-    def get_breakpoints(self):
+    def get_breakpoints(self, fSync = False):
         """
         Return breakpoints in a dictionary of id keys to CBreakPoint values
+
+            fSync - Fetch the breakpoints from the debuggee first, to get
+                    up to date hit counts.
         """
 
-        return self.__smi.get_breakpoints()
+        return self.__smi.get_breakpoints(fSync)
 
 
     def save_breakpoints(self, _filename = ''):
@@ -411,6 +463,97 @@ class CSessionManager:
         return self.__smi.get_trap_unhandled_exceptions()
 
 
+    def set_trace_filter(self, rules):
+        """
+        Set the rules that select which code is traced by the debuggee.
+        rules is a list of (action, pattern) pairs where action is
+        'include' or 'exclude' and pattern is a glob, a path prefix or
+        one of the aliases '<stdlib>' and '<site-packages>'.
+        The last matching rule wins, code that matches no rule is traced.
+        """
+
+        return self.__smi.set_trace_filter(rules)
+
+
+    def get_trace_filter(self):
+        """
+        Get the list of (action, pattern) trace filter rules.
+        """
+
+        return self.__smi.get_trace_filter()
+
+
+    def set_thread_filter(self, names, tids):
+        """
+        Select the threads that are traced by the debuggee.
+        names - list of glob patterns matched against thread names.
+        tids  - list of OS thread ids.
+        All threads are traced if both lists are empty. Threads that are
+        not selected run untraced but are still listed by get_thread_list().
+        """
+
+        return self.__smi.set_thread_filter(names, tids)
+
+
+    def get_thread_filter(self):
+        """
+        Get the thread selection as a tuple of (names, tids) lists.
+        """
+
+        return self.__smi.get_thread_filter()
+
+
+    def start_profiler(self, interval):
+        """
+        Start a new profile with the sampling profiler of the debuggee.
+        interval - time between samples in milliseconds.
+        """
+
+        return self.__smi.start_profiler(interval)
+
+
+    def stop_profiler(self):
+        """
+        Stop the sampling profiler of the debuggee. The profile is kept
+        until the profiler is started again.
+        """
+
+        return self.__smi.stop_profiler()
+
+
+    def get_profile(self):
+        """
+        Get the profile of the debuggee as a tuple of
+        (fRunning, interval, samples, dropped, stacks) where stacks is a
+        list of collapsed stack lines ('outer;...;inner count') as read
+        by flamegraph.pl.
+        """
+
+        return self.__smi.get_profile()
+
+
+    def get_compression_stats(self):
+        """
+        Get the compression statistics of the session as a tuple of
+        (link_speed, sent, received) where link_speed is the measured
+        speed of the link to the debuggee in bytes per second, or None,
+        and sent and received are tuples of (messages, compressed
+        messages, bytes, bytes after compression).
+        """
+
+        return self.__smi.get_compression_stats()
+
+
+    def get_code_cache_stats(self):
+        """
+        Get the statistics of the code context cache of the debuggee as a
+        dict with the keys 'size', 'max_size', 'hits', 'misses',
+        'evictions' and 'releases'.
+        """
+
+        return self.__smi.get_code_cache_stats()
+
+
     def set_fork_mode(self, ffork_into_child, ffork_auto):
         """
         Determine how to handle os.fork().
@@ -450,6 +593,45 @@ class CSessionManager:
         return self.__smi.get_source_lines(nlines, fAll)
 
 
+    def get_break_snapshot(self, spec):
+        """
+        Return in one round trip the stack, source lines, thread list and
+        namespace of the current thread and frame.
+
+        spec - dictionary describing the snapshot, with the optional keys:
+          DICT_KEY_MAX_DEPTH - number of innermost frames of the stack to
+              return, 0 for the whole stack.
+          DICT_KEY_NLINES - number of source lines around the current
+              line, 0 for none.
+          DICT_KEY_EXPR_LIST - list of (expr, fExpand) tuples, see
+              get_namespace().
+          DICT_KEY_FILTER_LEVEL, DICT_KEY_REPR_LIMIT - see get_namespace().
+
+        Return value is a dictionary with the keys DICT_KEY_STACK (an
+        element of the list returned by get_stack()), DICT_KEY_SOURCE (an
+        element of the list returned by get_source_lines() or None),
+        DICT_KEY_THREADS (as returned by get_thread_list()) and
+        DICT_KEY_NAMESPACE (as returned by get_namespace() or None).
+        """
+
+        return self.__smi.get_break_snapshot(spec)
+
+
+    def set_break_snapshot(self, spec):
+        """
+        Have the debuggee attach a snapshot described by spec to the
+        events it sends on every break, or stop if spec is None. See
+        get_break_snapshot() for spec. The snapshot is sent in a
+        CEventBreakSnapshot event and get_stack(), get_source_lines() and
+        get_namespace() answer from it the first time they are called
+        for data it holds, saving a round trip each.
+
+        Namespaces are not sent when synchronicity is off.
+        """
+
+        return self.__smi.set_break_snapshot(spec)
+
+
     def set_frame_index(self, frame_index):
         """
         Set frame index. 0 is the current executing frame, and 1, 2, 3,
@@ -1008,9 +1190,15 @@ class CSessionManagerInternal:
 
         self.m_breakpoints_proxy = CBreakPointsManagerProxy(self)
 
+        self.m_break_snapshot_spec = None
+        self.m_break_snapshot = CBreakSnapshot()
+
         event_type_dict = {CEventState: {EVENT_EXCLUDE: [STATE_BROKEN, STATE_ANALYZE]}}
         self.register_callback(self.reset_frame_indexes, event_type_dict, fSingleUse = False)
 
+        event_type_dict = {CEventState: {}}
+        self.register_callback(self.clear_break_snapshot, event_type_dict, fSingleUse = False)
+
         event_type_dict = {CEventStackDepth: {}}
         self.register_callback(self.set_stack_depth, event_type_dict, fSingleUse = False)
 
@@ -1048,6 +1236,9 @@ class CSessionManagerInternal:
         self.m_event_dispatcher_proxy.register_callback(self.on_event_fork_mode, event_type_dict, fSingleUse = False)
         self.m_event_dispatcher.register_chain_override(event_type_dict)
 
+        event_type_dict = {CEventBreakSnapshot: {}}
+        self.m_event_dispatcher_proxy.register_callback(self.on_event_break_snapshot, event_type_dict, fSingleUse = False)
+
         self.m_printer = self.__nul_printer
 
         self.m_last_command_line = None
@@ -1400,13 +1591,23 @@ class CSessionManagerInternal:
 
         self.m_server_info = self.get_server_info()
 
-        self.getSession().getProxy().set_synchronicity(self.m_fsynchronicity)
-        self.getSession().getProxy().set_breakonexit(self.m_breakonexit)
-        self.getSession().getProxy().set_trap_unhandled_exceptions(self.m_ftrap)
-        self.getSession().getProxy().set_fork_mode(self.m_ffork_into_child, self.m_ffork_auto)
+        mc = CMultiCall(self.getSession().getProxy())
+
+        mc.set_synchronicity(self.m_fsynchronicity)
+        mc.set_breakonexit(self.m_breakonexit)
+        mc.set_trap_unhandled_exceptions(self.m_ftrap)
+        mc.set_fork_mode(self.m_ffork_into_child, self.m_ffork_auto)
+
+        if self.m_break_snapshot_spec is not None:
+            mc.set_break_snapshot(self.m_break_snapshot_spec, self.m_encoding, self.m_fraw)
 
         if fsetenv and len(self.m_environment) != 0:
-            self.getSession().getProxy().set_environ(self.m_environment)
+            mc.set_environ(self.m_environment)
+
+        #
+        # Raise the exception of the first call that failed.
+        #
+        list(mc())
 
         self.request_break()
         self.refresh(True)
@@ -1440,8 +1641,13 @@ class CSessionManagerInternal:
     def refresh(self, fSendUnhandled = False):
         fAnalyzeMode = (self.m_state_manager.get_state() == STATE_ANALYZE)
 
-        self.m_remote_event_index = self.getSession().getProxy().sync_with_events(fAnalyzeMode, fSendUnhandled)
-        self.m_breakpoints_proxy.sync()
+        mc = CMultiCall(self.getSession().getProxy())
+        mc.sync_with_events(fAnalyzeMode, fSendUnhandled)
+        mc.get_breakpoints()
+        rl = mc()
+
+        self.m_remote_event_index = rl[0]
+        self.m_breakpoints_proxy.sync(rl[1])
 
 
     def __start_event_monitor(self):
@@ -1456,6 +1662,9 @@ class CSessionManagerInternal:
         t = 0
         nfailures = 0
 
+        if self.__receive_pushed_events():
+            return
+
         while not self.m_fStop:
             try:
                 t = ControlRate(t, IDLE_MAX_RATE)
@@ -1463,27 +1672,7 @@ class CSessionManagerInternal:
                     return
 
                 (n, sel) = self.getSession().getProxy().wait_for_event(PING_TIMEOUT, self.m_remote_event_index)
-
-                if True in [isinstance(e, CEventForkSwitch) for e in sel]:
-                    print_debug('Received fork switch event.')
-
-                    self.getSession().pause()
-                    threading.Thread(target = self.restart_session_job).start()
-
-                if True in [isinstance(e, CEventExecSwitch) for e in sel]:
-                    print_debug('Received exec switch event.')
-
-                    self.getSession().pause()
-                    threading.Thread(target = self.restart_session_job, args = (True, )).start()
-
-                if True in [isinstance(e, CEventExit) for e in sel]:
-                    self.getSession().shut_down()
-                    self.m_fStop = True
-
-                if n > self.m_remote_event_index:
-                    #print >> sys.__stderr__, (n, sel)
-                    self.m_remote_event_index = n
-                    self.m_event_dispatcher_proxy.fire_events(sel)
+                self.__handle_events(n, sel)
 
                 nfailures = 0
 
@@ -1506,6 +1695,113 @@ class CSessionManagerInternal:
                 return
 
 
+    def __handle_events(self, n, sel):
+        if True in [isinstance(e, CEventForkSwitch) for e in sel]:
+            print_debug('Received fork switch event.')
+
+            self.getSession().pause()
+            threading.Thread(target = self.restart_session_job).start()
+
+        if True in [isinstance(e, CEventExecSwitch) for e in sel]:
+            print_debug('Received exec switch event.')
+
+            self.getSession().pause()
+            threading.Thread(target = self.restart_session_job, args = (True, )).start()
+
+        if True in [isinstance(e, CEventExit) for e in sel]:
+            self.getSession().shut_down()
+            self.m_fStop = True
+
+        if n > self.m_remote_event_index:
+            #print >> sys.__stderr__, (n, sel)
+            self.m_remote_event_index = n
+            self.m_event_dispatcher_proxy.fire_events(sel)
+
+
+    def __receive_pushed_events(self):
+        """
+        Receive the events the debuggee pushes over a dedicated channel,
+        acknowledging each batch. Acknowledgements are also sent when no
+        events arrive, as heartbeats. A broken channel is reopened and
+        the stream resumed from the last event received.
+        Return False if the debuggee can not push events.
+        """
+
+        pushed = queue.Queue()
+        channel = None
+        t = 0
+        nfailures = 0
+
+        try:
+            while not self.m_fStop:
+                try:
+                    if channel is None:
+                        t = ControlRate(t, IDLE_MAX_RATE)
+
+                        channel = self.getSession().open_event_channel(pushed.put)
+                        if channel is None:
+                            return False
+
+                        subscription_id = channel.subscribe_events(self.m_remote_event_index)
+
+                    try:
+                        r = pushed.get(timeout = PING_TIMEOUT)
+                    except queue.Empty:
+                        r = (self.m_remote_event_index, [])
+
+                    if r is None:
+                        raise socket.error('Event channel closed.')
+
+                    (n, sel) = r
+
+                    #
+                    # Events the client already has, since a resync for
+                    # example, are skipped.
+                    #
+                    sel = sel[max(0, len(sel) - (n - self.m_remote_event_index)):]
+                    if n <= self.m_remote_event_index:
+                        sel = []
+
+                    self.__handle_events(n, sel)
+
+                    if self.m_fStop:
+                        return True
+
+                    if not channel.ack_events(subscription_id, n):
+                        raise socket.error('Event subscription dropped.')
+
+                    nfailures = 0
+
+                except CConnectionException:
+                    if not self.m_fStop:
+                        self.report_exception(*sys.exc_info())
+                        threading.Thread(target = self.detach_job).start()
+
+                    return True
+
+                except socket.error:
+                    if channel is not None:
+                        channel.close()
+                        channel = None
+                        pushed = queue.Queue()
+
+                    if nfailures < COMMUNICATION_RETRIES:
+                        nfailures += 1
+                        continue
+
+                    if not self.m_fStop:
+                        self.report_exception(*sys.exc_info())
+                        threading.Thread(target = self.detach_job).start()
+
+                    return True
+
+            return True
+
+        finally:
+            if channel is not None:
+                channel.close()
+
+
     def on_event_conflicting_modules(self, event):
         s = ', '.join(event.m_modules_list)
         self.m_printer(STR_CONFLICTING_MODULES % s)
@@ -1586,6 +1882,7 @@ class CSessionManagerInternal:
 
         finally:
             self.m_state_manager.set_state(STATE_DETACHED)
+            self.m_session.close()
             self.m_session = None
             self.m_printer(STR_DETACH_SUCCEEDED)
 
@@ -1646,6 +1943,16 @@ class CSessionManagerInternal:
         self.getSession().getProxy().set_breakpoint(filename, scope, lineno, fEnabled, expr, frame_index, fAnalyzeMode, encoding)
 
 
+    def set_logpoint(self, filename, scope, lineno, fEnabled, expr, log_exprs, encoding = None):
+        frame_index = self.get_frame_index()
+        fAnalyzeMode = (self.m_state_manager.get_state() == STATE_ANALYZE)
+
+        if encoding == None:
+            encoding = self.m_encoding
+
+        self.getSession().getProxy().set_logpoint(filename, scope, lineno, fEnabled, expr, log_exprs, frame_index, fAnalyzeMode, encoding)
+
+
     def disable_breakpoint(self, id_list, fAll):
         self.getSession().getProxy().disable_breakpoint(id_list, fAll)
 
@@ -1654,13 +1961,20 @@ class CSessionManagerInternal:
         self.getSession().getProxy().enable_breakpoint(id_list, fAll)
 
 
+    def set_breakpoint_filter(self, id_list, fAll, ignore_count, every, probability):
+        self.getSession().getProxy().set_breakpoint_filter(id_list, fAll, ignore_count, every, probability)
+
+
     def delete_breakpoint(self, id_list, fAll):
         self.getSession().getProxy().delete_breakpoint(id_list, fAll)
 
 
-    def get_breakpoints(self):
+    def get_breakpoints(self, fSync = False):
         self.__verify_attached()
 
+        if fSync:
+            self.m_breakpoints_proxy.sync()
+
         bpl = self.m_breakpoints_proxy.get_breakpoints()
         return bpl
 
@@ -1717,10 +2031,17 @@ class CSessionManagerInternal:
 
         ferror = False
 
+        frame_index = self.get_frame_index()
+        fAnalyzeMode = (self.m_state_manager.get_state() == STATE_ANALYZE)
+
+        #
+        # The breakpoints are set with a single batch of calls.
+        #
+        mc = CMultiCall(self.getSession().getProxy())
+
         try:
             try:
                 bpl = pickle.load(file)
-                self.delete_breakpoint([], True)
 
             except:
                 print_debug_exception()
@@ -1732,6 +2053,8 @@ class CSessionManagerInternal:
             if filename == '' and len(bpl.values()) == 0:
                 raise IOError
 
+            mc.delete_breakpoint([], True)
+
             for bp in bpl.values():
                 try:
                     if bp.m_scope_fqn != None:
@@ -1746,7 +2069,29 @@ class CSessionManagerInternal:
                     if bp.m_expr in [None, '']:
                         bp.m_encoding = as_unicode('utf-8')
 
-                    self.set_breakpoint(bp.m_filename, bp.m_scope_fqn, bp.m_scope_offset, bp.m_fEnabled, bp.m_expr, bp.m_encoding)
+                    encoding = [bp.m_encoding, self.m_encoding][bp.m_encoding is None]
+
+                    log_exprs = getattr(bp, 'm_log_exprs', None)
+                    if log_exprs:
+                        log_exprs = [as_unicode(e) for e in log_exprs]
+                        mc.set_logpoint(bp.m_filename, bp.m_scope_fqn, bp.m_scope_offset, bp.m_fEnabled, bp.m_expr, log_exprs, frame_index, fAnalyzeMode, encoding)
+                    else:
+                        mc.set_breakpoint(bp.m_filename, bp.m_scope_fqn, bp.m_scope_offset, bp.m_fEnabled, bp.m_expr, frame_index, fAnalyzeMode, encoding)
+                except:
+                    print_debug_exception()
+                    ferror = True
+
+            rl = mc()
+
+            try:
+                rl[0]
+            except:
+                print_debug_exception()
+                raise CException
+
+            for i in range(1, len(rl)):
+                try:
+                    rl[i]
                 except:
                     print_debug_exception()
                     ferror = True
@@ -1830,6 +2175,63 @@ class CSessionManagerInternal:
         return self.m_ftrap
 
 
+    def set_trace_filter(self, rules):
+        self.__verify_attached()
+
+        self.getSession().getProxy().set_trace_filter(rules)
+
+
+    def get_trace_filter(self):
+        self.__verify_attached()
+
+        rules = self.getSession().getProxy().get_trace_filter()
+        return [tuple(r) for r in rules]
+
+
+    def set_thread_filter(self, names, tids):
+        self.__verify_attached()
+
+        self.getSession().getProxy().set_thread_filter(names, tids)
+
+
+    def get_thread_filter(self):
+        self.__verify_attached()
+
+        (names, tids) = self.getSession().getProxy().get_thread_filter()
+        return (list(names), list(tids))
+
+
+    def start_profiler(self, interval):
+        self.__verify_attached()
+
+        self.getSession().getProxy().start_profiler(interval)
+
+
+    def stop_profiler(self):
+        self.__verify_attached()
+
+        self.getSession().getProxy().stop_profiler()
+
+
+    def get_profile(self):
+        self.__verify_attached()
+
+        (frunning, interval, samples, dropped, stacks) = self.getSession().getProxy().get_profile()
+        return (frunning, interval, samples, dropped, list(stacks))
+
+
+    def get_compression_stats(self):
+        self.__verify_attached()
+
+        return self.getSession().get_compressor().get_stats()
+
+
+    def get_code_cache_stats(self):
+        self.__verify_attached()
+
+        return self.getSession().getProxy().get_code_cache_stats()
+
+
     def is_unhandled_exception(self):
         self.__verify_attached()
 
@@ -1872,6 +2274,12 @@ class CSessionManagerInternal:
 
     def get_stack(self, tid_list, fAll):
         fAnalyzeMode = (self.m_state_manager.get_state() == STATE_ANALYZE)
+
+        if len(tid_list) == 0 and not fAll:
+            st = self.m_break_snapshot.take_stack(fAnalyzeMode)
+            if st is not None:
+                return [st]
+
         r = self.getSession().getProxy().get_stack(tid_list, fAll, fAnalyzeMode)
         return r
 
@@ -1890,10 +2298,45 @@ class CSessionManagerInternal:
         frame_index = self.get_frame_index()
         fAnalyzeMode = (self.m_state_manager.get_state() == STATE_ANALYZE)
 
+        if not fAll:
+            source = self.m_break_snapshot.take_source_lines(nlines, frame_index, fAnalyzeMode)
+            if source is not None:
+                return [source]
+
         r = self.getSession().getProxy().get_source_lines(nlines, fAll, frame_index, fAnalyzeMode)
         return r
 
 
+    def get_break_snapshot(self, spec):
+        frame_index = self.get_frame_index()
+        fAnalyzeMode = (self.m_state_manager.get_state() == STATE_ANALYZE)
+
+        r = self.getSession().getProxy().get_break_snapshot(spec, frame_index, fAnalyzeMode, self.m_encoding, self.m_fraw)
+        return r
+
+
+    def set_break_snapshot(self, spec):
+        if spec is not None:
+            spec = calc_snapshot_spec(spec)
+
+        self.m_break_snapshot_spec = spec
+        self.m_break_snapshot.clear()
+
+        if self.__is_attached():
+            try:
+                self.getSession().getProxy().set_break_snapshot(spec, self.m_encoding, self.m_fraw)
+            except NotAttached:
+                pass
+
+
+    def on_event_break_snapshot(self, event):
+        self.m_break_snapshot.set(event.m_snapshot)
+
+
+    def clear_break_snapshot(self, event):
+        self.m_break_snapshot.clear()
+
+
     def get_thread_list(self):
         (current_thread_id, thread_list) = self.getSession().getProxy().get_thread_list()
         return (current_thread_id, thread_list)
@@ -1901,6 +2344,7 @@ class CSessionManagerInternal:
 
     def set_thread(self, tid):
         self.reset_frame_indexes(None)
+        self.m_break_snapshot.clear()
         self.getSession().getProxy().set_thread(tid)
 
 
@@ -1918,7 +2362,16 @@ class CSessionManagerInternal:
         frame_index = self.get_frame_index()
         fAnalyzeMode = (self.m_state_manager.get_state() == STATE_ANALYZE)
 
-        r = self.getSession().getProxy().get_namespace(nl, filter_level, frame_index, fAnalyzeMode, repr_limit, self.m_encoding, self.m_fraw)
+        (rd, _nl) = self.m_break_snapshot.take_namespace(nl, filter_level, frame_index, fAnalyzeMode, repr_limit)
+        if len(rd) == 0:
+            r = self.getSession().getProxy().get_namespace(nl, filter_level, frame_index, fAnalyzeMode, repr_limit, self.m_encoding, self.m_fraw)
+            return r
+
+        if len(_nl) > 0:
+            rl = self.getSession().getProxy().get_namespace(_nl, filter_level, frame_index, fAnalyzeMode, repr_limit, self.m_encoding, self.m_fraw)
+            rd.update([(e[DICT_KEY_EXPR], e) for e in rl])
+
+        r = [rd[expr] for (expr, fExpand) in nl if expr in rd]
         return r
 
 
@@ -1935,6 +2388,7 @@ class CSessionManagerInternal:
 
         if fclear_completions:
             self.m_completions.clear()
+            self.m_break_snapshot.clear()
 
         return (value, warning, error)
 
@@ -1951,6 +2405,7 @@ class CSessionManagerInternal:
         (warning, error) = self.getSession().getProxy().execute(suite, frame_index, fAnalyzeMode, self.m_encoding)
 
         self.m_completions.clear()
+        self.m_break_snapshot.clear()
 
         return (warning, error)
 
@@ -1966,6 +2421,9 @@ class CSessionManagerInternal:
         self.m_event_dispatcher.fire_event(event)
 
         if self.__is_attached():
+            if self.m_break_snapshot_spec is not None:
+                self.set_break_snapshot(self.m_break_snapshot_spec)
+
             self.refresh()
 
 
@@ -2272,6 +2730,7 @@ class CSessionManagerInternal:
 
         finally:
             self.m_state_manager.set_state(STATE_DETACHED)
+            self.m_session.close()
             self.m_session = None
             self.m_printer(STR_DETACH_SUCCEEDED)
 
@@ -2284,9 +2743,54 @@ class CServerList:
 
 
     def calcList(self, _rpdb2_pwd, rid, key = None):
+        self.m_errors = {}
+
+        #
+        # Debuggees on this host are looked up in the registry first. The
+        # port range is still scanned for debuggees that are not
+        # registered, such as ones run by other users, and the list of
+        # servers merges both.
+        #
+        registered = []
+
+        if self.m_host.lower() in [LOCALHOST, LOOPBACK]:
+            registered = self.__calc_registered_list()
+            self.m_list = registered
+
+            if key != None:
+                try:
+                    return self.findServers(key)[0]
+                except UnknownServer:
+                    pass
+
+        return self.__scan(_rpdb2_pwd, rid, key, registered)
+
+
+    def __calc_registered_list(self):
+        t = time.time()
+
+        sil = []
+        for record in list_servers():
+            si = CServerInfo(
+                t - record[RECORD_TIME],
+                record[RECORD_PORT],
+                record[RECORD_PID],
+                record[RECORD_FILENAME],
+                as_unicode(record[RECORD_RID]),
+                record[RECORD_STATE],
+                record[RECORD_EMBEDDED],
+                record[RECORD_SOCKET]
+                )
+
+            sil.append((-si.m_age, si))
+
+        sil.sort(key = lambda s: s[0])
+        return [s[1] for s in sil]
+
+
+    def __scan(self, _rpdb2_pwd, rid, key, registered = []):
         sil = []
         sessions = []
-        self.m_errors = {}
 
         port = SERVER_PORT_RANGE_START
         while port < SERVER_PORT_RANGE_START + SERVER_PORT_RANGE_LENGTH:
@@ -2320,7 +2824,14 @@ class CServerList:
         if key != None:
             raise UnknownServer
 
-        sil.sort()
+        #
+        # Registered debuggees the scan did not find, such as ones that
+        # only listen on a local socket, are kept.
+        #
+        pids = [s[1].m_pid for s in sil]
+        sil += [(-si.m_age, si) for si in registered if not si.m_pid in pids]
+
+        sil.sort(key = lambda s: s[0])
         self.m_list = [s[1] for s in sil]
 
         return self.m_list
@@ -2587,6 +3098,10 @@ class CSession:
         return self.m_proxy.get_encryption()
 
 
+    def get_compressor(self):
+        return self.m_crypto.get_compressor()
+
+
     def getServerInfo(self):
         return self.m_server_info
 
@@ -2626,6 +3141,33 @@ class CSession:
         self.m_fShutDown = True
 
 
+    def close(self):
+        """
+        Close the persistent connection to the debuggee, if any.
+        """
+
+        if self.m_proxy is not None:
+            self.m_proxy.close()
+
+
+    def open_event_channel(self, push_handler):
+        """
+        Return a proxy on a dedicated connection over which the debuggee
+        pushes events to push_handler, or None if the debuggee can not
+        push events.
+        """
+
+        proxy = self.getProxy()
+
+        channel = CPwdServerProxy(self.m_crypto, proxy.m_uri, CPooledTransport(), target_rid = proxy.m_target_rid, fFrames = True, path = proxy.m_path)
+        channel.set_push_handler(push_handler)
+
+        if channel.get_frames_connection() is None:
+            return None
+
+        return channel
+
+
     def getProxy(self):
         """
         Return the proxy object.
@@ -2663,9 +3205,20 @@ class CSession:
         server = CPwdServerProxy(self.m_crypto, calcURL(host, self.m_port), CTimeoutTransport())
         server_info = server.server_info()
 
-        self.m_proxy = CPwdServerProxy(self.m_crypto, calcURL(host, self.m_port), CLocalTransport(), target_rid = server_info.m_rid)
+        #
+        # Local debuggees are preferably called over their Unix domain
+        # socket.
+        #
+        path = [None, server_info.m_socket_path][host == LOOPBACK]
+
+        proxy = self.m_proxy
+
+        self.m_proxy = CPwdServerProxy(self.m_crypto, calcURL(host, self.m_port), CPooledTransport(), target_rid = server_info.m_rid, fFrames = True, path = path)
         self.m_server_info = server_info
 
+        if proxy is not None:
+            proxy.close()
+
 
     def isConnected(self):
         return self.m_proxy is not None
\ No newline at end of file
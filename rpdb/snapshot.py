@@ -0,0 +1,168 @@
+import threading
+
+from rpdb.const import DICT_KEY_SPEC, DICT_KEY_MAX_DEPTH, DICT_KEY_NLINES, DICT_KEY_EXPR_LIST, DICT_KEY_FILTER_LEVEL, \
+    DICT_KEY_REPR_LIMIT, DICT_KEY_FRAME_INDEX, DICT_KEY_EXCEPTION, DICT_KEY_STACK, DICT_KEY_SOURCE, DICT_KEY_THREADS, \
+    DICT_KEY_NAMESPACE, DICT_KEY_EXPR, SNAPSHOT_REPR_LIMIT
+from rpdb.exceptions import BadArgument
+from rpdb.utils import as_unicode
+
+
+def calc_snapshot_spec(spec):
+    """
+    Return a copy of a break snapshot spec with missing keys set to
+    their defaults:
+      DICT_KEY_MAX_DEPTH - number of innermost frames of the stack to
+          return, 0 for the whole stack.
+      DICT_KEY_NLINES - number of source lines around the current line,
+          0 for none.
+      DICT_KEY_EXPR_LIST - list of (expr, fExpand) tuples as passed to
+          get_namespace().
+      DICT_KEY_FILTER_LEVEL, DICT_KEY_REPR_LIMIT - as passed to
+          get_namespace().
+    """
+
+    try:
+        _spec = {
+            DICT_KEY_MAX_DEPTH: int(spec.get(DICT_KEY_MAX_DEPTH, 0)),
+            DICT_KEY_NLINES: int(spec.get(DICT_KEY_NLINES, 0)),
+            DICT_KEY_EXPR_LIST: [(as_unicode(expr), bool(fExpand)) for (expr, fExpand) in spec.get(DICT_KEY_EXPR_LIST, [])],
+            DICT_KEY_FILTER_LEVEL: int(spec.get(DICT_KEY_FILTER_LEVEL, 0)),
+            DICT_KEY_REPR_LIMIT: int(spec.get(DICT_KEY_REPR_LIMIT, SNAPSHOT_REPR_LIMIT))
+            }
+
+    except (AttributeError, TypeError, ValueError):
+        raise BadArgument
+
+    if _spec[DICT_KEY_MAX_DEPTH] < 0 or _spec[DICT_KEY_NLINES] < 0 or not _spec[DICT_KEY_FILTER_LEVEL] in [0, 1, 2]:
+        raise BadArgument
+
+    return _spec
+
+
+class CBreakSnapshot:
+    """
+    Client side store of the snapshot the debuggee sends after a break.
+
+    Every part of the snapshot is handed out once. Later queries for the
+    same data go to the debuggee, so they see changes made by evaluated
+    expressions or by threads that are still running.
+    """
+
+    def __init__(self):
+        self.m_lock = threading.Lock()
+        self.m_snapshot = None
+
+
+    def set(self, snapshot):
+        try:
+            self.m_lock.acquire()
+            self.m_snapshot = dict(snapshot)
+
+            rl = snapshot.get(DICT_KEY_NAMESPACE, None)
+            if rl is not None:
+                self.m_snapshot[DICT_KEY_NAMESPACE] = dict([(r[DICT_KEY_EXPR], r) for r in rl])
+
+        finally:
+            self.m_lock.release()
+
+
+    def clear(self):
+        try:
+            self.m_lock.acquire()
+            self.m_snapshot = None
+
+        finally:
+            self.m_lock.release()
+
+
+    def take_stack(self, fException):
+        """
+        Return the stack of the current thread as returned by get_stack()
+        or None if it is not available.
+        """
+
+        try:
+            self.m_lock.acquire()
+
+            s = self.m_snapshot
+            if s is None or s[DICT_KEY_SPEC][DICT_KEY_MAX_DEPTH] != 0 or s[DICT_KEY_EXCEPTION] != fException:
+                return None
+
+            return s.pop(DICT_KEY_STACK, None)
+
+        finally:
+            self.m_lock.release()
+
+
+    def take_source_lines(self, nlines, frame_index, fException):
+        try:
+            self.m_lock.acquire()
+
+            s = self.m_snapshot
+            if s is None or s[DICT_KEY_SPEC][DICT_KEY_NLINES] != nlines:
+                return None
+
+            if (s[DICT_KEY_FRAME_INDEX], s[DICT_KEY_EXCEPTION]) != (frame_index, fException):
+                return None
+
+            return s.pop(DICT_KEY_SOURCE, None)
+
+        finally:
+            self.m_lock.release()
+
+
+    def take_thread_list(self):
+        try:
+            self.m_lock.acquire()
+
+            s = self.m_snapshot
+            if s is None:
+                return None
+
+            return s.pop(DICT_KEY_THREADS, None)
+
+        finally:
+            self.m_lock.release()
+
+
+    def take_namespace(self, nl, filter_level, frame_index, fException, repr_limit):
+        """
+        Split nl into the expressions whose values are in the snapshot
+        and the ones that are not.
+        Return (rd, _nl) where rd maps expressions to their get_namespace()
+        results and _nl is the list of the missing (expr, fExpand) tuples.
+        """
+
+        try:
+            self.m_lock.acquire()
+
+            s = self.m_snapshot
+            if s is None or s.get(DICT_KEY_NAMESPACE, None) is None:
+                return ({}, nl)
+
+            spec = s[DICT_KEY_SPEC]
+            if (spec[DICT_KEY_FILTER_LEVEL], spec[DICT_KEY_REPR_LIMIT]) != (filter_level, repr_limit):
+                return ({}, nl)
+
+            if (s[DICT_KEY_FRAME_INDEX], s[DICT_KEY_EXCEPTION]) != (frame_index, fException):
+                return ({}, nl)
+
+            fExpand_dict = dict(spec[DICT_KEY_EXPR_LIST])
+            namespace = s[DICT_KEY_NAMESPACE]
+
+            rd = {}
+            _nl = []
+
+            for (expr, fExpand) in nl:
+                r = namespace.get(expr, None)
+                if r is None or fExpand_dict.get(expr, None) != fExpand:
+                    _nl.append((expr, fExpand))
+                    continue
+
+                rd[expr] = r
+                del namespace[expr]
+
+            return (rd, _nl)
+
+        finally:
+            self.m_lock.release()
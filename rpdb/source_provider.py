@@ -1,6 +1,11 @@
 import os.path
 import sys, codecs
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
 
+from rpdb.const import SOURCE_CACHE_MAX_BYTES
 from rpdb.globals import g_found_unicode_files
 from rpdb.utils import as_unicode, is_unicode, winlower, as_bytes, mygetfile
 
@@ -14,7 +19,6 @@ MODULE_SCOPE2 = '<module>'
 SCOPE_SEP = '.'
 
 g_source_provider_aux = None
-g_lines_cache = {}
 
 
 def ParseLineEncoding(l):
@@ -54,27 +58,270 @@ def ParseEncoding(txt):
 
     return 'utf-8'
 
-def lines_cache(filename):
-    filename = g_found_unicode_files.get(filename, filename)
+def calc_source_signature(filename):
+    """
+    Return the (mtime, size, inode) of a source file or None if it is
+    not a file on disk, for example when it is inside a zip archive.
+    """
 
-    if filename in g_lines_cache:
-        return g_lines_cache[filename]
+    try:
+        st = os.stat(filename)
+    except (OSError, ValueError):
+        return None
 
-    (source, encoding, ffilesystem) = source_provider(filename)
-    source = source.replace(as_unicode('\r\n'), as_unicode('\n'))
+    return (st.st_mtime, st.st_size, st.st_ino)
 
-    lines = source.split(as_unicode('\n'))
 
-    g_lines_cache[filename] = (lines, encoding, ffilesystem)
+class CSourceFile:
+    """
+    Source of a file, kept as a single buffer with an index of the
+    offsets at which its lines start.
+    """
 
-    return (lines, encoding, ffilesystem)
+    def __init__(self, source, encoding, ffilesystem, signature = None):
+        self.m_source = source.replace(as_unicode('\r\n'), as_unicode('\n'))
+        self.m_encoding = encoding
+        self.m_ffilesystem = ffilesystem
+        self.m_signature = signature
 
+        offsets = array('L', [0])
 
-def get_source(filename):
-    (lines, encoding, ffilesystem) = lines_cache(filename)
-    source = as_unicode('\n').join(lines)
+        i = self.m_source.find('\n')
+        while i != -1:
+            offsets.append(i + 1)
+            i = self.m_source.find('\n', i + 1)
+
+        self.m_offsets = offsets
+        self.m_found_lines = {}
+
+        self.m_size = sys.getsizeof(self.m_source) + offsets.itemsize * len(offsets)
+
+
+    def get_line_count(self):
+        return len(self.m_offsets)
+
+
+    def get_line(self, lineno):
+        """
+        Return line lineno, counted from 1, with its end of line or ''
+        if there is no such line.
+        """
+
+        if lineno < 1 or lineno > len(self.m_offsets):
+            return as_unicode('')
+
+        start = self.m_offsets[lineno - 1]
+        if lineno < len(self.m_offsets):
+            return self.m_source[start:self.m_offsets[lineno]]
+
+        return self.m_source[start:] + as_unicode('\n')
+
+
+    def get_lines(self, lineno, nlines = -1):
+        """
+        Return nlines lines from line lineno with their end of line, or
+        all lines to the end of the file if nlines is negative.
+        """
+
+        n = len(self.m_offsets)
+        if lineno < 1 or lineno > n or nlines == 0:
+            return []
+
+        last = n
+        if nlines > 0:
+            last = min(n, lineno + nlines - 1)
+
+        end = len(self.m_source)
+        if last < n:
+            end = self.m_offsets[last] - 1
+
+        lines = self.m_source[self.m_offsets[lineno - 1]:end].split(as_unicode('\n'))
+        return [l + as_unicode('\n') for l in lines]
+
+
+    def find_lines(self, text):
+        """
+        Return the sorted list of the numbers of the lines that contain
+        text. The list is computed once per text.
+        """
+
+        found = self.m_found_lines.get(text, None)
+        if found is not None:
+            return found
+
+        found = []
+
+        i = self.m_source.find(text)
+        while i != -1:
+            lineno = bisect_right(self.m_offsets, i)
+            found.append(lineno)
+
+            if lineno == len(self.m_offsets):
+                break
+
+            i = self.m_source.find(text, self.m_offsets[lineno])
+
+        self.m_found_lines[text] = found
+        return found
+
+
+class CSourceCache:
+    """
+    LRU cache of source files with a budget in bytes.
+
+    Files read from disk are validated against their (mtime, size, inode)
+    on every lookup and read again when they change. Sources that come
+    from other providers cannot be validated and are kept until they are
+    invalidated or evicted.
+    """
+
+    def __init__(self, max_bytes = SOURCE_CACHE_MAX_BYTES):
+        self.m_max_bytes = max_bytes
+
+        self.m_lock = threading.Lock()
+        self.m_files = OrderedDict()
+        self.m_bytes = 0
+
+        self.m_hits = 0
+        self.m_misses = 0
+        self.m_evictions = 0
+        self.m_invalidations = 0
+
+
+    def get(self, filename):
+        filename = g_found_unicode_files.get(filename, filename)
+
+        try:
+            self.m_lock.acquire()
+            sf = self.m_files.get(filename, None)
+
+        finally:
+            self.m_lock.release()
+
+        if sf is not None:
+            if sf.m_signature is None or sf.m_signature == calc_source_signature(filename):
+                try:
+                    self.m_lock.acquire()
+
+                    if self.m_files.get(filename, None) is sf:
+                        self.m_files.move_to_end(filename)
 
-    return (source, encoding)
+                    self.m_hits += 1
+
+                finally:
+                    self.m_lock.release()
+
+                return sf
+
+            self.invalidate(filename)
+
+        #
+        # The signature is taken before the source is read so a file
+        # that changes in between is read again on the next lookup.
+        #
+        signature = calc_source_signature(filename)
+        (source, encoding, ffilesystem) = source_provider(filename)
+        sf = CSourceFile(source, encoding, ffilesystem, [None, signature][ffilesystem])
+
+        try:
+            self.m_lock.acquire()
+
+            self.m_misses += 1
+            self.__remove(filename)
+
+            self.m_files[filename] = sf
+            self.m_bytes += sf.m_size
+
+            #
+            # The newest file is kept even when it alone is over budget.
+            #
+            while self.m_bytes > self.m_max_bytes and len(self.m_files) > 1:
+                self.__remove(next(iter(self.m_files)))
+                self.m_evictions += 1
+
+        finally:
+            self.m_lock.release()
+
+        return sf
+
+
+    def __remove(self, filename):
+        sf = self.m_files.pop(filename, None)
+        if sf is not None:
+            self.m_bytes -= sf.m_size
+
+        return sf
+
+
+    def invalidate(self, filename):
+        filename = g_found_unicode_files.get(filename, filename)
+
+        try:
+            self.m_lock.acquire()
+
+            if self.__remove(filename) is not None:
+                self.m_invalidations += 1
+
+        finally:
+            self.m_lock.release()
+
+
+    def invalidate_unvalidated(self):
+        """
+        Drop the sources that cannot be validated against the file system.
+        """
+
+        try:
+            self.m_lock.acquire()
+
+            for (filename, sf) in list(self.m_files.items()):
+                if sf.m_signature is None:
+                    self.__remove(filename)
+                    self.m_invalidations += 1
+
+        finally:
+            self.m_lock.release()
+
+
+    def clear(self):
+        try:
+            self.m_lock.acquire()
+
+            self.m_files.clear()
+            self.m_bytes = 0
+
+        finally:
+            self.m_lock.release()
+
+
+    def get_stats(self):
+        try:
+            self.m_lock.acquire()
+
+            return {
+                'size': len(self.m_files),
+                'bytes': self.m_bytes,
+                'max_bytes': self.m_max_bytes,
+                'hits': self.m_hits,
+                'misses': self.m_misses,
+                'evictions': self.m_evictions,
+                'invalidations': self.m_invalidations
+                }
+
+        finally:
+            self.m_lock.release()
+
+
+g_source_cache = CSourceCache()
+
+
+def get_source_file(filename):
+    return g_source_cache.get(filename)
+
+
+def get_source(filename):
+    sf = get_source_file(filename)
+    return (sf.m_source, sf.m_encoding)
 
 
 def source_provider(filename):
@@ -170,18 +417,12 @@ def source_provider_filesystem(filename):
 
 
 def get_source_line(filename, lineno):
-    (lines, encoding, ffilesystem) = lines_cache(filename)
-
-    if lineno > len(lines):
-        return as_unicode('')
-
-    return lines[lineno - 1] + as_unicode('\n')
+    return get_source_file(filename).get_line(lineno)
 
 
 def is_provider_filesystem(filename):
     try:
-        (lines, encoding, ffilesystem) = lines_cache(filename)
-        return ffilesystem
+        return get_source_file(filename).m_ffilesystem
 
     except IOError:
         v = sys.exc_info()[1]
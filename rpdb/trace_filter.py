@@ -0,0 +1,195 @@
+import fnmatch
+import os
+import site
+import sysconfig
+
+from rpdb.exceptions import BadArgument
+from rpdb.utils import as_unicode, winlower
+
+TRACE_INCLUDE = 'include'
+TRACE_EXCLUDE = 'exclude'
+
+#
+# Pattern aliases which expand to the installation paths of
+# the running interpreter.
+#
+ALIAS_STDLIB = '<stdlib>'
+ALIAS_SITE_PACKAGES = '<site-packages>'
+
+GLOB_CHARS = '*?['
+
+
+def calc_alias_paths(alias):
+    """
+    Return the list of directories an alias pattern stands for.
+    """
+
+    if alias == ALIAS_STDLIB:
+        keys = ['stdlib', 'platstdlib']
+        paths = [sysconfig.get_paths().get(k, None) for k in keys]
+
+    elif alias == ALIAS_SITE_PACKAGES:
+        keys = ['purelib', 'platlib']
+        paths = [sysconfig.get_paths().get(k, None) for k in keys]
+
+        try:
+            paths += site.getsitepackages()
+            paths.append(site.getusersitepackages())
+        except AttributeError:
+            pass
+
+        #
+        # Third party packages of the interpreter a virtual environment
+        # was created from live in its stdlib directory.
+        #
+        for p in calc_alias_paths(ALIAS_STDLIB):
+            paths += [os.path.join(p, 'site-packages'), os.path.join(p, 'dist-packages')]
+
+    else:
+        return []
+
+    _paths = []
+    for p in paths:
+        if not p:
+            continue
+
+        p = winlower(os.path.join(os.path.abspath(p), ''))
+        if p not in _paths:
+            _paths.append(p)
+
+    return _paths
+
+
+def calc_alias_exclusions(alias):
+    """
+    Return the list of directories inside the directories of an alias
+    pattern which the alias does not stand for. Site packages are
+    installed inside the stdlib directory.
+    """
+
+    if alias == ALIAS_STDLIB:
+        return calc_alias_paths(ALIAS_SITE_PACKAGES)
+
+    return []
+
+
+
+class CTraceFilter:
+    """
+    Include/exclude rules that select which source files are traced.
+
+    A rule is an (action, pattern) pair where action is 'include' or
+    'exclude' and pattern is either a glob (if it contains glob characters),
+    a path prefix or one of the aliases '<stdlib>' and '<site-packages>'.
+    Rules are evaluated in order and the last matching rule wins. Files
+    that match no rule are traced.
+    """
+
+    def __init__(self, rules = None):
+        self.m_rules = []
+        self.m_matchers = []
+
+        self.set_rules(rules or [])
+
+
+    def set_rules(self, rules):
+        _rules = []
+        matchers = []
+
+        for r in rules:
+            try:
+                (action, pattern) = r
+            except (TypeError, ValueError):
+                raise BadArgument
+
+            action = as_unicode(action)
+            pattern = as_unicode(pattern)
+
+            if action not in [TRACE_INCLUDE, TRACE_EXCLUDE] or pattern == '':
+                raise BadArgument
+
+            _rules.append((action, pattern))
+            matchers.append((action == TRACE_EXCLUDE, self.__calc_matcher(pattern)))
+
+        self.m_rules = _rules
+        self.m_matchers = matchers
+
+
+    def get_rules(self):
+        return list(self.m_rules)
+
+
+    def __calc_matcher(self, pattern):
+        if pattern in [ALIAS_STDLIB, ALIAS_SITE_PACKAGES]:
+            prefixes = tuple(calc_alias_paths(pattern))
+            exclusions = tuple(calc_alias_exclusions(pattern))
+            return lambda filename: filename.startswith(prefixes) and not filename.startswith(exclusions)
+
+        _pattern = winlower(pattern)
+
+        if [c for c in GLOB_CHARS if c in _pattern]:
+            return lambda filename: fnmatch.fnmatchcase(filename, _pattern)
+
+        return lambda filename: filename.startswith(_pattern)
+
+
+    def is_excluded(self, filename):
+        """
+        Return True if code from filename should not be traced.
+        """
+
+        filename = winlower(filename)
+
+        fexcluded = False
+        for (fexclude, matcher) in self.m_matchers:
+            if matcher(filename):
+                fexcluded = fexclude
+
+        return fexcluded
+
+
+
+class CThreadFilter:
+    """
+    Selection of the threads that are traced, by glob patterns on the
+    thread name or by thread id. All threads are traced when both lists
+    are empty.
+    """
+
+    def __init__(self, names = None, tids = None):
+        self.m_names = []
+        self.m_tids = []
+
+        self.set_selection(names or [], tids or [])
+
+
+    def set_selection(self, names, tids):
+        try:
+            _names = [as_unicode(n) for n in names]
+            _tids = [int(t) for t in tids]
+        except (TypeError, ValueError):
+            raise BadArgument
+
+        if '' in _names:
+            raise BadArgument
+
+        self.m_names = _names
+        self.m_tids = _tids
+
+
+    def get_selection(self):
+        return (list(self.m_names), list(self.m_tids))
+
+
+    def is_selected(self, tid, name):
+        if len(self.m_names) == 0 and len(self.m_tids) == 0:
+            return True
+
+        if tid in self.m_tids:
+            return True
+
+        for pattern in self.m_names:
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+
+        return False
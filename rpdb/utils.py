@@ -20,7 +20,7 @@ except ImportError:
     pass
 
 from rpdb.globals import g_fDebug, g_traceback_lock, g_initial_cwd, g_found_unicode_files
-from rpdb.const import PYTHONW_FILE_EXTENSION, PYTHON_FILE_EXTENSION, PYTHONW_SO_EXTENSION
+from rpdb.const import PYTHONW_FILE_EXTENSION, PYTHON_FILE_EXTENSION, PYTHONW_SO_EXTENSION, PATH_CACHE_NEGATIVE_TTL
 
 
 def is_py3k():
@@ -349,6 +349,145 @@ def my_os_path_join(dirname, basename):
     return os.path.join(dirname, basename)
 
 
+class CPathCache:
+    """
+    Cache of file path resolutions, including the ones that failed.
+
+    Resolutions depend on sys.path, the current directory and PATH, and
+    the ones that look at loaded modules also on sys.modules. Entries
+    are dropped when these change. A failed resolution is also dropped
+    after PATH_CACHE_NEGATIVE_TTL seconds, in case the file was created
+    since.
+    """
+
+    def __init__(self):
+        self.m_lock = threading.Lock()
+
+        self.m_paths_token = None
+        self.m_modules_token = None
+
+        #
+        # Entries of resolutions that look at loaded modules, and of the
+        # ones that do not. An entry is a (path, t) tuple, where path is
+        # None for a failed resolution.
+        #
+        self.m_entries = {True: {}, False: {}}
+
+        #
+        # Maps lowered module names to module names.
+        #
+        self.m_module_names = None
+
+        self.m_hits = 0
+        self.m_misses = 0
+
+
+    def __calc_paths_token(self):
+        try:
+            cwd = getcwdu()
+        except (EnvironmentError, UnicodeDecodeError):
+            cwd = None
+
+        return (tuple(sys.path), cwd, tuple(g_initial_cwd), os.environ.get('PATH', ''))
+
+
+    def __validate(self, fModules):
+        paths_token = self.__calc_paths_token()
+        if paths_token != self.m_paths_token:
+            self.m_paths_token = paths_token
+            self.m_entries[True].clear()
+            self.m_entries[False].clear()
+
+        modules_token = len(sys.modules)
+        if fModules and modules_token != self.m_modules_token:
+            self.m_modules_token = modules_token
+            self.m_entries[True].clear()
+            self.m_module_names = None
+
+
+    def get(self, key, fModules):
+        """
+        Return the cached path, None for a failed resolution, or raise
+        KeyError.
+        """
+
+        try:
+            self.m_lock.acquire()
+
+            self.__validate(fModules)
+
+            entries = self.m_entries[fModules]
+            (path, t) = entries[key]
+
+            if path is None and time.time() > t + PATH_CACHE_NEGATIVE_TTL:
+                del entries[key]
+                raise KeyError(key)
+
+            self.m_hits += 1
+            return path
+
+        except KeyError:
+            self.m_misses += 1
+            raise
+
+        finally:
+            self.m_lock.release()
+
+
+    def set(self, key, fModules, path):
+        try:
+            self.m_lock.acquire()
+
+            self.__validate(fModules)
+            self.m_entries[fModules][key] = (path, time.time())
+
+        finally:
+            self.m_lock.release()
+
+
+    def get_module_names(self):
+        try:
+            self.m_lock.acquire()
+
+            self.__validate(True)
+
+            if self.m_module_names is None:
+                self.m_module_names = dict([(winlower(module_name), module_name) for module_name in list(sys.modules.keys())])
+
+            return self.m_module_names
+
+        finally:
+            self.m_lock.release()
+
+
+    def clear(self):
+        try:
+            self.m_lock.acquire()
+
+            self.m_paths_token = None
+            self.m_modules_token = None
+
+        finally:
+            self.m_lock.release()
+
+
+    def get_stats(self):
+        try:
+            self.m_lock.acquire()
+
+            return {
+                'size': len(self.m_entries[True]) + len(self.m_entries[False]),
+                'hits': self.m_hits,
+                'misses': self.m_misses
+                }
+
+        finally:
+            self.m_lock.release()
+
+
+g_path_cache = CPathCache()
+
+
 def FindFile(
         filename,
         sources_paths = [],
@@ -373,11 +512,33 @@ def FindFile(
     2. current path.
     3. PYTHONPATH
     4. PATH
+
+    Results, including failures, are cached in g_path_cache.
     """
 
     if filename in g_found_unicode_files:
         return filename
 
+    key = (filename, tuple(sources_paths), fAllowAnyExt)
+
+    try:
+        path = g_path_cache.get(key, fModules)
+
+    except KeyError:
+        try:
+            path = _FindFile(filename, sources_paths, fModules, fAllowAnyExt)
+        except IOError:
+            path = None
+
+        g_path_cache.set(key, fModules, path)
+
+    if path is None:
+        raise IOError
+
+    return path
+
+
+def _FindFile(filename, sources_paths, fModules, fAllowAnyExt):
     if filename.startswith('<'):
         raise IOError
 
@@ -494,18 +655,19 @@ def FindFileAsModule(filename):
 
     root_dotted = root.replace('\\', '.').replace('/', '.').replace(':', '.')
 
+    #
+    # Candidates are the loaded modules whose names prefix root_dotted,
+    # the longest first.
+    #
+    module_names = g_path_cache.get_module_names()
+    parts = root_dotted.split('.')
+
     match_list = []
-    for (module_name, m) in list(sys.modules.items()):
-        lowered_module_name = winlower(module_name)
-        if (root_dotted + '.').startswith(lowered_module_name + '.'):
+    for i in range(len(parts), 0, -1):
+        module_name = module_names.get('.'.join(parts[:i]), None)
+        if module_name is not None and module_name in sys.modules:
             match_list.append((len(module_name), module_name))
 
-            if lowered_module_name == root_dotted:
-                break
-
-    match_list.sort()
-    match_list.reverse()
-
     for (matched_len, matched_module) in match_list:
         try:
             module_dir = FindModuleDir(matched_module)
@@ -26,12 +26,13 @@ import rpdb.globals
 import rpdb.source_provider
 from rpdb.breakinfo import CScopeBreakInfo, CalcValidLines
 from rpdb.breakpoint import CBreakPointsManager
-from rpdb.compat import sets, unicode, str8, base64_decodestring
+from rpdb.code_cache import CWeakKeyCache
+from rpdb.compat import sets, unicode, str8, base64_decodestring, load_source
 from rpdb.const import *
 from rpdb.const import POSIX, \
     STR_STATE_BROKEN, STATE_BROKEN, STATE_RUNNING, STATE_ANALYZE, STATE_DETACHED, DEBUGGER_FILENAME, THREADING_FILENAME, \
     DEFAULT_NUMBER_OF_LINES, DICT_KEY_TID, DICT_KEY_STACK, \
-    DICT_KEY_CODE_LIST, DICT_KEY_CURRENT_TID, DICT_KEY_BROKEN, DICT_KEY_BREAKPOINTS, DICT_KEY_LINES, DICT_KEY_FILENAME, \
+    DICT_KEY_CODE_LIST, DICT_KEY_CURRENT_TID, DICT_KEY_BROKEN, DICT_KEY_TRACED, DICT_KEY_BREAKPOINTS, DICT_KEY_LINES, DICT_KEY_FILENAME, \
     DICT_KEY_FIRST_LINENO, DICT_KEY_FRAME_LINENO, DICT_KEY_EVENT, DICT_KEY_EXPR, DICT_KEY_NAME, DICT_KEY_REPR, \
     DICT_KEY_IS_VALID, DICT_KEY_TYPE, DICT_KEY_SUBNODES, DICT_KEY_N_SUBNODES, DICT_KEY_ERROR, PYTHON_FILE_EXTENSION, PYTHONW_FILE_EXTENSION
 from rpdb.crypto import is_encryption_supported
@@ -40,24 +41,30 @@ from rpdb.events import CEventNull, CEventEmbeddedSync, CEventClearSourceCache,
     CEventSignalException, CEventPsycoWarning, CEventConflictingModules, CEventSyncReceivers, \
     CEventForkSwitch, CEventExecSwitch, CEventExit, CEventState, CEventSynchronicity, CEventBreakOnExit, CEventTrap, \
     CEventForkMode, CEventUnhandledException, CEventNamespace, CEventNoThreads, CEventThreads, CEventThreadBroken, \
-    CEventStack, CEventStackDepth, CEventBreakpoint, CEventSync, breakpoint_copy, CEventDispatcher
+    CEventStack, CEventStackDepth, CEventBreakpoint, CEventSync, breakpoint_copy, CEventDispatcher, CEventLogRecords, \
+    CEventBreakSnapshot
+from rpdb.logpoints import CLogBuffer
+from rpdb.profiler import CSamplingProfiler
+from rpdb.snapshot import calc_snapshot_spec
 from rpdb.exceptions import InvalidScopeName, CException, NotPythonSource, BadArgument, ThreadNotFound, \
     NoThreads, ThreadDone, DebuggerNotBroken, InvalidFrame, NoExceptionFound, CConnectionException, NotAttached, EncryptionNotSupported
 from rpdb.repr import clip_filename, safe_str, safe_repr, parse_type, repr_ltd, calc_suffix
 from rpdb.rpc import CThread
 from rpdb.session_manager import CSessionManager, is_valid_pwd, calc_pwd_file_path, delete_pwd_file
 from rpdb.state_manager import CStateManager, lock_notify_all, g_alertable_waiters
+from rpdb.trace_filter import CTraceFilter, CThreadFilter, TRACE_INCLUDE, TRACE_EXCLUDE
 from rpdb.utils import is_unicode, as_unicode, as_string, as_bytes, print_debug, print_debug_exception, winlower, _print, \
     thread_is_alive, thread_get_name, current_thread, \
     detect_encoding, detect_locale, get_python_executable, ENCODING_AUTO, ENCODING_RAW, ENCODING_RAW_I, safe_wait, \
     my_os_path_join, FindFile, my_abspath, CalcScriptName, getcwd, getcwdu, g_safe_base64_from, _getpid
-from rpdb.source_provider import MODULE_SCOPE, MODULE_SCOPE2, lines_cache, g_lines_cache, get_source_line, \
+from rpdb.source_provider import MODULE_SCOPE, MODULE_SCOPE2, get_source_file, g_source_cache, get_source_line, \
     is_provider_filesystem, ENCODING_SOURCE
 
 if '.' in __name__:
     raise ImportError('rpdb2 must not be imported as part of a package!')
 
 import threading
+import weakref
 import traceback
 import platform
 import operator
@@ -72,7 +79,6 @@ import time
 import copy
 import sys
 import cmd
-import imp
 import os
 
 if sys.version_info[:2] < (3,2):
@@ -118,7 +124,9 @@ def start_embedded_debugger(
             timeout =TIMEOUT_FIVE_MINUTES,
             source_provider = None,
             fDebug = False,
-            depth = 0
+            depth = 0,
+            fMonitoring = False,
+            trace_filter = None
             ):
 
     """
@@ -155,6 +163,14 @@ def start_embedded_debugger(
         defaults to '0' so the top of stack will be in the code where
         start_embedded_debugger is called.
 
+    fMonitoring - Use the sys.monitoring (PEP 669) tracing engine instead of
+        sys.settrace(). Code that does not need tracing then runs at nearly
+        full speed. Requires Python 3.12 or later, ignored otherwise.
+
+    trace_filter - A list of ('include' | 'exclude', pattern) rules that
+        select which code is traced, e.g. [('exclude', '<site-packages>')].
+        See CSessionManager.set_trace_filter() for the rules syntax.
+
     IMPORTNAT SECURITY NOTE:
     USING A HARDCODED PASSWORD MAY BE UNSECURE SINCE ANYONE WITH READ
     PERMISSION TO THE SCRIPT WILL BE ABLE TO READ THE PASSWORD AND CONNECT TO
@@ -170,7 +186,9 @@ def start_embedded_debugger(
                         timeout,
                         source_provider,
                         fDebug,
-                        depth + 2
+                        depth + 2,
+                        fMonitoring,
+                        trace_filter
                         )
 
 
@@ -183,12 +201,20 @@ def start_embedded_debugger_interactive_password(
                 fDebug = False,
                 stdin = sys.stdin,
                 stdout = sys.stdout,
-                depth = 0
+                depth = 0,
+                fMonitoring = False,
+                trace_filter = None
                 ):
 
     if rpdb.globals.g_server is not None:
         return
 
+    #
+    # Validate the rules here, BadArgument is reported as a bad password below.
+    #
+    if trace_filter is not None:
+        CTraceFilter(trace_filter)
+
     while True:
         if stdout is not None:
             stdout.write('Please type password:')
@@ -204,7 +230,9 @@ def start_embedded_debugger_interactive_password(
                                 timeout,
                                 source_provider,
                                 fDebug,
-                                depth + 2
+                                depth + 2,
+                                fMonitoring,
+                                trace_filter
                                 )
 
         except BadArgument:
@@ -373,6 +401,7 @@ STATE_DISABLED = 'disabled'
 
 BP_FILENAME_SEP = ':'
 BP_EVAL_SEP = ','
+LP_EXPR_SEP = ';'
 
 RPDB_EXEC_INFO = as_unicode('rpdb_exception_info')
 
@@ -599,9 +628,63 @@ def IsPythonSourceFile(path):
 
 
 
+EMBEDDED_DEBUGGER_CALL = 'start_embedded_debugger('
+
+
+def hide_session_password(sf, lineno, lines):
+    """
+    Replace the password arguments of start_embedded_debugger() calls in
+    lines, which are the lines of source file sf from line lineno.
+    Calls that start before lineno and continue into lines are handled
+    too.
+    """
+
+    end = lineno + len(lines)
+    _lineno = 0
+
+    for call_lineno in sf.find_lines(EMBEDDED_DEBUGGER_CALL):
+        if call_lineno >= end:
+            break
+
+        #
+        # The call is inside the arguments of the previous one.
+        #
+        if call_lineno < _lineno:
+            continue
+
+        ls = sf.get_line(call_lineno).split(EMBEDDED_DEBUGGER_CALL, 1)
+        line = ls[0] + EMBEDDED_DEBUGGER_CALL + '"""...Removed-password-from-output...'
+
+        fhide_pwd_mode = not ')' in ls[1]
+        if fhide_pwd_mode:
+            line += '\n'
+        else:
+            line += '""")' + ls[1].split(')', 1)[1]
+
+        if call_lineno >= lineno:
+            lines[call_lineno - lineno] = line
+
+        _lineno = call_lineno + 1
+
+        while fhide_pwd_mode and _lineno < end:
+            line = sf.get_line(_lineno)
+            if line == '':
+                break
+
+            if not ')' in line:
+                line = as_unicode('...\n')
+            else:
+                line = '...""")' + line.split(')', 1)[1]
+                fhide_pwd_mode = False
+
+            if _lineno >= lineno:
+                lines[_lineno - lineno] = line
+
+            _lineno += 1
+
+
 def get_file_encoding(filename):
-    (lines, encoding, ffilesystem) = lines_cache(filename)
-    return encoding
+    return get_source_file(filename).m_encoding
 
 
 def calc_prefix(_str, n):
@@ -1014,17 +1097,33 @@ class CEventQueue:
             self.m_event_lock.release()
 
 
+    def notify(self):
+        """
+        Wake up waiters without firing an event, so they can check
+        for pending data.
+        """
+
+        try:
+            self.m_event_lock.acquire()
+            lock_notify_all(self.m_event_lock)
+
+        finally:
+            self.m_event_lock.release()
+
+
     def get_event_index(self):
         return self.m_event_index
 
 
-    def wait_for_event(self, timeout, event_index):
+    def wait_for_event(self, timeout, event_index, n_receivers = 1):
         """
         Return the events above index event_index which were fired.
+        n_receivers is the number of clients the caller waits for, as
+        counted by synchronized events.
         """
 
         try:
-            self.m_n_waiters.append(0)
+            self.m_n_waiters.extend([0] * n_receivers)
 
             self.m_event_lock.acquire()
             if event_index >= self.m_event_index:
@@ -1037,7 +1136,7 @@ class CEventQueue:
             return (self.m_event_index, sub_event_list)
 
         finally:
-            self.m_n_waiters.pop()
+            del self.m_n_waiters[-n_receivers:]
 
             self.m_event_lock.release()
 
@@ -1064,15 +1163,29 @@ class CCodeContext:
     Class represents info related to code objects.
     """
 
-    def __init__(self, frame, bp_manager):
-        self.m_code = frame.f_code
+    def __init__(self, frame, bp_manager, trace_filter):
+        #
+        # The code object itself is not kept, code contexts are cached
+        # by weak references to their code objects.
+        #
+        code = frame.f_code
+        self.m_code_name = code.co_name
         self.m_filename = calc_frame_path(frame)
         self.m_basename = os.path.basename(self.m_filename)
 
+        #
+        # Identity of the code object as used by the breakpoints
+        # manager to index breakpoints by code.
+        #
+        self.m_code_key = (winlower(self.m_filename), code.co_firstlineno)
+
         self.m_file_breakpoints = bp_manager.get_active_break_points_by_file(self.m_filename)
 
         self.m_fExceptionTrap = False
 
+        self.m_break_points_by_code = bp_manager.m_break_points_by_code
+        self.m_fFiltered = trace_filter.is_excluded(self.m_filename)
+
 
     def is_untraced(self):
         """
@@ -1082,6 +1195,15 @@ class CCodeContext:
         return self.m_basename in [THREADING_FILENAME, DEBUGGER_FILENAME]
 
 
+    def is_filtered(self):
+        """
+        Return True if this code object is excluded by the trace filter.
+        Code with breakpoints is always traced.
+        """
+
+        return self.m_fFiltered and not self.m_code_key in self.m_break_points_by_code
+
+
     def is_exception_trap_frame(self):
         """
         Return True if this frame should be a trap for unhandled
@@ -1091,7 +1213,7 @@ class CCodeContext:
         if self.m_basename == THREADING_FILENAME:
             return True
 
-        if self.m_basename == DEBUGGER_FILENAME and self.m_code.co_name in ['__execv', '__execve', '__function_wrapper']:
+        if self.m_basename == DEBUGGER_FILENAME and self.m_code_name in ['__execv', '__execve', '__function_wrapper']:
             return True
 
         return False
@@ -1129,6 +1251,8 @@ class CDebuggerCoreThread:
 
         self.m_exc_info = None
 
+        self.m_fselected = True
+
         self.m_depth = 0
         self.set_depth(frame)
 
@@ -1184,6 +1308,11 @@ class CDebuggerCoreThread:
 
             try:
                 self.m_code_context = self.m_core.m_code_contexts[self.m_frame.f_code]
+            except KeyError:
+                #
+                # The context of the caller was evicted from the cache.
+                #
+                self.m_code_context = self.m_core.get_code_context(self.m_frame)
             except AttributeError:
                 if self.m_event != 'return' and self.m_core.m_ftrap:
                     #
@@ -1207,8 +1336,10 @@ class CDebuggerCoreThread:
                     self.m_frame = None
 
                 self.m_core.remove_thread(self.m_thread_id)
-                sys.setprofile(None)
-                sys.settrace(self.m_core.trace_dispatch_init)
+
+                if self.m_core.m_monitoring is None:
+                    sys.setprofile(None)
+                    sys.settrace(self.m_core.trace_dispatch_init)
 
             if self.m_frame_external_references == 0:
                 return
@@ -1409,6 +1540,24 @@ class CDebuggerCoreThread:
         if not bp.m_fEnabled:
             return False
 
+        if not bp.count_hit():
+            return False
+
+        if not self.__eval_condition(frame, bp):
+            return False
+
+        if bp.m_log_codes is not None:
+            self.__log_breakpoint(frame, bp)
+            return False
+
+        return True
+
+
+    def __eval_condition(self, frame, bp):
+        """
+        Return True if the condition of the breakpoint is true.
+        """
+
         if bp.m_expr == '':
             return True
 
@@ -1425,6 +1574,30 @@ class CDebuggerCoreThread:
             return False
 
 
+    def __log_breakpoint(self, frame, bp):
+        """
+        Record the values of the expressions of a logpoint.
+        The thread does not break.
+        """
+
+        if frame in self.m_locals_copy:
+            l = self.m_locals_copy[frame][0]
+        else:
+            l = frame.f_locals
+
+        values = []
+        for code in bp.m_log_codes:
+            try:
+                v = eval(code, frame.f_globals, l)
+                values.append(repr_ltd(v, LOG_VALUE_LENGTH, ENCODING_AUTO))
+            except:
+                (t, v, tb) = sys.exc_info()
+                values.append(as_unicode('<%s: %s>' % (t.__name__, safe_str(v))))
+
+        record = (time.time(), self.m_thread_id, bp.m_id, frame.f_lineno, values)
+        self.m_core.m_log_buffer.append(record)
+
+
     def set_local_trace(self, frame, fsignal_exception = False):
         """
         Set trace callback of frame.
@@ -1432,7 +1605,14 @@ class CDebuggerCoreThread:
         during actual tracing.
         """
 
-        if not self.m_core.m_ftrace:
+        self.__set_local_trace(frame, fsignal_exception)
+
+        if self.m_core.m_monitoring is not None:
+            self.m_core.m_monitoring.watch_frame(frame)
+
+
+    def __set_local_trace(self, frame, fsignal_exception):
+        if not self.m_core.m_ftrace or not self.m_fselected:
             frame.f_trace = self.trace_dispatch_stop
             return
 
@@ -1442,13 +1622,16 @@ class CDebuggerCoreThread:
 
         code_context = self.m_core.get_code_context(frame)
 
-        if self.m_core.is_break(self, frame):
+        if code_context.is_filtered() and not code_context.m_fExceptionTrap and (frame.f_back is not None):
+            del frame.f_trace
+
+        elif self.m_core.is_break(self, frame):
             frame.f_trace = self.trace_dispatch_break
 
         elif code_context.m_fExceptionTrap or (frame.f_back is None):
             frame.f_trace = self.trace_dispatch_trap
 
-        elif frame.f_code.co_name in self.m_bp_manager.m_break_points_by_function:
+        elif code_context.m_code_key in self.m_bp_manager.m_break_points_by_code:
             frame.f_trace = self.trace_dispatch
 
         elif frame in self.m_locals_copy:
@@ -1466,6 +1649,9 @@ class CDebuggerCoreThread:
         Set trace callbacks for all frames in stack.
         """
 
+        if self.m_core.m_monitoring is not None:
+            self.m_core.m_monitoring.refresh()
+
         try:
             try:
                 f = self.frame_acquire()
@@ -1489,6 +1675,13 @@ class CDebuggerCoreThread:
         if frame in self.m_locals_copy:
             self.update_locals()
 
+        #
+        # Frames of a thread that was deselected and selected again may
+        # still point here, they are simply released.
+        #
+        if not self.m_fselected and not self.m_core.untrace_thread(self):
+            return None
+
         sys.settrace(None)
         sys.setprofile(None)
         return None
@@ -1527,10 +1720,22 @@ class CDebuggerCoreThread:
         if not self.m_core.m_ftrace:
             return self.trace_dispatch_stop(frame, event, arg)
 
+        if not self.m_fselected:
+            return self.trace_dispatch_stop(frame, event, arg)
+
         self.m_depth += 1
         if self.m_depth > g_recursionlimit:
             sys.setprofile(self.profile_recursion)
 
+        return self.dispatch_call(frame, event, arg)
+
+
+    def dispatch_call(self, frame, event, arg):
+        """
+        Handle a call event, shared by the settrace and the
+        sys.monitoring engines.
+        """
+
         self.m_frame = frame
 
         try:
@@ -1538,6 +1743,14 @@ class CDebuggerCoreThread:
         except KeyError:
             self.m_code_context = self.m_core.get_code_context(frame)
 
+        #
+        # Exception trap frames are handled as unfiltered code, so
+        # excluding their modules does not stop unhandled exceptions
+        # from being trapped.
+        #
+        if self.m_code_context.m_fFiltered and self.m_code_context.is_filtered() and not self.m_code_context.m_fExceptionTrap:
+            return None
+
         if self.m_core.m_fBreak or (self.m_core.m_step_tid == self.m_thread_id):
             self.m_event = event
             self.m_core._break(self, frame, event, arg)
@@ -1546,7 +1759,7 @@ class CDebuggerCoreThread:
                 self.set_local_trace(frame)
             return frame.f_trace
 
-        if not frame.f_code.co_name in self.m_bp_manager.m_break_points_by_function:
+        if not self.m_code_context.m_code_key in self.m_bp_manager.m_break_points_by_code:
             return None
 
         bp = self.m_code_context.m_file_breakpoints.get(frame.f_lineno, None)
@@ -1651,7 +1864,11 @@ class CDebuggerCoreThread:
         if event == 'exception':
             self.m_event = event
 
-            if self.m_code_context.m_fExceptionTrap and self.m_core.m_ftrap:
+            #
+            # While the debugger is idle there is no profile hook to keep
+            # m_code_context current, so the context of frame is used.
+            #
+            if self.m_core.get_code_context(frame).m_fExceptionTrap and self.m_core.m_ftrap:
                 self.set_exc_info(arg)
 
                 self.m_fUnhandledException = True
@@ -1683,7 +1900,9 @@ class CDebuggerCoreThread:
         self.set_exc_info(arg)
         self.set_tracers()
         self.set_depth(frame)
-        sys.setprofile(self.profile)
+
+        if self.m_core.m_monitoring is None:
+            sys.setprofile(self.profile)
 
         return self.trace_dispatch_trap(frame, event, arg)
 
@@ -1725,10 +1944,13 @@ class CDebuggerCoreThread:
         """
 
         bp = self.m_code_context.m_file_breakpoints.get(self.m_frame.f_lineno, None)
-        if bp is not None and self.__eval_breakpoint(self.m_frame, bp):
-            return True
+        if bp is None or not bp.m_fEnabled or bp.m_log_codes is not None:
+            return False
 
-        return False
+        #
+        # The hit was already counted and filtered on the way here.
+        #
+        return self.__eval_condition(self.m_frame, bp)
 
 
     def get_breakpoint(self):
@@ -1740,193 +1962,577 @@ class CDebuggerCoreThread:
 
 
 
-class CDebuggerCore:
+def is_monitoring_supported():
     """
-    Base class for the debugger.
-    Handles basic debugger functionality.
+    Return True if the sys.monitoring API (PEP 669) is available.
     """
 
-    def __init__(self, fembedded = False):
-        self.m_ftrace = True
+    return hasattr(sys, 'monitoring')
 
-        self.m_current_ctx = None
-        self.m_f_first_to_break = True
-        self.m_f_break_on_init = False
 
-        self.m_builtins_hack = None
 
-        self.m_timer_embedded_giveup = None
+class CMonitoringEngine:
+    """
+    Tracing engine based on sys.monitoring (PEP 669) for Python 3.12+.
+
+    Monitoring callbacks are translated to the trace methods of
+    CDebuggerCoreThread so break, step, next, return and exception
+    trapping keep their semantics. Code objects that do not need
+    tracing are disabled with sys.monitoring.DISABLE on their first
+    call and then run at full speed. Line and return events are
+    enabled locally on code objects of frames that have a trace
+    method, and globally only while a break or a step is pending.
+
+    Limitations: a loop that fits on a single line reports its line
+    once per entry, and PY_THROW into generators is not reported.
+    """
 
-        self.m_threads_lock = threading.Condition()
+    def __init__(self, core_debugger):
+        self.m_core = core_debugger
 
-        self.m_threads = {}
+        self.m_lock = threading.RLock()
+        self.m_fstarted = False
+        self.m_fglobal = False
+        self.m_watched_codes = {}
 
-        self.m_event_dispatcher = CEventDispatcher()
-        self.m_state_manager = CStateManager(STATE_RUNNING, self.m_event_dispatcher)
 
-        self.m_ffork_into_child = False
-        self.m_ffork_auto = False
+    def __calc_callbacks(self):
+        events = sys.monitoring.events
 
-        self.m_fsynchronicity = True
-        self.m_ftrap = True
-        self.m_fUnhandledException = False
-        self.m_fBreak = False
+        return [
+            (events.PY_START, self.__on_start),
+            (events.PY_RESUME, self.__on_start),
+            (events.LINE, self.__on_line),
+            (events.PY_RETURN, self.__on_return),
+            (events.PY_YIELD, self.__on_return),
+            (events.PY_UNWIND, self.__on_unwind),
+            (events.RAISE, self.__on_raise)
+            ]
 
-        self.m_lastest_event = None
-        self.m_step_tid = None
-        self.m_next_frame = None
-        self.m_return_frame = None
-        self.m_saved_step = (None, None, None)
-        self.m_saved_next = None
 
-        self.m_bp_manager = CBreakPointsManager()
+    def __calc_global_events(self, fglobal):
+        events = sys.monitoring.events
 
-        self.m_code_contexts = {None: None}
+        if self.m_core.m_fidle:
+            if self.m_core.m_ftrap:
+                return events.RAISE | events.PY_UNWIND
 
-        self.m_fembedded = fembedded
-        self.m_embedded_event = threading.Event()
-        self.m_embedded_sync_t0 = 0
-        self.m_embedded_sync_t1 = 0
+            return 0
 
-        self.m_heartbeats = {0: time.time() + 3600}
+        global_events = events.PY_START | events.PY_RESUME | events.RAISE | events.PY_UNWIND
+        if fglobal:
+            global_events |= events.LINE | events.PY_RETURN | events.PY_YIELD
 
+        return global_events
 
-    def shutdown(self):
-        self.m_event_dispatcher.shutdown()
-        self.m_state_manager.shutdown()
 
+    def start(self):
+        """
+        Claim the debugger tool id and install the callbacks.
+        Return False if the tool id can not be claimed, in which case
+        the caller should fall back to sys.settrace().
+        """
 
-    def is_embedded(self):
-        return self.m_fembedded
+        if self.m_fstarted:
+            return True
 
+        try:
+            sys.monitoring.use_tool_id(sys.monitoring.DEBUGGER_ID, 'rpdb2')
+        except ValueError:
+            print_debug('sys.monitoring debugger tool id is taken, falling back to sys.settrace().')
+            return False
 
-    def send_fork_switch(self, sync_n):
-        """
-        Notify client that debuggee is forking and that it should
-        try to reconnect to the child.
-        """
+        for event, callback in self.__calc_callbacks():
+            sys.monitoring.register_callback(sys.monitoring.DEBUGGER_ID, event, callback)
 
-        print_debug('Sending fork switch event')
+        self.m_fstarted = True
+        self.m_fglobal = False
+        self.refresh(fforce = True)
 
-        event = CEventForkSwitch(sync_n)
-        self.m_event_dispatcher.fire_event(event)
+        return True
 
 
-    def send_exec_switch(self, sync_n):
+    def stop(self):
         """
-        Notify client that debuggee is doing an exec and that it should
-        try to reconnect (in case the exec failed).
+        Remove the callbacks and release the debugger tool id.
         """
 
-        print_debug('Sending exec switch event')
+        if not self.m_fstarted:
+            return
 
-        event = CEventExecSwitch(sync_n)
-        self.m_event_dispatcher.fire_event(event)
+        try:
+            self.m_lock.acquire()
 
+            self.m_fstarted = False
 
-    def send_event_exit(self):
-        """
-        Notify client that the debuggee is shutting down.
-        """
+            sys.monitoring.set_events(sys.monitoring.DEBUGGER_ID, 0)
+            self.__reset_local_events()
 
-        event = CEventExit()
-        self.m_event_dispatcher.fire_event(event)
+            for event, callback in self.__calc_callbacks():
+                sys.monitoring.register_callback(sys.monitoring.DEBUGGER_ID, event, None)
 
+            sys.monitoring.free_tool_id(sys.monitoring.DEBUGGER_ID)
 
-    def send_events(self, event):
-        pass
+        finally:
+            self.m_lock.release()
 
 
-    def set_request_go_timer(self, timeout):
+    def refresh(self, fforce = False):
         """
-        Set timeout thread to release debugger from waiting for a client
-        to attach.
+        Recalculate the enabled events after the break state, the step
+        state or the breakpoints have changed. Return True if the trace
+        methods of all threads were reset.
         """
 
-        self.cancel_request_go_timer()
+        if not self.m_fstarted:
+            return False
 
-        if timeout is None:
-            return
+        fglobal = (not self.m_core.m_fidle) and (self.m_core.m_fBreak or (self.m_core.m_step_tid is not None))
+        if not fforce and (fglobal == self.m_fglobal):
+            return False
 
-        _timeout = max(1.0, timeout)
+        try:
+            self.m_lock.acquire()
 
-        f = lambda: (
-            self.record_client_heartbeat(0, False, True),
-            self.request_go()
-            )
+            self.m_fglobal = fglobal
+            self.__reset_local_events()
 
-        self.m_timer_embedded_giveup = threading.Timer(_timeout, f)
-        self.m_timer_embedded_giveup.start()
+            sys.monitoring.set_events(sys.monitoring.DEBUGGER_ID, self.__calc_global_events(fglobal))
+            sys.monitoring.restart_events()
 
-        #
-        # sleep() releases control and allow timer thread to actually start
-        # before this scope returns.
-        #
-        time.sleep(0.1)
+        finally:
+            self.m_lock.release()
 
+        for ctx in list(self.m_core.m_threads.values()):
+            ctx.set_tracers()
 
-    def cancel_request_go_timer(self):
-        t = self.m_timer_embedded_giveup
-        if t is not None:
-            self.m_timer_embedded_giveup = None
-            t.cancel()
+        return True
 
 
-    def setbreak(self, f):
+    def watch_frame(self, frame):
         """
-        Set thread to break on next statement.
+        Enable local line and return events on the code object of frame
+        if the frame has a trace method.
         """
 
-        if not self.m_ftrace:
+        if not self.m_fstarted or frame.f_trace is None:
             return
 
-        tid = thread.get_ident()
+        code = frame.f_code
+        if code in self.m_watched_codes:
+            return
 
-        if not tid in self.m_threads:
-            return self.settrace(f)
+        events = sys.monitoring.events
 
-        ctx = self.m_threads[tid]
-        f.f_trace = ctx.trace_dispatch_break
-        self.m_saved_next = self.m_next_frame
-        self.m_next_frame = f
+        try:
+            self.m_lock.acquire()
 
+            self.m_watched_codes[code] = True
+            sys.monitoring.set_local_events(sys.monitoring.DEBUGGER_ID, code, events.LINE | events.PY_RETURN | events.PY_YIELD)
 
-    def settrace(self, f = None, f_break_on_init = True, timeout = None, builtins_hack = None):
-        """
-        Start tracing mechanism for thread.
-        """
+        finally:
+            self.m_lock.release()
 
-        if not self.m_ftrace:
-            return
 
-        tid = thread.get_ident()
-        if tid in self.m_threads:
-            return
+    def __reset_local_events(self):
+        for code in list(self.m_watched_codes.keys()):
+            sys.monitoring.set_local_events(sys.monitoring.DEBUGGER_ID, code, 0)
 
-        self.set_request_go_timer(timeout)
+        self.m_watched_codes = {}
 
-        self.m_f_break_on_init = f_break_on_init
-        self.m_builtins_hack = builtins_hack
 
-        threading.settrace(self.trace_dispatch_init)
-        sys.settrace(self.trace_dispatch_init)
+    def __is_traced_code(self, code_context):
+        """
+        Return True if calls to this code object must be traced.
+        """
 
-        if f is not None:
-            f.f_trace = self.trace_dispatch_init
+        if code_context.m_fExceptionTrap:
+            return True
 
+        return code_context.m_code_key in self.m_core.m_bp_manager.m_break_points_by_code
 
-    def stoptrace(self):
+
+    def __is_trap_candidate(self, frame, exception):
         """
-        Stop tracing mechanism.
+        Return True if an exception in a frame of a thread that is not
+        yet debugged may be an unhandled exception.
         """
 
-        global g_fignore_atexit
+        if not self.m_core.m_ftrap:
+            return False
 
-        g_fignore_atexit = True
+        if frame.f_back is None:
+            return True
 
-        threading.settrace(None)
-        sys.settrace(None)
-        sys.setprofile(None)
+        if not self.m_core.get_code_context(frame).is_exception_trap_frame():
+            return False
+
+        #
+        # Only exceptions that propagate from traced code are of interest,
+        # exceptions raised and handled inside the trap module are not.
+        #
+        tb = exception.__traceback__
+        if tb is None or tb.tb_next is None:
+            return False
+
+        return not self.m_core.get_code_context(tb.tb_next.tb_frame).is_untraced()
+
+
+    def __get_ctx(self, frame, event):
+        """
+        Return the context of the current thread. The thread is registered
+        with the debugger on its first relevant event.
+        """
+
+        ctx = self.m_core.m_threads.get(thread.get_ident(), None)
+        if ctx is not None:
+            if not ctx.m_fselected:
+                self.m_core.untrace_thread(ctx)
+                return None
+
+            return ctx
+
+        if isinstance(current_thread(), CThread):
+            return None
+
+        if not self.m_core.is_thread_selected():
+            return None
+
+        return self.m_core.init_thread(frame, event)
+
+
+    def __dispatch(self, ctx, frame, event, arg):
+        """
+        Call the trace method of frame, the way the interpreter does
+        for sys.settrace() local trace functions.
+        """
+
+        tracer = frame.f_trace
+        if tracer is None:
+            if not self.m_fglobal:
+                return
+
+            ctx.set_local_trace(frame)
+
+            tracer = frame.f_trace
+            if tracer is None:
+                return
+
+        ctx.m_frame = frame
+        ctx.m_code_context = self.m_core.get_code_context(frame)
+
+        _tracer = tracer(frame, event, arg)
+        if _tracer is not None:
+            frame.f_trace = _tracer
+
+
+    def __on_start(self, code, instruction_offset):
+        frame = sys._getframe(1)
+
+        code_context = self.m_core.get_code_context(frame)
+        if not self.m_fglobal and not self.__is_traced_code(code_context):
+            return sys.monitoring.DISABLE
+
+        if code_context.is_filtered() and not code_context.m_fExceptionTrap:
+            return sys.monitoring.DISABLE
+
+        ctx = self.__get_ctx(frame, 'call')
+        if ctx is None:
+            return None
+
+        _tracer = ctx.dispatch_call(frame, 'call', None)
+        if _tracer is not None:
+            frame.f_trace = _tracer
+            self.watch_frame(frame)
+
+        return None
+
+
+    def __on_line(self, code, line_number):
+        frame = sys._getframe(1)
+
+        if frame.f_trace is None:
+            if not self.m_fglobal:
+                return None
+
+            code_context = self.m_core.get_code_context(frame)
+            if (code_context.is_untraced() or code_context.is_filtered()) and not code_context.m_fExceptionTrap:
+                return sys.monitoring.DISABLE
+
+        ctx = self.__get_ctx(frame, 'line')
+        if ctx is None:
+            return None
+
+        self.__dispatch(ctx, frame, 'line', None)
+        return None
+
+
+    def __on_return(self, code, instruction_offset, retval):
+        self.__dispatch_return(sys._getframe(1), retval)
+
+
+    def __on_unwind(self, code, instruction_offset, exception):
+        self.__dispatch_return(sys._getframe(1), None)
+
+
+    def __dispatch_return(self, frame, arg):
+        ctx = self.m_core.m_threads.get(thread.get_ident(), None)
+        if ctx is None:
+            return
+
+        if frame.f_trace is not None:
+            self.__dispatch(ctx, frame, 'return', arg)
+
+        if frame.f_back is not None:
+            self.m_core.get_code_context(frame.f_back)
+
+        ctx.profile(frame, 'return', arg)
+
+
+    def __on_raise(self, code, instruction_offset, exception):
+        frame = sys._getframe(1)
+
+        if frame.f_trace is None and not self.m_fglobal:
+            if thread.get_ident() in self.m_core.m_threads:
+                return
+
+            if not self.__is_trap_candidate(frame, exception):
+                return
+
+        ctx = self.__get_ctx(frame, 'exception')
+        if ctx is None:
+            return
+
+        self.__dispatch(ctx, frame, 'exception', (type(exception), exception, exception.__traceback__))
+
+
+
+class CDebuggerCore:
+    """
+    Base class for the debugger.
+    Handles basic debugger functionality.
+    """
+
+    def __init__(self, fembedded = False, fmonitoring = False):
+        self.m_ftrace = True
+
+        self.m_current_ctx = None
+        self.m_f_first_to_break = True
+        self.m_f_break_on_init = False
+
+        self.m_builtins_hack = None
+
+        self.m_timer_embedded_giveup = None
+
+        self.m_threads_lock = threading.Condition()
+
+        self.m_threads = {}
+
+        self.m_event_dispatcher = CEventDispatcher()
+        self.m_state_manager = CStateManager(STATE_RUNNING, self.m_event_dispatcher)
+
+        self.m_ffork_into_child = False
+        self.m_ffork_auto = False
+
+        self.m_fsynchronicity = True
+        self.m_ftrap = True
+        self.m_fUnhandledException = False
+        self.m_fBreak = False
+
+        self.m_lastest_event = None
+        self.m_step_tid = None
+        self.m_next_frame = None
+        self.m_return_frame = None
+        self.m_saved_step = (None, None, None)
+        self.m_saved_next = None
+
+        self.m_bp_manager = CBreakPointsManager()
+
+        self.m_code_contexts = CWeakKeyCache()
+
+        #
+        # Code contexts may be evicted from the cache, so the code objects
+        # of the exception trap frames are kept apart.
+        #
+        self.m_exception_trap_codes = weakref.WeakSet()
+
+        self.m_trace_filter = CTraceFilter()
+
+        self.m_thread_filter = CThreadFilter()
+        self.m_untraced_threads = {}
+
+        self.m_log_buffer = CLogBuffer()
+
+        self.m_profiler = CSamplingProfiler(calc_frame_path)
+
+        self.m_fembedded = fembedded
+        self.m_embedded_event = threading.Event()
+        self.m_embedded_sync_t0 = 0
+        self.m_embedded_sync_t1 = 0
+
+        self.m_heartbeats = {0: time.time() + 3600}
+
+        self.m_fidle = False
+
+        self.m_monitoring = None
+        if fmonitoring and is_monitoring_supported():
+            self.m_monitoring = CMonitoringEngine(self)
+
+
+    def shutdown(self):
+        self.m_event_dispatcher.shutdown()
+        self.m_state_manager.shutdown()
+
+
+    def is_embedded(self):
+        return self.m_fembedded
+
+
+    def send_fork_switch(self, sync_n):
+        """
+        Notify client that debuggee is forking and that it should
+        try to reconnect to the child.
+        """
+
+        print_debug('Sending fork switch event')
+
+        event = CEventForkSwitch(sync_n)
+        self.m_event_dispatcher.fire_event(event)
+
+
+    def send_exec_switch(self, sync_n):
+        """
+        Notify client that debuggee is doing an exec and that it should
+        try to reconnect (in case the exec failed).
+        """
+
+        print_debug('Sending exec switch event')
+
+        event = CEventExecSwitch(sync_n)
+        self.m_event_dispatcher.fire_event(event)
+
+
+    def send_event_exit(self):
+        """
+        Notify client that the debuggee is shutting down.
+        """
+
+        event = CEventExit()
+        self.m_event_dispatcher.fire_event(event)
+
+
+    def send_events(self, event):
+        pass
+
+
+    def set_request_go_timer(self, timeout):
+        """
+        Set timeout thread to release debugger from waiting for a client
+        to attach.
+        """
+
+        self.cancel_request_go_timer()
+
+        if timeout is None:
+            return
+
+        _timeout = max(1.0, timeout)
+
+        f = lambda: (
+            self.record_client_heartbeat(0, False, True),
+            self.request_go()
+            )
+
+        self.m_timer_embedded_giveup = threading.Timer(_timeout, f)
+        self.m_timer_embedded_giveup.start()
+
+        #
+        # sleep() releases control and allow timer thread to actually start
+        # before this scope returns.
+        #
+        time.sleep(0.1)
+
+
+    def cancel_request_go_timer(self):
+        t = self.m_timer_embedded_giveup
+        if t is not None:
+            self.m_timer_embedded_giveup = None
+            t.cancel()
+
+
+    def setbreak(self, f):
+        """
+        Set thread to break on next statement.
+        """
+
+        if not self.m_ftrace:
+            return
+
+        tid = thread.get_ident()
+
+        if not tid in self.m_threads:
+            return self.settrace(f)
+
+        ctx = self.m_threads[tid]
+        f.f_trace = ctx.trace_dispatch_break
+        self.m_saved_next = self.m_next_frame
+        self.m_next_frame = f
+
+        if self.m_monitoring is not None:
+            self.m_monitoring.watch_frame(f)
+
+        self.check_idle()
+
+
+    def settrace(self, f = None, f_break_on_init = True, timeout = None, builtins_hack = None):
+        """
+        Start tracing mechanism for thread.
+        """
+
+        if not self.m_ftrace:
+            return
+
+        tid = thread.get_ident()
+        if tid in self.m_threads:
+            return
+
+        self.set_request_go_timer(timeout)
+
+        self.m_f_break_on_init = f_break_on_init
+        self.m_builtins_hack = builtins_hack
+
+        if self.m_monitoring is not None and not self.m_monitoring.start():
+            self.m_monitoring = None
+
+        if self.m_monitoring is not None:
+            if f is not None:
+                f.f_trace = self.trace_dispatch_init
+                self.m_monitoring.watch_frame(f)
+
+            return
+
+        threading.settrace(self.trace_dispatch_init)
+        sys.settrace(self.trace_dispatch_init)
+
+        if f is not None:
+            f.f_trace = self.trace_dispatch_init
+
+
+    def stoptrace(self):
+        """
+        Stop tracing mechanism.
+        """
+
+        global g_fignore_atexit
+
+        g_fignore_atexit = True
+
+        threading.settrace(None)
+        sys.settrace(None)
+        sys.setprofile(None)
+
+        if self.m_monitoring is not None:
+            self.m_monitoring.stop()
 
         self.m_ftrace = False
         self.set_all_tracers()
@@ -1948,10 +2554,152 @@ class CDebuggerCore:
                     self.m_builtins_hack = None
                     frame.f_globals['__builtins__'] = rpdb.globals.g_builtins_module
 
-            code_context = CCodeContext(frame, self.m_bp_manager)
+            code_context = CCodeContext(frame, self.m_bp_manager, self.m_trace_filter)
+            code_context.m_fExceptionTrap = frame.f_code in self.m_exception_trap_codes
             return self.m_code_contexts.setdefault(frame.f_code, code_context)
 
 
+    def set_trace_filter(self, rules):
+        """
+        Set the include/exclude rules that select which code is traced
+        and update the cached decision of known code objects.
+        """
+
+        self.m_trace_filter.set_rules(rules)
+
+        for code_context in self.m_code_contexts.values():
+            code_context.m_fFiltered = self.m_trace_filter.is_excluded(code_context.m_filename)
+
+        self.set_all_tracers()
+
+
+    def get_trace_filter(self):
+        return self.m_trace_filter.get_rules()
+
+
+    def get_code_cache_stats(self):
+        return self.m_code_contexts.get_stats()
+
+
+    def is_thread_selected(self):
+        """
+        Return True if the current thread is selected for tracing.
+        Threads that are not selected are recorded for the thread list.
+        """
+
+        t = current_thread()
+        tid = thread.get_ident()
+
+        if self.m_untraced_threads.get(tid, None) is t:
+            return False
+
+        #
+        # Debugger threads are never traced, they may still get here when
+        # threading.settrace_all_threads() reinstalls the trace hooks.
+        #
+        if isinstance(t, CThread):
+            return False
+
+        if self.m_thread_filter.is_selected(tid, thread_get_name(t)):
+            return True
+
+        self.m_untraced_threads[tid] = t
+        return False
+
+
+    def untrace_thread(self, ctx):
+        """
+        Stop debugging the current thread after it was deselected.
+        Return False if ctx no longer debugs the thread.
+        """
+
+        try:
+            self.m_threads_lock.acquire()
+
+            if self.m_threads.get(ctx.m_thread_id, None) is not ctx:
+                return False
+
+            self.remove_thread(ctx.m_thread_id)
+
+        finally:
+            self.m_threads_lock.release()
+
+        self.m_untraced_threads[ctx.m_thread_id] = current_thread()
+        return True
+
+
+    def get_untraced_threads(self):
+        """
+        Return a dictionary of thread ids to threads that are alive and
+        not selected for tracing.
+        """
+
+        frames = sys._current_frames()
+
+        for tid in list(self.m_untraced_threads.keys()):
+            if tid in frames and not tid in self.m_threads:
+                continue
+
+            try:
+                del self.m_untraced_threads[tid]
+            except KeyError:
+                pass
+
+        frames = None
+
+        return dict(self.m_untraced_threads)
+
+
+    def set_thread_filter(self, names, tids):
+        """
+        Select the threads that are traced by glob patterns on their names
+        or by thread ids. All threads are traced if both lists are empty.
+        """
+
+        self.m_thread_filter.set_selection(names, tids)
+
+        funtraced = False
+        for (tid, t) in list(self.m_untraced_threads.items()):
+            if self.m_thread_filter.is_selected(tid, thread_get_name(t)):
+                funtraced = True
+                self.m_untraced_threads.pop(tid, None)
+
+        for ctx in list(self.m_threads.values()):
+            fselected = self.m_thread_filter.is_selected(ctx.m_thread_id, ctx.m_thread_name)
+            if fselected == ctx.m_fselected:
+                continue
+
+            ctx.m_fselected = fselected
+            ctx.set_tracers()
+
+        #
+        # Threads that are selected again have no trace hook. It can be
+        # reinstalled from this thread only with Python 3.12 or later,
+        # earlier versions keep them untraced.
+        #
+        if not funtraced or not self.m_ftrace or self.m_fidle or self.m_monitoring is not None:
+            return
+
+        if hasattr(threading, 'settrace_all_threads'):
+            threading.settrace_all_threads(self.trace_dispatch_init)
+
+
+    def get_thread_filter(self):
+        return self.m_thread_filter.get_selection()
+
+
+    def start_profiler(self, interval):
+        self.m_profiler.start(interval)
+
+
+    def stop_profiler(self):
+        self.m_profiler.stop()
+
+
+    def get_profile(self):
+        return self.m_profiler.get_profile()
+
+
     def get_current_ctx(self):
         if len(self.m_threads) == 0:
             raise NoThreads
@@ -2007,6 +2755,7 @@ class CDebuggerCore:
         while frame is not None:
             code_context = self.get_code_context(frame)
             if code_context.is_exception_trap_frame():
+                self.m_exception_trap_codes.add(frame.f_code)
                 code_context.m_fExceptionTrap = True
                 return
 
@@ -2033,7 +2782,10 @@ class CDebuggerCore:
 
 
     def clear_source_cache(self):
-        g_lines_cache.clear()
+        #
+        # Sources read from disk are validated on lookup.
+        #
+        g_source_cache.invalidate_unvalidated()
 
         event = CEventClearSourceCache()
         self.m_event_dispatcher.fire_event(event)
@@ -2047,6 +2799,53 @@ class CDebuggerCore:
         if event not in ['call', 'line', 'return']:
             return None
 
+        if not self.is_thread_selected():
+            sys.settrace(None)
+            return None
+
+        ctx = self.init_thread(frame, event)
+        if ctx is None or self.m_fidle:
+            return None
+
+        sys.settrace(ctx.trace_dispatch_call)
+        sys.setprofile(ctx.profile)
+
+        if event == 'call':
+            return ctx.trace_dispatch_call(frame, event, arg)
+        elif hasattr(frame, 'f_trace') and (frame.f_trace is not None):
+            return frame.f_trace(frame, event, arg)
+        else:
+            return None
+
+
+    def trace_dispatch_idle(self, frame, event, arg):
+        """
+        Global trace method while the debugger is idle.
+        Frames that trap unhandled exceptions keep their local trace
+        methods, so only the first call of a new thread is handled here.
+        """
+
+        if thread.get_ident() in self.m_threads:
+            return None
+
+        return self.trace_dispatch_init(frame, event, arg)
+
+
+    def init_thread(self, frame, event):
+        """
+        Start debugging the current thread from frame.
+        Return the new thread context or None if the thread should
+        not be traced.
+        """
+
+        #
+        # Threads which are already debugged come here after their trace
+        # hooks were reinstalled by threading.settrace_all_threads().
+        #
+        ctx = self.m_threads.get(thread.get_ident(), None)
+        if ctx is not None:
+            return ctx
+
         code_context = self.get_code_context(frame)
         if event == 'call' and code_context.is_untraced():
             return None
@@ -2087,17 +2886,11 @@ class CDebuggerCore:
                 self.m_f_break_on_init = False
                 self.request_break()
 
-        sys.settrace(ctx.trace_dispatch_call)
-        sys.setprofile(ctx.profile)
-
         self.wait_embedded_sync(nthreads == 1)
 
-        if event == 'call':
-            return ctx.trace_dispatch_call(frame, event, arg)
-        elif hasattr(frame, 'f_trace') and (frame.f_trace is not None):
-            return frame.f_trace(frame, event, arg)
-        else:
-            return None
+        self.check_idle()
+
+        return ctx
 
 
     def prepare_embedded_sync(self):
@@ -2153,10 +2946,117 @@ class CDebuggerCore:
         Set trace methods for all frames of all threads.
         """
 
+        if self.check_idle() and self.m_monitoring is not None:
+            return
+
+        if self.m_monitoring is not None and self.m_monitoring.refresh(fforce = True):
+            return
+
         for ctx in list(self.m_threads.values()):
             ctx.set_tracers()
 
 
+    def is_idle(self):
+        """
+        Return True if nothing can make the debugger break until a client
+        requests a break, sets a breakpoint or starts a step. Trace hooks
+        are then uninstalled from all threads.
+        """
+
+        if self.m_monitoring is None:
+            #
+            # Without sys.monitoring the hooks of other threads can only
+            # be changed with threading.settrace_all_threads() (3.12+).
+            #
+            if not hasattr(threading, 'settrace_all_threads'):
+                return False
+
+        if not self.m_ftrace or len(self.m_threads) == 0:
+            return False
+
+        if self.m_fBreak or self.m_state_manager.get_state() != STATE_RUNNING:
+            return False
+
+        if self.m_step_tid is not None or self.m_next_frame is not None or self.m_return_frame is not None:
+            return False
+
+        if len(self.m_bp_manager.m_break_points_by_code) != 0:
+            return False
+
+        for ctx in list(self.m_threads.values()):
+            if len(ctx.m_locals_copy) != 0:
+                return False
+
+        return True
+
+
+    def check_idle(self):
+        """
+        Uninstall the trace hooks of all threads when the debugger becomes
+        idle and re-install them when it is needed again.
+        Return True if the idle state changed.
+        """
+
+        fidle = self.is_idle()
+        if fidle == self.m_fidle:
+            return False
+
+        print_debug('Debugger idle: %s' % fidle)
+
+        self.m_fidle = fidle
+
+        if not self.m_ftrace:
+            return True
+
+        if not fidle:
+            self.update_thread_frames()
+
+        if self.m_monitoring is not None:
+            self.m_monitoring.refresh(fforce = True)
+            return True
+
+        if fidle:
+            self.set_idle_tracers()
+        else:
+            threading.settrace_all_threads(self.trace_dispatch_init)
+
+        return True
+
+
+    def set_idle_tracers(self):
+        """
+        Uninstall the trace hooks of all threads while the debugger is
+        idle. While unhandled exceptions are trapped, trace_dispatch_idle()
+        stays installed as a minimal global hook, which keeps the local
+        trace methods of exception trap frames working.
+        """
+
+        threading.setprofile_all_threads(None)
+        threading.settrace_all_threads([None, self.trace_dispatch_idle][self.m_ftrap])
+
+
+    def update_thread_frames(self):
+        """
+        Refresh the frames of debugged threads after a period in which
+        they were not traced, and forget threads that exited meanwhile.
+        """
+
+        frames = sys._current_frames()
+
+        for tid, ctx in list(self.m_threads.items()):
+            f = frames.get(tid, None)
+            if f is None:
+                self.remove_thread(tid)
+                continue
+
+            ctx.m_frame = f
+            ctx.m_code_context = self.get_code_context(f)
+            ctx.set_depth(f)
+
+        f = None
+        frames = None
+
+
     def remove_thread(self, thread_id):
         try:
             del self.m_threads[thread_id]
@@ -2336,6 +3236,7 @@ class CDebuggerCore:
 
         ctx.m_fUnhandledException = False
         ctx.m_fBroken = False
+        self.check_idle()
         ctx.set_tracers()
         ctx.reset_exc_info()
 
@@ -2756,8 +3657,8 @@ class CDebuggerEngine(CDebuggerCore):
     Adds functionality on top of CDebuggerCore.
     """
 
-    def __init__(self, fembedded = False):
-        CDebuggerCore.__init__(self, fembedded)
+    def __init__(self, fembedded = False, fmonitoring = False):
+        CDebuggerCore.__init__(self, fembedded, fmonitoring)
 
         event_type_dict = {
             CEventState: {},
@@ -2782,12 +3683,18 @@ class CDebuggerEngine(CDebuggerCore):
             CEventSignalIntercepted: {},
             CEventSignalException: {},
             CEventClearSourceCache: {},
-            CEventEmbeddedSync: {}
+            CEventEmbeddedSync: {},
+            CEventLogRecords: {},
+            CEventBreakSnapshot: {}
             }
 
         self.m_event_queue = CEventQueue(self.m_event_dispatcher)
         self.m_event_queue.register_event_types(event_type_dict)
 
+        self.m_log_buffer.set_notify(self.m_event_queue.notify)
+
+        self.m_break_snapshot = None
+
         event_type_dict = {CEventSync: {}}
         self.m_event_dispatcher.register_callback(self.send_events, event_type_dict, fSingleUse = False)
 
@@ -2798,6 +3705,17 @@ class CDebuggerEngine(CDebuggerCore):
         CDebuggerCore.shutdown(self)
 
 
+    def send_event_exit(self):
+        #
+        # Clients stop polling for events once they see the exit event,
+        # so pending logpoint records are sent before it.
+        #
+        while self.send_log_records():
+            pass
+
+        CDebuggerCore.send_event_exit(self)
+
+
 
     def sync_with_events(self, fException, fSendUnhandled):
         """
@@ -2842,7 +3760,7 @@ class CDebuggerEngine(CDebuggerCore):
         return True
 
 
-    def wait_for_event(self, timeout, event_index):
+    def wait_for_event(self, timeout, event_index, n_receivers = 1):
         """
         Wait for new events and return them as list of events.
         """
@@ -2850,15 +3768,45 @@ class CDebuggerEngine(CDebuggerCore):
         self.cancel_request_go_timer()
         self.trap_conflicting_modules()
 
-        (new_event_index, sel) = self.m_event_queue.wait_for_event(timeout, event_index)
+        self.send_log_records()
+        (new_event_index, sel) = self.m_event_queue.wait_for_event(timeout, event_index, n_receivers)
+
+        #
+        # The wait is cut short when logpoint records arrive.
+        #
+        if len(sel) == 0 and self.send_log_records():
+            (new_event_index, sel) = self.m_event_queue.wait_for_event(0, event_index, n_receivers)
 
         if self.trap_conflicting_modules():
-            (new_event_index, sel) = self.m_event_queue.wait_for_event(timeout, event_index)
+            (new_event_index, sel) = self.m_event_queue.wait_for_event(timeout, event_index, n_receivers)
 
         return (new_event_index, sel)
 
 
-    def set_breakpoint(self, filename, scope, lineno, fEnabled, expr, frame_index, fException, encoding):
+    def notify_event_waiters(self):
+        self.m_event_queue.notify()
+
+
+    def send_log_records(self):
+        """
+        Fire a batch of logpoint records to the clients.
+        Return True if a batch was fired.
+        """
+
+        if len(self.m_log_buffer) == 0:
+            return False
+
+        (records, dropped) = self.m_log_buffer.pop_records(LOG_RECORDS_BATCH)
+        if len(records) == 0:
+            return False
+
+        event = CEventLogRecords(records, dropped)
+        self.m_event_dispatcher.fire_event(event)
+
+        return True
+
+
+    def set_breakpoint(self, filename, scope, lineno, fEnabled, expr, frame_index, fException, encoding, log_exprs = None):
         print_debug('Setting breakpoint to: %s, %s, %d' % (repr(filename), scope, lineno))
 
         assert(is_unicode(filename))
@@ -2879,17 +3827,20 @@ class CDebuggerEngine(CDebuggerCore):
             else:
                 _filename = FindFile(filename, fModules = True)
 
-            if expr != '':
+            for e in [expr] + list(log_exprs or []):
+                if e == '':
+                    continue
+
                 try:
                     encoding = self.__calc_encoding(encoding, filename = _filename)
-                    _expr = as_bytes(ENCODING_SOURCE % encoding + expr, encoding)
+                    _expr = as_bytes(ENCODING_SOURCE % encoding + e, encoding)
                     compile(_expr, '<string>', 'eval')
                 except:
                     raise SyntaxError
 
             encoding = as_unicode(encoding)
 
-            bp = self.m_bp_manager.set_breakpoint(_filename, scope, lineno, fEnabled, expr, encoding)
+            bp = self.m_bp_manager.set_breakpoint(_filename, scope, lineno, fEnabled, expr, encoding, log_exprs)
             self.set_all_tracers()
 
             event = CEventBreakpoint(bp)
@@ -2917,6 +3868,14 @@ class CDebuggerEngine(CDebuggerCore):
         self.m_event_dispatcher.fire_event(event)
 
 
+    def set_breakpoint_filter(self, id_list, fAll, ignore_count, every, probability):
+        bpl = self.m_bp_manager.set_breakpoint_filter(id_list, fAll, ignore_count, every, probability)
+
+        for bp in bpl:
+            event = CEventBreakpoint(bp)
+            self.m_event_dispatcher.fire_event(event)
+
+
     def delete_breakpoint(self, id_list, fAll):
         self.m_bp_manager.delete_breakpoint(id_list, fAll)
         self.set_all_tracers()
@@ -2934,6 +3893,7 @@ class CDebuggerEngine(CDebuggerCore):
         _items = [(id, breakpoint_copy(bp)) for (id, bp) in bpl.items()]
         for (id, bp) in _items:
             bp.m_code = None
+            bp.m_log_codes = None
 
         _bpl = dict(_items)
 
@@ -2959,6 +3919,7 @@ class CDebuggerEngine(CDebuggerCore):
             self.send_stack_depth()
             self.send_threads_event(fException)
             self.send_stack_event(fException)
+            self.send_break_snapshot_event(fException)
             self.send_namespace_event()
 
             if fSendUnhandled and self.m_fUnhandledException:
@@ -3047,6 +4008,29 @@ class CDebuggerEngine(CDebuggerCore):
         self.m_event_dispatcher.fire_event(event)
 
 
+    def send_break_snapshot_event(self, fException):
+        """
+        Send the snapshot set with set_break_snapshot(). The namespace
+        is left out when synchronicity is off since the thread that sends
+        the event may be the one that would have to evaluate it.
+        """
+
+        t = self.m_break_snapshot
+        if t is None:
+            return
+
+        (spec, encoding, fraw) = t
+
+        try:
+            snapshot = self.get_break_snapshot(spec, 0, fException, encoding, fraw, fNamespace = self.m_fsynchronicity)
+        except:
+            print_debug_exception()
+            return
+
+        event = CEventBreakSnapshot(snapshot)
+        self.m_event_dispatcher.fire_event(event)
+
+
     def send_namespace_event(self):
         """
         Send event notifying namespace should be queried again.
@@ -3139,14 +4123,46 @@ class CDebuggerEngine(CDebuggerCore):
             __s = [(a, ctx.m_uef_lineno, c, d)] + __s[1:]
 
         r = {}
-        r[DICT_KEY_STACK] = __s
+        r[DICT_KEY_STACK] = __s
+        r[DICT_KEY_CODE_LIST] = code_list
+        r[DICT_KEY_TID] = tid
+        r[DICT_KEY_BROKEN] = ctx.m_fBroken
+        r[DICT_KEY_EVENT] = as_unicode([ctx.m_event, 'exception'][fException])
+
+        if tid == ctid:
+            r[DICT_KEY_CURRENT_TID] = True
+
+        return r
+
+
+    def __get_sampled_stack(self, tid):
+        """
+        Return a dictionary describing the stack of a thread that is not
+        traced, sampled with sys._current_frames(). See __get_stack().
+        """
+
+        f = sys._current_frames().get(tid, None)
+        if f is None:
+            return None
+
+        try:
+            s = my_extract_stack(f)
+
+            code_list = []
+            while f is not None:
+                rc = repr(f.f_code).split(',')[0].split()[-1]
+                code_list.insert(0, as_unicode(rc))
+                f = f.f_back
+
+        finally:
+            f = None
+
+        r = {}
+        r[DICT_KEY_STACK] = [(a, b, c, d) for (a, b, c, d) in s if not is_func_hidden( c ) ]
         r[DICT_KEY_CODE_LIST] = code_list
         r[DICT_KEY_TID] = tid
-        r[DICT_KEY_BROKEN] = ctx.m_fBroken
-        r[DICT_KEY_EVENT] = as_unicode([ctx.m_event, 'exception'][fException])
-
-        if tid == ctid:
-            r[DICT_KEY_CURRENT_TID] = True
+        r[DICT_KEY_BROKEN] = False
+        r[DICT_KEY_EVENT] = as_unicode('')
 
         return r
 
@@ -3174,19 +4190,114 @@ class CDebuggerEngine(CDebuggerCore):
         ctx = self.get_current_ctx()
         ctid = ctx.m_thread_id
 
+        untraced_list = []
+
         if fAll:
             ctx_list = list(self.get_threads().values())
+            untraced_list = list(self.get_untraced_threads().keys())
         elif fException or (len(tid_list) == 0):
             ctx_list = [ctx]
         else:
             ctx_list = [self.get_threads().get(t, None) for t in tid_list]
+            untraced_list = [t for t in tid_list if t in self.get_untraced_threads()]
 
         _sl = [self.__get_stack(ctx, ctid, fException) for ctx in ctx_list if ctx is not None]
+        _sl += [self.__get_sampled_stack(tid) for tid in untraced_list]
         sl = [s for s in _sl if s is not None]
 
         return sl
 
 
+    def set_break_snapshot(self, spec, encoding, fraw):
+        """
+        Send a snapshot described by spec with the events of every break,
+        or stop sending it if spec is None. See get_break_snapshot().
+        """
+
+        if spec is None:
+            self.m_break_snapshot = None
+            return
+
+        self.m_break_snapshot = (calc_snapshot_spec(spec), encoding, fraw)
+
+
+    def get_break_snapshot(self, spec, frame_index, fException, encoding, fraw, fNamespace = True):
+        """
+        Return in one dictionary what clients query after a break:
+          DICT_KEY_STACK - the stack of the current thread as returned by
+              get_stack(), limited to the innermost frames of the spec.
+          DICT_KEY_SOURCE - the source lines around the current line as
+              returned by get_source_lines(), or None.
+          DICT_KEY_THREADS - the thread list as returned by get_thread_list().
+          DICT_KEY_NAMESPACE - the values of the expressions of the spec as
+              returned by get_namespace(), or None.
+        The dictionary also holds the spec, frame_index and fException.
+        See calc_snapshot_spec() for the keys of spec.
+        """
+
+        spec = calc_snapshot_spec(spec)
+
+        r = {}
+        r[DICT_KEY_SPEC] = spec
+        r[DICT_KEY_FRAME_INDEX] = frame_index
+        r[DICT_KEY_EXCEPTION] = fException
+
+        st = None
+        sl = self.get_stack([], False, fException)
+        if len(sl) > 0:
+            st = sl[0]
+
+        max_depth = spec[DICT_KEY_MAX_DEPTH]
+        if st is not None and max_depth > 0:
+            st[DICT_KEY_STACK] = st[DICT_KEY_STACK][-max_depth:]
+            st[DICT_KEY_CODE_LIST] = st[DICT_KEY_CODE_LIST][-max_depth:]
+
+        r[DICT_KEY_STACK] = st
+
+        r[DICT_KEY_SOURCE] = None
+        if spec[DICT_KEY_NLINES] > 0:
+            sl = self.get_source_lines(spec[DICT_KEY_NLINES], False, frame_index, fException)
+            if len(sl) > 0:
+                r[DICT_KEY_SOURCE] = sl[0]
+
+        r[DICT_KEY_THREADS] = self.get_thread_list()
+
+        r[DICT_KEY_NAMESPACE] = None
+        if fNamespace and len(spec[DICT_KEY_EXPR_LIST]) > 0:
+            r[DICT_KEY_NAMESPACE] = self.get_namespace(spec[DICT_KEY_EXPR_LIST], spec[DICT_KEY_FILTER_LEVEL], frame_index, fException, spec[DICT_KEY_REPR_LIMIT], encoding, fraw)
+
+        return r
+
+
+    def __read_source(self, filename, lineno, nlines):
+        """
+        Return (lines, breakpoints) where lines are nlines lines of filename
+        from line lineno, or the lines to the end of the file if nlines is
+        negative, and breakpoints maps the line numbers of the breakpoints
+        on these lines to their states.
+        """
+
+        try:
+            rpdb.globals.g_traceback_lock.acquire()
+            sf = get_source_file(filename)
+
+        finally:
+            rpdb.globals.g_traceback_lock.release()
+
+        lines = sf.get_lines(lineno, nlines)
+
+        #
+        # Remove any trace of session password from data structures that
+        # go over the network.
+        #
+        hide_session_password(sf, lineno, lines)
+
+        bpm = self.m_bp_manager.get_file_breakpoints(filename, lineno, len(lines))
+        breakpoints = dict([(l, as_unicode([STATE_DISABLED, STATE_ENABLED][bp.isEnabled()])) for (l, bp) in bpm.items()])
+
+        return (lines, breakpoints)
+
+
     def get_source_file(self, filename, lineno, nlines, frame_index, fException):
         assert(is_unicode(filename))
 
@@ -3194,7 +4305,6 @@ class CDebuggerEngine(CDebuggerCore):
             lineno = 1
             nlines = -1
 
-        _lineno = lineno
         r = {}
         frame_filename = None
 
@@ -3232,53 +4342,7 @@ class CDebuggerEngine(CDebuggerCore):
 
         _filename = winlower(__filename)
 
-        lines = []
-        breakpoints = {}
-        fhide_pwd_mode = False
-
-        while nlines != 0:
-            try:
-                rpdb.globals.g_traceback_lock.acquire()
-                line = get_source_line(_filename, _lineno)
-
-            finally:
-                rpdb.globals.g_traceback_lock.release()
-
-            if line == '':
-                break
-
-            #
-            # Remove any trace of session password from data structures that
-            # go over the network.
-            #
-
-            if fhide_pwd_mode:
-                if not ')' in line:
-                    line = as_unicode('...\n')
-                else:
-                    line = '...""")' + line.split(')', 1)[1]
-                    fhide_pwd_mode = False
-
-            elif 'start_embedded_debugger(' in line:
-                ls = line.split('start_embedded_debugger(', 1)
-                line = ls[0] + 'start_embedded_debugger("""...Removed-password-from-output...'
-
-                if ')' in ls[1]:
-                    line += '""")' + ls[1].split(')', 1)[1]
-                else:
-                    line += '\n'
-                    fhide_pwd_mode = True
-
-            lines.append(line)
-
-            try:
-                bp = self.m_bp_manager.get_breakpoint(_filename, _lineno)
-                breakpoints[_lineno] = as_unicode([STATE_DISABLED, STATE_ENABLED][bp.isEnabled()])
-            except KeyError:
-                pass
-
-            _lineno += 1
-            nlines -= 1
+        (lines, breakpoints) = self.__read_source(_filename, lineno, nlines)
 
         if frame_filename == _filename:
             r[DICT_KEY_FRAME_LINENO] = frame_lineno
@@ -3317,55 +4381,8 @@ class CDebuggerEngine(CDebuggerCore):
         frame_event = [[ctx.m_event, 'call'][frame_index > 0], 'exception'][fException]
 
         first_line = max(1, frame_lineno - nlines // 2)
-        _lineno = first_line
-
-        lines = []
-        breakpoints = {}
-        fhide_pwd_mode = False
-
-        while nlines != 0:
-            try:
-                rpdb.globals.g_traceback_lock.acquire()
-                line = get_source_line(frame_filename, _lineno)
-
-            finally:
-                rpdb.globals.g_traceback_lock.release()
-
-            if line == '':
-                break
-
-            #
-            # Remove any trace of session password from data structures that
-            # go over the network.
-            #
-
-            if fhide_pwd_mode:
-                if not ')' in line:
-                    line = as_unicode('...\n')
-                else:
-                    line = '...""")' + line.split(')', 1)[1]
-                    fhide_pwd_mode = False
 
-            elif 'start_embedded_debugger(' in line:
-                ls = line.split('start_embedded_debugger(', 1)
-                line = ls[0] + 'start_embedded_debugger("""...Removed-password-from-output...'
-
-                if ')' in ls[1]:
-                    line += '""")' + ls[1].split(')', 1)[1]
-                else:
-                    line += '\n'
-                    fhide_pwd_mode = True
-
-            lines.append(line)
-
-            try:
-                bp = self.m_bp_manager.get_breakpoint(frame_filename, _lineno)
-                breakpoints[_lineno] = as_unicode([STATE_DISABLED, STATE_ENABLED][bp.isEnabled()])
-            except KeyError:
-                pass
-
-            _lineno += 1
-            nlines -= 1
+        (lines, breakpoints) = self.__read_source(frame_filename, first_line, nlines)
 
         r = {}
 
@@ -3933,6 +4950,16 @@ class CDebuggerEngine(CDebuggerCore):
             d[DICT_KEY_NAME] = self.__decode_thread_name(c.m_thread_name)
             d[DICT_KEY_BROKEN] = c.m_fBroken
             d[DICT_KEY_EVENT] = as_unicode(c.m_event)
+            d[DICT_KEY_TRACED] = True
+            tl.append(d)
+
+        for tid, t in list(self.get_untraced_threads().items()):
+            d = {}
+            d[DICT_KEY_TID] = tid
+            d[DICT_KEY_NAME] = self.__decode_thread_name(thread_get_name(t))
+            d[DICT_KEY_BROKEN] = False
+            d[DICT_KEY_EVENT] = as_unicode('')
+            d[DICT_KEY_TRACED] = False
             tl.append(d)
 
         return (current_thread_id, tl)
@@ -3957,6 +4984,10 @@ class CDebuggerEngine(CDebuggerCore):
 
     def set_trap_unhandled_exceptions(self, ftrap):
         self.m_ftrap = ftrap
+        self.set_all_tracers()
+
+        if self.m_fidle and self.m_ftrace and self.m_monitoring is None:
+            self.set_idle_tracers()
 
         event = CEventTrap(ftrap)
         self.m_event_dispatcher.fire_event(event)
@@ -4123,6 +5154,9 @@ class CConsoleInternal(cmd.Cmd, threading.Thread):
         event_type_dict = {CEventForkMode: {}}
         self.m_session_manager.register_callback(self.fork_mode_handler, event_type_dict, fSingleUse = False)
 
+        event_type_dict = {CEventLogRecords: {}}
+        self.m_session_manager.register_callback(self.log_records_handler, event_type_dict, fSingleUse = False)
+
         self.m_last_source_line = None
         self.m_last_nlines = DEFAULT_NUMBER_OF_LINES
 
@@ -4445,6 +5479,21 @@ class CConsoleInternal(cmd.Cmd, threading.Thread):
         self.printer(STR_FORK_MODE_SET % (x, y))
 
 
+    def log_records_handler(self, event):
+        if event.m_dropped > 0:
+            self.printer(STR_LOG_RECORDS_DROPPED % event.m_dropped)
+
+        bpl = self.m_session_manager.get_breakpoints()
+
+        for (t, tid, id, lineno, values) in event.m_records:
+            bp = bpl.get(id, None)
+            if bp is not None and bp.m_log_exprs is not None and len(bp.m_log_exprs) == len(values):
+                values = ['%s = %s' % (e, v) for (e, v) in zip(bp.m_log_exprs, values)]
+
+            ts = time.strftime('%H:%M:%S', time.localtime(t))
+            self.printer(STR_LOG_RECORD % (ts, int(t * 1000) % 1000, id, tid, lineno, ', '.join(values)))
+
+
     def do_launch(self, arg):
         fchdir, interpreter, command_line = parse_console_launch( arg )
 
@@ -4717,6 +5766,32 @@ class CConsoleInternal(cmd.Cmd, threading.Thread):
             self.m_session_manager.report_exception(*sys.exc_info())
 
 
+    def do_lp(self, arg):
+        if arg == '':
+            self.printer(STR_BAD_ARGUMENT)
+            return
+
+        try:
+            (filename, scope, lineno, exprs) = self.__parse_bp_arg(arg, fAllowExpr = True)
+
+            log_exprs = [e.strip() for e in exprs.split(LP_EXPR_SEP) if e.strip() != '']
+            if len(log_exprs) == 0:
+                raise BadArgument
+
+            self.m_session_manager.set_logpoint(filename, scope, lineno, True, '', log_exprs)
+
+        except BadArgument:
+            self.printer(STR_BAD_ARGUMENT)
+        except IOError:
+            self.printer(STR_FILE_NOT_FOUND % filename)
+        except InvalidScopeName:
+            self.printer(STR_SCOPE_NOT_FOUND % scope)
+        except SyntaxError:
+            self.printer(STR_BAD_EXPRESSION % exprs)
+        except DebuggerNotBroken:
+            self.m_session_manager.report_exception(*sys.exc_info())
+
+
     def do_be(self, arg):
         if arg == '':
             self.printer(STR_BAD_ARGUMENT)
@@ -4774,8 +5849,41 @@ class CConsoleInternal(cmd.Cmd, threading.Thread):
             self.printer(STR_BAD_ARGUMENT)
 
 
+    def do_bf(self, arg):
+        if arg == '':
+            self.printer(STR_BAD_ARGUMENT)
+            return
+
+        try:
+            id_list = []
+            fAll = False
+            filters = {'ignore': 0, 'every': 0, 'prob': 1.0}
+
+            for a in arg.split():
+                if '=' in a:
+                    (name, value) = a.split('=', 1)
+                    if not name in filters:
+                        raise ValueError
+
+                    filters[name] = [int, float][name == 'prob'](value)
+
+                elif a == SYMBOL_ALL:
+                    fAll = True
+
+                else:
+                    id_list.append(int(a))
+
+            if not fAll and len(id_list) == 0:
+                raise ValueError
+
+            self.m_session_manager.set_breakpoint_filter(id_list, fAll, filters['ignore'], filters['every'], filters['prob'])
+
+        except (ValueError, BadArgument):
+            self.printer(STR_BAD_ARGUMENT)
+
+
     def do_bl(self, arg):
-        bpl = self.m_session_manager.get_breakpoints()
+        bpl = self.m_session_manager.get_breakpoints(fSync = True)
 
         bplk = list(bpl.keys())
         bplk.sort()
@@ -4803,8 +5911,15 @@ class CConsoleInternal(cmd.Cmd, threading.Thread):
             elif scope.startswith(MODULE_SCOPE2 + '.'):
                 scope = scope[len(MODULE_SCOPE2) + 1:]
 
+            condition = calc_prefix(expr, 45)
+            if bp.is_logpoint():
+                condition = (condition + ' ' + STR_LOGPOINT % calc_prefix(LP_EXPR_SEP.join(bp.m_log_exprs), 45)).lstrip()
+
+            if bp.has_filter():
+                condition = (condition + ' ' + STR_BREAKPOINT_FILTER % (bp.m_ignore_count, bp.m_every, bp.m_probability)).lstrip()
+
             state = [STATE_DISABLED, STATE_ENABLED][bp.isEnabled()]
-            s = STR_BREAKPOINTS_TEMPLATE % (id, state, bp.m_lineno, clip_filename(bp.m_filename, 45), calc_suffix(scope, 45), calc_prefix(expr, 50), encoding)
+            s = STR_BREAKPOINTS_TEMPLATE % (id, state, bp.m_lineno, bp.m_hit_count, clip_filename(bp.m_filename, 37), calc_suffix(scope, 45), condition, encoding)
             _print(s.rstrip() + '\n', self.m_stdout)
 
 
@@ -5175,6 +6290,8 @@ class CConsoleInternal(cmd.Cmd, threading.Thread):
             for i, t in enumerate(tl):
                 m = ['', SYMBOL_MARKER][t[DICT_KEY_TID] == current_thread_id]
                 state = [STATE_RUNNING, STR_STATE_BROKEN][t[DICT_KEY_BROKEN]]
+                if not t.get(DICT_KEY_TRACED, True):
+                    state = STR_STATE_UNTRACED
                 _print(' %1s %3d  %5d  %-15s  %s' % (m, i, t[DICT_KEY_TID], t[DICT_KEY_NAME], state[:25]), self.m_stdout)
 
         except ValueError:
@@ -5251,6 +6368,140 @@ class CConsoleInternal(cmd.Cmd, threading.Thread):
         self.m_session_manager.set_trap_unhandled_exceptions(ftrap)
 
 
+    def do_trace(self, arg):
+        if arg == '':
+            rules = self.m_session_manager.get_trace_filter()
+            if len(rules) == 0:
+                _print(STR_TRACE_FILTER_EMPTY, self.m_stdout)
+                return
+
+            _print(STR_TRACE_FILTER, self.m_stdout)
+            for i, (action, pattern) in enumerate(rules):
+                _print(' %3d  %-7s  %s' % (i, action, pattern), self.m_stdout)
+            return
+
+        if arg == 'clear':
+            self.m_session_manager.set_trace_filter([])
+            return
+
+        try:
+            (action, pattern) = arg.split(None, 1)
+        except ValueError:
+            _print(STR_BAD_ARGUMENT, self.m_stdout)
+            return
+
+        if action not in [TRACE_INCLUDE, TRACE_EXCLUDE]:
+            _print(STR_BAD_ARGUMENT, self.m_stdout)
+            return
+
+        rules = self.m_session_manager.get_trace_filter()
+        rules.append((action, pattern.strip()))
+        self.m_session_manager.set_trace_filter(rules)
+
+
+    def do_tracethreads(self, arg):
+        if arg == '':
+            (names, tids) = self.m_session_manager.get_thread_filter()
+            if len(names) == 0 and len(tids) == 0:
+                _print(STR_THREAD_FILTER_ALL, self.m_stdout)
+                return
+
+            _print(STR_THREAD_FILTER % ', '.join(names + [str(t) for t in tids]), self.m_stdout)
+            return
+
+        names = []
+        tids = []
+
+        if arg != 'all':
+            for a in arg.split():
+                try:
+                    tids.append(int(a))
+                except ValueError:
+                    names.append(a)
+
+        self.m_session_manager.set_thread_filter(names, tids)
+
+
+    def do_profile(self, arg):
+        args = arg.split(None, 1)
+
+        if len(args) == 0:
+            (frunning, interval, samples, dropped, stacks) = self.m_session_manager.get_profile()
+            state = [STR_PROFILER_STOPPED, STR_PROFILER_RUNNING][frunning]
+            _print(STR_PROFILER_STATE % (state, interval, samples, dropped), self.m_stdout)
+            return
+
+        try:
+            if args[0] == 'start':
+                interval = PROFILE_INTERVAL
+                if len(args) > 1:
+                    interval = float(args[1])
+
+                self.m_session_manager.start_profiler(interval)
+                return
+
+            if args[0] == 'stop' and len(args) == 1:
+                self.m_session_manager.stop_profiler()
+                return
+
+        except (ValueError, BadArgument):
+            pass
+
+        if args[0] != 'dump':
+            _print(STR_BAD_ARGUMENT, self.m_stdout)
+            return
+
+        (frunning, interval, samples, dropped, stacks) = self.m_session_manager.get_profile()
+
+        if len(args) == 1:
+            for s in stacks:
+                _print(s, self.m_stdout)
+            return
+
+        filename = args[1].strip()
+        f = open(filename, 'w')
+
+        try:
+            for s in stacks:
+                f.write(s + '\n')
+
+        finally:
+            f.close()
+
+        _print(STR_PROFILE_SAVED % filename, self.m_stdout)
+
+
+    def do_compression(self, arg):
+        if arg != '':
+            self.printer(STR_BAD_ARGUMENT)
+            return
+
+        (link_speed, sent, received) = self.m_session_manager.get_compression_stats()
+
+        l = []
+        for (n, n_compressed, size, wire_size) in [sent, received]:
+            saved = [0, 100 * (size - wire_size) // max(size, 1)][size > wire_size]
+            l += [n, n_compressed, size, wire_size, saved]
+
+        _print(STR_COMPRESSION_STATS % tuple(l), self.m_stdout)
+
+        if link_speed is None:
+            speed = STR_COMPRESSION_LINK_UNKNOWN
+        else:
+            speed = '%d KB/s' % (link_speed // 1024)
+
+        _print(STR_COMPRESSION_LINK_SPEED % speed, self.m_stdout)
+
+
+    def do_codecache(self, arg):
+        if arg != '':
+            self.printer(STR_BAD_ARGUMENT)
+            return
+
+        stats = self.m_session_manager.get_code_cache_stats()
+        _print(STR_CODE_CACHE_STATS % stats, self.m_stdout)
+
+
     def do_fork(self, arg):
         (ffork_into_child, ffork_auto) = self.m_session_manager.get_fork_mode()
 
@@ -5423,9 +6674,11 @@ Breakpoints Control:
 --------------------
 
 bp          - Set a break point.
+lp          - Set a logpoint.
 bd          - Disable a breakpoint.
 be          - Enable a breakpoint.
 bc          - Clear (delete) a breakpoint.
+bf          - Set the hit filters of a breakpoint.
 bl          - List all breakpoints.
 load        - Load session breakpoints.
 save        - save session breakpoints.
@@ -5443,6 +6696,11 @@ eval        - Evaluate expression in the context of the current frame.
 exec        - Execute suite in the context of the current frame.
 analyze     - Toggle analyze last exception mode.
 trap        - Get or set "trap unhandled exceptions" mode.
+trace       - Display or set the trace include/exclude filter.
+tracethreads - Display or select the threads that are traced.
+profile     - Control the sampling profiler of the debuggee.
+compression - Display the compression statistics of the session.
+codecache   - Display the code context cache statistics of the debuggee.
 fork        - Get or set fork handling mode.
 synchro     - Get or set synchronicity mode.
 breakonexit - Get or set break-on-exit mode.
@@ -5544,6 +6802,84 @@ When set to True:
 Debuggee will pause on unhandled exceptions for inspection.""", self.m_stdout)
 
 
+    def help_trace(self):
+        _print("""trace [include <pattern> | exclude <pattern> | clear]
+
+Display or set the rules that select which code is traced.
+
+Code that is excluded is never traced, it does not pay the tracing
+cost and stepping does not enter it. Code with breakpoints is always
+traced.
+
+A pattern is either a glob, a path prefix or one of the aliases
+<stdlib> and <site-packages>. <stdlib> does not cover the site
+packages installed inside the stdlib directory. Rules are evaluated
+in order and the last matching rule wins. Code that matches no rule
+is traced.
+
+e.g.    trace exclude <stdlib>
+        trace exclude */vendor/*
+        trace include /usr/lib/python3/site-packages/mypackage/""", self.m_stdout)
+
+
+    def help_tracethreads(self):
+        _print("""tracethreads [all | <name-pattern | tid> ...]
+
+Display or select the threads that are traced.
+
+Threads are selected by glob patterns on their names or by their
+thread ids. Threads that are not selected run at full speed but are
+still listed by the 'thread' command, their stacks are sampled.
+
+With Python older than 3.12 a thread that was not traced can not be
+traced again until it is restarted.
+
+e.g.    tracethreads worker-3 MainThread
+        tracethreads 140011559749312
+        tracethreads all""", self.m_stdout)
+
+
+    def help_profile(self):
+        _print("""profile [start [<interval>] | stop | dump [<filename>]]
+
+Control the sampling profiler of the debuggee, or display its state.
+
+The profiler runs on a debugger thread in the debuggee. Every <interval>
+milliseconds (10 by default) it samples the stacks of all threads. It does
+not use the trace hooks and it works while the debugger is idle.
+
+start     - start a new profile.
+stop      - stop sampling, the profile is kept until the next start.
+dump      - print the profile, or save it to <filename> on this machine,
+            as collapsed stacks which can be read by flamegraph.pl and
+            compatible tools.
+
+e.g.    profile start 5
+        profile dump /tmp/app.folded""", self.m_stdout)
+
+
+    def help_compression(self):
+        _print("""compression
+
+Display the compression statistics of the session.
+
+Messages larger than a few hundred bytes are compressed with a preset
+dictionary of typical payloads when that saves space. The compression
+level depends on the payload size and on the speed of the link to the
+debuggee, measured from the calls of the session. On fast links only
+large payloads are compressed.""", self.m_stdout)
+
+
+    def help_codecache(self):
+        _print("""codecache
+
+Display the statistics of the code context cache of the debuggee.
+
+The debuggee caches what it knows about each code object it traces.
+Entries are released when their code object is garbage collected and
+the oldest entries are evicted when the cache is full.""", self.m_stdout)
+
+
     def help_breakonexit(self):
         _print("""breakonexit [True | False]
 
@@ -5689,6 +7025,26 @@ Examples:
 Type 'help break' for more information on breakpoints and threads.""", self.m_stdout)
 
 
+    def help_lp(self):
+        _print("""lp [<filename>':'] (<line> | <scope>) ',' <expr> [';' <expr>]...
+
+Set a logpoint. A logpoint does not break, it records the values of the
+expressions whenever it is hit and the records are printed as they arrive
+from the debuggee. Records are kept in a bounded buffer, when the buffer
+overflows the oldest records are dropped.
+
+<filename>, <line> and <scope> are the same as for the bp command.
+<expr>     - expression to evaluate in the context of the frame.
+
+Hit filters can be set on logpoints with the bf command, and logpoints
+are listed, enabled, disabled and cleared like breakpoints.
+
+Examples:
+
+    lp test_file.py:20, x; len(items)
+    lp test_file.py:MyClass.Foo, self.name""", self.m_stdout)
+
+
     def help_be(self):
         _print("""be (<id_list> | '*')
 
@@ -5716,10 +7072,33 @@ Clear (delete) breakpoints.
 '*' - clear all breakpoints.""", self.m_stdout)
 
 
+    def help_bf(self):
+        _print("""bf (<id_list> | '*') [ignore=<count>] [every=<n>] [prob=<p>]
+
+Set the hit filters of breakpoints. The filters are checked before the
+condition of a breakpoint is evaluated, which makes them cheap enough for
+breakpoints in hot code. Setting the filters resets the hit count.
+
+<id_list> - is a space delimited list of at least one breakpoint id
+'*'       - set the filters of all breakpoints.
+<count>   - ignore the next <count> hits.
+<n>       - break only on every <n>th hit.
+<p>       - break with probability <p>, between 0 and 1.
+
+Filters that are not given are cleared.
+
+Examples:
+
+    bf 0 ignore=100
+    bf 1 2 every=1000 prob=0.5
+    bf *""", self.m_stdout)
+
+
     def help_bl(self):
         _print("""bl
 
-List all breakpoints, sorted by their id.""", self.m_stdout)
+List all breakpoints, sorted by their id, with their hit counts and
+hit filters.""", self.m_stdout)
 
 
     def help_load(self):
@@ -6634,7 +8013,7 @@ def workaround_import_deadlock():
 
 
 
-def __start_embedded_debugger(_rpdb2_pwd, fAllowUnencrypted, fAllowRemote, timeout, source_provider, fDebug, depth):
+def __start_embedded_debugger(_rpdb2_pwd, fAllowUnencrypted, fAllowRemote, timeout, source_provider, fDebug, depth, fMonitoring = False, trace_filter = None):
     global g_debugger
 
     _rpdb2_pwd = as_unicode(_rpdb2_pwd)
@@ -6642,6 +8021,9 @@ def __start_embedded_debugger(_rpdb2_pwd, fAllowUnencrypted, fAllowRemote, timeo
     try:
         rpdb.globals.g_server_lock.acquire()
 
+        if g_debugger is not None and trace_filter is not None:
+            g_debugger.set_trace_filter(trace_filter)
+
         if g_debugger is not None and timeout == 0:
             f = sys._getframe(depth)
             g_debugger.settrace(f, f_break_on_init = False)
@@ -6684,7 +8066,10 @@ def __start_embedded_debugger(_rpdb2_pwd, fAllowUnencrypted, fAllowRemote, timeo
 
         atexit.register(_atexit)
 
-        g_debugger = CDebuggerEngine(fembedded = True)
+        g_debugger = CDebuggerEngine(fembedded = True, fmonitoring = fMonitoring)
+
+        if trace_filter is not None:
+            g_debugger.set_trace_filter(trace_filter)
 
         print_debug('Setting g_server')
         rpdb.globals.g_server = CDebuggeeServer(filename, g_debugger, _rpdb2_pwd, fAllowUnencrypted, fAllowRemote)
@@ -6702,7 +8087,7 @@ def __start_embedded_debugger(_rpdb2_pwd, fAllowUnencrypted, fAllowRemote, timeo
 
 
 
-def StartServer(args, fchdir, _rpdb2_pwd, fAllowUnencrypted, fAllowRemote, rid):
+def StartServer(args, fchdir, _rpdb2_pwd, fAllowUnencrypted, fAllowRemote, rid, fMonitoring = False):
     assert(is_unicode(_rpdb2_pwd))
 
     global g_debugger
@@ -6744,7 +8129,7 @@ def StartServer(args, fchdir, _rpdb2_pwd, fAllowUnencrypted, fAllowRemote, rid):
 
     atexit.register(_atexit)
 
-    g_debugger = CDebuggerEngine()
+    g_debugger = CDebuggerEngine(fmonitoring = fMonitoring)
 
     print_debug('Setting g_server')
     rpdb.globals.g_server = CDebuggeeServer(ExpandedFilename, g_debugger, _rpdb2_pwd, fAllowUnencrypted, fAllowRemote, rid)
@@ -6768,7 +8153,7 @@ def StartServer(args, fchdir, _rpdb2_pwd, fAllowUnencrypted, fAllowRemote, rid):
     # there was a problem loading the debugged script.
     #
 
-    imp.load_source('__main__', _path)
+    load_source('__main__', _path)
 
 
 
@@ -6840,6 +8225,8 @@ def PrintUsage(fExtended = False):
     -i, --interpreter= Launch debuggee with the given interpreter executable
     -v, --version   Print version information.
     --debug         Debug prints.
+    --monitoring    Trace the debuggee with sys.monitoring (Python 3.12+)
+                    instead of sys.settrace(). Only with --debuggee.
 
     Note that each option is available in short form (example -e) and in a
     long form (example --encrypt).
@@ -6874,7 +8261,7 @@ def main(StartClient_func = StartClient, version =RPDB_TITLE):
                             'hdao:rtep:scvi:',
                             ['help', 'debugee', 'debuggee', 'attach', 'host=', 'remote', 
                              'plaintext', 'encrypt', 'pwd=', 'rid=', 'screen', 'chdir', 
-                             'base64=', 'nofwtest', 'version', 'debug', 'interpreter=' ]
+                             'base64=', 'nofwtest', 'version', 'debug', 'interpreter=', 'monitoring' ]
                             )
 
     except getopt.GetoptError:
@@ -6893,6 +8280,7 @@ def main(StartClient_func = StartClient, version =RPDB_TITLE):
     fchdir = False
     fAllowRemote = False
     fAllowUnencrypted = True
+    fMonitoring = False
     interpreter = as_unicode('')
 
     for o, a in options:
@@ -6930,6 +8318,8 @@ def main(StartClient_func = StartClient, version =RPDB_TITLE):
             g_fFirewallTest = False
         if o in ['-i', '--interpreter']:
             interpreter = a
+        if o in ['--monitoring']:
+            fMonitoring = True
 
     arg = None
     argv = None
@@ -6977,6 +8367,10 @@ def main(StartClient_func = StartClient, version =RPDB_TITLE):
         _print("--host can only be used together with --attach.")
         return 2
 
+    if fMonitoring and not fWrap:
+        _print("--monitoring can only be used together with --debuggee.")
+        return 2
+
     if host is None:
         host = LOCALHOST
 
@@ -7034,7 +8428,7 @@ def main(StartClient_func = StartClient, version =RPDB_TITLE):
             _print(STR_ENCRYPTION_SUPPORT_ERROR)
             return 2
 
-        StartServer(_rpdb2_args, fchdir, _rpdb2_pwd, fAllowUnencrypted, fAllowRemote, secret)
+        StartServer(_rpdb2_args, fchdir, _rpdb2_pwd, fAllowUnencrypted, fAllowRemote, secret, fMonitoring)
 
     elif fAttach:
         StartClient_func(_rpdb2_args[0], fAttach, fchdir, _rpdb2_pwd, fAllowUnencrypted, fAllowRemote, host, interpreter)
@@ -23,6 +23,19 @@ from unittest import main
 from tests.test_utils import *
 from tests.test_utils_func_tests import *
 from tests.test_events import *
+from tests.test_breakpoint import *
+from tests.test_trace_filter import *
+from tests.test_code_cache import *
+from tests.test_logpoints import *
+from tests.test_profiler import *
+from tests.test_rpc_frames import *
+from tests.test_event_stream import *
+from tests.test_snapshot import *
+from tests.test_registry import *
+from tests.test_crypto import *
+from tests.test_compression import *
+from tests.test_source_provider import *
+from tests.test_breakinfo import *
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
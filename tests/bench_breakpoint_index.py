@@ -0,0 +1,126 @@
+"""
+    Benchmark for the code identity breakpoint index.
+
+    Generates a Django-style module with many model classes which all define
+    __init__(), sets a conditional breakpoint in one of them and counts the
+    line events a tracer receives when deciding which frames to trace:
+
+    - by function name (the former m_break_points_by_function lookup)
+    - by code identity (CBreakPointsManager.m_break_points_by_code)
+
+    Run with: python tests/bench_breakpoint_index.py [n_classes] [n_rounds]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from rpdb.breakpoint import CBreakPointsManager
+from rpdb.compat import load_source
+from rpdb.utils import as_unicode, winlower
+
+MODEL_TEMPLATE = '''
+class Model%(i)d(object):
+    def __init__(self, pk=None, name='', value=0):
+        self.pk = pk
+        self.name = name
+        self.value = value
+        self.extra = {}
+
+    def save(self):
+        return self.pk
+'''
+
+DRIVER = '''
+MODELS = [%(models)s]
+
+def run(n_rounds):
+    for i in range(n_rounds):
+        for model in MODELS:
+            model(i, 'name', i).save()
+'''
+
+
+def generate_module(n_classes):
+    parts = [MODEL_TEMPLATE % {'i': i} for i in range(n_classes)]
+    parts.append(DRIVER % {'models': ', '.join(['Model%d' % i for i in range(n_classes)])})
+    return ''.join(parts)
+
+
+def count_line_events(run, n_rounds, fshould_trace):
+    counters = {'line': 0}
+
+    def trace_line(frame, event, arg):
+        if event == 'line':
+            counters['line'] += 1
+        return trace_line
+
+    def trace_call(frame, event, arg):
+        if fshould_trace(frame.f_code):
+            return trace_line
+        return None
+
+    t0 = time.perf_counter()
+    sys.settrace(trace_call)
+    try:
+        run(n_rounds)
+    finally:
+        sys.settrace(None)
+
+    return counters['line'], time.perf_counter() - t0
+
+
+def main():
+    n_classes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    fd, path = tempfile.mkstemp(suffix='.py', prefix='bench_models_')
+    os.write(fd, generate_module(n_classes).encode())
+    os.close(fd)
+
+    try:
+        module = load_source('bench_models', path)
+        filename = winlower(module.__file__)
+
+        #
+        # Breakpoint on the first line of Model0.__init__ with a condition
+        # which is never true, so it costs tracing but never breaks.
+        #
+        bpm = CBreakPointsManager()
+        lineno = 4
+        bp = bpm.set_breakpoint(filename, as_unicode(''), lineno, True, as_unicode('pk is None'), as_unicode('utf-8'))
+
+        names = set([bp.m_scope_name.split('.')[-1]])
+        by_code = bpm.m_break_points_by_code
+
+        def by_name(code):
+            return code.co_name in names
+
+        def by_identity(code):
+            return (winlower(code.co_filename), code.co_firstlineno) in by_code
+
+        name_lines, name_time = count_line_events(module.run, n_rounds, by_name)
+        code_lines, code_time = count_line_events(module.run, n_rounds, by_identity)
+
+        result = {
+            'classes': n_classes,
+            'rounds': n_rounds,
+            'breakpoint_scope': bp.m_scope_fqn,
+            'line_events_by_name': name_lines,
+            'line_events_by_code': code_lines,
+            'seconds_by_name': round(name_time, 4),
+            'seconds_by_code': round(code_time, 4),
+        }
+        print(json.dumps(result, indent=2))
+
+    finally:
+        sys.modules.pop('bench_models', None)
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+"""
+    Benchmark of the tracing overhead of rpdb2.
+
+    Runs a fixed set of workloads in five debugger states and reports, as
+    JSON, the run time of each workload, its slowdown relative to running
+    without the debugger and the number of trace callbacks it caused:
+
+    - nodebugger:    rpdb2 is not imported
+    - embedded:      start_embedded_debugger() was called, no client attached,
+                     the debugger is driven into idle mode
+    - attached:      a client heartbeat was recorded, no breakpoints
+    - cold_bp:       attached, one breakpoint in a function that is never called
+    - hot_cond_bp:   attached, a conditional breakpoint in a hot loop which is
+                     never true
+
+    Idle mode depends on breakpoints, steps and break requests, not on
+    whether a client is attached, so the embedded and attached states are
+    expected to match. The 'idle' field of each state tells whether the
+    trace hooks were uninstalled; with the settrace engine this requires
+    Python 3.12+, otherwise both states keep tracing all calls.
+
+    Each state runs in its own process since the debugger can not be
+    removed once embedded. Callbacks are counted in a separate process
+    from the timing, with counting wrappers around the trace methods.
+
+    Run with: python tests/bench_tracing_overhead.py [--monitoring] [--scale=N] [--repeat=N] [--output=FILE]
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import getopt
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+RPDB_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATES = ['nodebugger', 'embedded', 'attached', 'cold_bp', 'hot_cond_bp']
+
+CHILD_TIMEOUT = 600
+
+IDLE_TIMEOUT = 5.0
+
+#
+# Trace methods which are wrapped to count callbacks. The sys.monitoring
+# callbacks themselves look up the traced frame with sys._getframe(1) and
+# can not be wrapped, their dispatch to the trace methods is counted instead.
+#
+CORE_CALLBACKS = ['trace_dispatch_init']
+THREAD_CALLBACKS = ['trace_dispatch_call', 'trace_dispatch', 'trace_dispatch_break',
+    'trace_dispatch_trap', 'trace_dispatch_signal', 'profile', 'profile_recursion',
+    'set_local_trace']
+MONITORING_CALLBACKS = ['__dispatch']
+
+
+
+#
+# ---------------------------------- Workloads --------------------------------------
+#
+
+def cold_function():
+    return None
+
+
+def hot_function(i):
+    x = i * 2
+    return x
+
+
+def tight_loop(n):
+    x = 0
+    for i in range(n * 50):
+        x += i
+    return x
+
+
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+
+def recursive_calls(n):
+    return [fib(15) for i in range(max(1, n // 500))]
+
+
+def small_functions(n):
+    s = 0
+    for i in range(n * 5):
+        s += hot_function(i)
+    return s
+
+
+def raise_value_error(i):
+    raise ValueError(i)
+
+
+def exceptions(n):
+    c = 0
+    for i in range(n):
+        try:
+            raise_value_error(i)
+        except ValueError:
+            c += 1
+    return c
+
+
+def thread_pool(n):
+    with concurrent.futures.ThreadPoolExecutor(max_workers = 4) as executor:
+        return sum(executor.map(hot_function, range(n)))
+
+
+def gen_values(n):
+    for i in range(n):
+        yield i
+
+
+async def async_value(i):
+    await asyncio.sleep(0)
+    return i
+
+
+async def async_main(n):
+    return sum(await asyncio.gather(*[async_value(i) for i in range(n)]))
+
+
+def generators_async(n):
+    s = sum(gen_values(n * 5))
+    s += asyncio.run(async_main(n // 5))
+    return s
+
+
+WORKLOADS = [
+    ('tight_loop', tight_loop),
+    ('recursive_calls', recursive_calls),
+    ('small_functions', small_functions),
+    ('exceptions', exceptions),
+    ('thread_pool', thread_pool),
+    ('generators_async', generators_async),
+    ]
+
+
+
+#
+# ---------------------------------- Child process ------------------------------------
+#
+
+def install_counters(rpdb2, counters):
+    def wrap(cls, name, key):
+        orig = getattr(cls, name)
+
+        def wrapper(self, *args, **kwargs):
+            counters[key] += 1
+            return orig(self, *args, **kwargs)
+
+        setattr(cls, name, wrapper)
+
+    for name in CORE_CALLBACKS:
+        wrap(rpdb2.CDebuggerCore, name, name)
+
+    for name in THREAD_CALLBACKS:
+        wrap(rpdb2.CDebuggerCoreThread, name, name)
+
+    for name in MONITORING_CALLBACKS:
+        wrap(rpdb2.CMonitoringEngine, '_CMonitoringEngine' + name, 'monitoring' + name[1:])
+
+
+def code_line(func, offset):
+    return func.__code__.co_firstlineno + offset
+
+
+def call_from_debugger_thread(rpdb2, target, *args):
+    """
+    Debugger requests must come from an untraced thread, the way
+    they do when they arrive through the RPC server.
+    """
+
+    t = rpdb2.CThread(target = target, args = args)
+    t.start()
+    t.join()
+
+
+def wait_for_idle(rpdb2, debugger):
+    """
+    Wait until the debugger uninstalls its trace hooks.
+    Return False if it does not become idle.
+    """
+
+    t0 = time.time()
+
+    while time.time() < t0 + IDLE_TIMEOUT:
+        #
+        # A traced call registers this thread with the debugger.
+        #
+        cold_function()
+        call_from_debugger_thread(rpdb2, debugger.check_idle)
+        if debugger.m_fidle:
+            return True
+
+        time.sleep(0.1)
+
+    return False
+
+
+def setup_state(state, fmonitoring, counters):
+    """
+    Put the debugger in the given state.
+    Return True if the debugger is idle.
+    """
+
+    if state == 'nodebugger':
+        return False
+
+    sys.path.insert(0, RPDB_PATH)
+    import rpdb2
+
+    if counters is not None:
+        install_counters(rpdb2, counters)
+
+    rpdb2.start_embedded_debugger('bench', timeout = 0, fMonitoring = fmonitoring)
+    debugger = rpdb2.g_debugger
+
+    if state == 'embedded':
+        #
+        # No heartbeats means no client is attached.
+        #
+        debugger.m_heartbeats = {}
+        return wait_for_idle(rpdb2, debugger)
+
+    debugger.record_client_heartbeat(1, True, False)
+
+    filename = rpdb2.as_unicode(rpdb2.winlower(os.path.abspath(__file__)))
+    empty = rpdb2.as_unicode('')
+
+    if state == 'cold_bp':
+        args = (filename, empty, code_line(cold_function, 1), True, empty, 0, False, 'utf-8')
+        call_from_debugger_thread(rpdb2, debugger.set_breakpoint, *args)
+
+    elif state == 'hot_cond_bp':
+        args = (filename, empty, code_line(hot_function, 1), True, rpdb2.as_unicode('i < 0'), 0, False, 'utf-8')
+        call_from_debugger_thread(rpdb2, debugger.set_breakpoint, *args)
+
+    call_from_debugger_thread(rpdb2, debugger.check_idle)
+    return debugger.m_fidle
+
+
+def run_child(state, fmonitoring, fcount, scale, repeat):
+    counters = None
+    if fcount:
+        counters = collections.Counter()
+
+    fidle = setup_state(state, fmonitoring, counters)
+
+    results = {}
+    for (name, workload) in WORKLOADS:
+        if fcount:
+            counters.clear()
+            workload(scale)
+            results[name] = dict(counters)
+            continue
+
+        best = None
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            workload(scale)
+            t = time.perf_counter() - t0
+            if best is None or t < best:
+                best = t
+
+        results[name] = best
+
+    sys.stdout.write(json.dumps({'idle': fidle, 'workloads': results}) + '\n')
+    sys.stdout.flush()
+
+    #
+    # Skip the debugger shutdown sequence, rpdb2 replaces os._exit() with
+    # a version that breaks into the debugger.
+    #
+    _exit = os._exit
+    if 'rpdb2' in sys.modules and sys.modules['rpdb2'].g_os_exit is not None:
+        _exit = sys.modules['rpdb2'].g_os_exit
+
+    _exit(0)
+
+
+
+#
+# ---------------------------------- Parent process ----------------------------------
+#
+
+def spawn_child(state, fmonitoring, fcount, scale, repeat):
+    args = [sys.executable, os.path.abspath(__file__), '--child=' + state, '--scale=%d' % scale, '--repeat=%d' % repeat]
+    if fmonitoring:
+        args.append('--monitoring')
+    if fcount:
+        args.append('--count')
+
+    p = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+    try:
+        (out, err) = p.communicate(timeout = CHILD_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        p.kill()
+        (out, err) = p.communicate()
+
+    for l in reversed(out.decode('utf-8', 'replace').splitlines()):
+        if l.startswith('{'):
+            return json.loads(l)
+
+    raise RuntimeError('Benchmark of state %s failed (exit code %s).' % (state, p.returncode))
+
+
+def run_parent(fmonitoring, scale, repeat):
+    timings = {}
+    callbacks = {}
+
+    for state in STATES:
+        timings[state] = spawn_child(state, fmonitoring, False, scale, repeat)
+        if state != 'nodebugger':
+            callbacks[state] = spawn_child(state, fmonitoring, True, scale, 1)
+
+    workloads = {}
+    for (name, workload) in WORKLOADS:
+        base = timings['nodebugger']['workloads'][name]
+
+        r = {}
+        for state in STATES:
+            t = timings[state]['workloads'][name]
+            cb = callbacks.get(state, {}).get('workloads', {}).get(name, {})
+
+            r[state] = {
+                'idle': timings[state]['idle'],
+                'seconds': round(t, 6),
+                'slowdown': round(t / base, 2) if base > 0 else None,
+                'callbacks': cb,
+                'total_callbacks': sum(cb.values()),
+                }
+
+        workloads[name] = r
+
+    return {
+        'python': platform.python_version(),
+        'engine': ['settrace', 'monitoring'][fmonitoring],
+        'scale': scale,
+        'repeat': repeat,
+        'workloads': workloads,
+        }
+
+
+def main():
+    (options, args) = getopt.getopt(sys.argv[1:], '', ['child=', 'monitoring', 'count', 'scale=', 'repeat=', 'output='])
+    options = dict(options)
+
+    fmonitoring = '--monitoring' in options
+    scale = int(options.get('--scale', 20000))
+    repeat = int(options.get('--repeat', 3))
+
+    if '--child' in options:
+        run_child(options['--child'], fmonitoring, '--count' in options, scale, repeat)
+        return
+
+    result = run_parent(fmonitoring, scale, repeat)
+    s = json.dumps(result, indent = 2, sort_keys = True)
+
+    if '--output' in options:
+        with open(options['--output'], 'w') as f:
+            f.write(s + '\n')
+
+    print(s)
+
+
+if __name__ == '__main__':
+    main()
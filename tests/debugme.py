@@ -9,7 +9,7 @@ else:
     def u(s): return unicode(s)
 
 prefix = 'DEBUGME: '
-pathprefix = os.path.join( os.path.dirname( __file__) )
+pathprefix = os.environ.get( 'DEBUGME_STEPS_DIR', os.path.dirname( __file__ ) )
 
 def step(t):
     print( prefix + u(t) )
@@ -0,0 +1,141 @@
+import os
+import py_compile
+import shutil
+import tempfile
+from unittest.case import TestCase
+
+import rpdb.breakinfo
+from rpdb.breakinfo import CFileBreakInfo, CalcValidLines, calc_break_info, calc_break_info_key, \
+    load_break_info, save_break_info, load_compiled_code, BREAKINFO_SCOPES
+from rpdb.const import BREAKINFO_CACHE_MIN_SIZE
+from rpdb.exceptions import InvalidScopeName
+from rpdb.source_provider import calc_source_signature
+
+SOURCE = '''import os
+
+def f(x):
+    for i in x:
+        pass
+
+    return 1
+
+class C:
+    def m(self):
+        return 2
+'''
+
+
+class TestBreakInfo( TestCase ):
+    def setUp( self ):
+        self.folder = tempfile.mkdtemp()
+        self.compile = rpdb.breakinfo.compile = CCountingCompile()
+
+    def tearDown( self ):
+        del rpdb.breakinfo.compile
+        shutil.rmtree( self.folder )
+
+    def write( self, name, source ):
+        path = os.path.join( self.folder, name )
+        f = open( path, 'w' )
+        f.write( source )
+        f.close()
+        return path
+
+    def testValidLines( self ):
+        code = compile( SOURCE, 'test', 'exec' )
+
+        self.assertEqual( [ 1, 3, 9 ], CalcValidLines( code ) )
+        f = [ c for c in code.co_consts if getattr( c, 'co_name', None ) == 'f' ][ 0 ]
+        self.assertEqual( [ 3, 4, 5, 7 ], CalcValidLines( f ) )
+
+    def testScopes( self ):
+        info = calc_break_info( compile( SOURCE, 'test', 'exec' ) )
+
+        fqns = [ fqn for (fqn, valid_lines) in info[ BREAKINFO_SCOPES ] ]
+        self.assertEqual( [ '<module>.f', '<module>.C.m', '<module>.C', '<module>' ], fqns )
+
+    def testFileBreakInfo( self ):
+        path = self.write( 'a.py', SOURCE )
+
+        mbi = CFileBreakInfo( path, self.folder )
+        mbi.CalcBreakInfo()
+
+        (s, l) = mbi.FindScopeByLineno( 6 )
+        self.assertEqual( ('<module>.f', 5), (s.m_fqn, l) )
+        self.assertEqual( 1, self.compile.m_count )
+
+    def testFindScope( self ):
+        mbi = CFileBreakInfo( self.write( 'a.py', SOURCE ), self.folder )
+        mbi.CalcBreakInfo()
+
+        def find( lineno ):
+            (s, l) = mbi.FindScopeByLineno( lineno )
+            return (s.m_fqn, l)
+
+        self.assertEqual( ('<module>', 1), find( 0 ) )
+        self.assertEqual( ('<module>', 1), find( 2 ) )
+        self.assertEqual( ('<module>.f', 4), find( 4 ) )
+        self.assertEqual( ('<module>.f', 5), find( 6 ) )
+        self.assertEqual( ('<module>.f', 7), find( 8 ) )
+        self.assertEqual( ('<module>.C', 9), find( 9 ) )
+        self.assertEqual( ('<module>.C.m', 11), find( 11 ) )
+        self.assertEqual( ('<module>.C.m', 11), find( 100 ) )
+
+    def testFindScopeByName( self ):
+        mbi = CFileBreakInfo( self.write( 'a.py', SOURCE ), self.folder )
+        mbi.CalcBreakInfo()
+
+        (s, l) = mbi.FindScopeByName( 'f', 1 )
+        self.assertEqual( ('<module>.f', 4), (s.m_fqn, l) )
+
+        (s, l) = mbi.FindScopeByName( '?.C.m', 0 )
+        self.assertEqual( ('<module>.C.m', 10), (s.m_fqn, l) )
+
+        self.assertRaises( InvalidScopeName, mbi.FindScopeByName, 'g', 0 )
+
+    def testCompiledCode( self ):
+        path = self.write( 'a.py', SOURCE )
+        py_compile.compile( path, doraise = True )
+
+        code = load_compiled_code( path, calc_source_signature( path ) )
+        self.assertEqual( '<module>', code.co_name )
+
+        mbi = CFileBreakInfo( path, self.folder )
+        mbi.CalcBreakInfo()
+        self.assertEqual( 0, self.compile.m_count )
+
+        self.write( 'a.py', SOURCE + '\nx = 1\n' )
+        self.assertEqual( None, load_compiled_code( path, calc_source_signature( path ) ) )
+
+    def testCache( self ):
+        source = SOURCE + 'x = 1\n' * (BREAKINFO_CACHE_MIN_SIZE // 6)
+        key = calc_break_info_key( source )
+        self.assertEqual( None, load_break_info( key, self.folder ) )
+
+        path = self.write( 'a.py', source )
+        mbi = CFileBreakInfo( path, self.folder )
+        mbi.CalcBreakInfo()
+        self.assertEqual( 1, self.compile.m_count )
+
+        info = load_break_info( key, self.folder )
+        self.assertEqual( mbi.m_last_line, info[ 'last_line' ] )
+
+        other = self.write( 'b.py', source )
+        mbi = CFileBreakInfo( other, self.folder )
+        mbi.CalcBreakInfo()
+        self.assertEqual( 1, self.compile.m_count )
+        self.assertEqual( '<module>.C.m', mbi.FindScopeByLineno( 11 )[ 0 ].m_fqn )
+
+    def testCorruptCache( self ):
+        key = calc_break_info_key( SOURCE )
+        save_break_info( key, { 'first_line': 1 }, self.folder )
+        self.assertEqual( None, load_break_info( key, self.folder ) )
+
+
+class CCountingCompile:
+    def __init__( self ):
+        self.m_count = 0
+
+    def __call__( self, *args ):
+        self.m_count += 1
+        return compile( *args )
@@ -0,0 +1,116 @@
+import os
+import tempfile
+from unittest.case import TestCase
+
+from rpdb.breakpoint import CBreakPointsManager
+from rpdb.exceptions import BadArgument
+from rpdb.utils import as_unicode, winlower
+
+SOURCE = '''
+class A:
+    def __init__(self):
+        self.a = 1
+
+class B:
+    def __init__(self):
+        self.b = 2
+
+def f():
+    return A()
+'''
+
+class TestBreakPointsByCode( TestCase ):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp( suffix='.py' )
+        os.write( fd, SOURCE.encode() )
+        os.close( fd )
+        self.filename = winlower( self.filename )
+
+        code = compile( SOURCE, self.filename, 'exec' )
+        self.codes = {}
+        for c in code.co_consts:
+            if hasattr( c, 'co_consts' ):
+                for _c in c.co_consts:
+                    if hasattr( _c, 'co_name' ):
+                        self.codes[ c.co_name + '.' + _c.co_name ] = _c
+                self.codes[ c.co_name ] = c
+        self.codes[ '<module>' ] = code
+
+        self.bpm = CBreakPointsManager()
+
+    def tearDown(self):
+        os.unlink( self.filename )
+
+    def key( self, name ):
+        return ( self.filename, self.codes[ name ].co_firstlineno )
+
+    def testBreakpointInMethod( self ):
+        self.bpm.set_breakpoint( self.filename, as_unicode(''), 4, True, as_unicode(''), as_unicode('utf-8') )
+        self.assertIn( self.key( 'A.__init__' ), self.bpm.m_break_points_by_code )
+        self.assertNotIn( self.key( 'B.__init__' ), self.bpm.m_break_points_by_code )
+        self.assertEqual( 1, len( self.bpm.m_break_points_by_code ) )
+
+    def testBreakpointOnDeclaration( self ):
+        self.bpm.set_breakpoint( self.filename, as_unicode('f'), 0, True, as_unicode(''), as_unicode('utf-8') )
+        self.assertIn( self.key( 'f' ), self.bpm.m_break_points_by_code )
+        self.assertIn( self.key( '<module>' ), self.bpm.m_break_points_by_code )
+
+    def testDisableAndDelete( self ):
+        bp = self.bpm.set_breakpoint( self.filename, as_unicode(''), 8, True, as_unicode(''), as_unicode('utf-8') )
+        self.assertIn( self.key( 'B.__init__' ), self.bpm.m_break_points_by_code )
+        self.bpm.disable_breakpoint( [bp.m_id], False )
+        self.assertEqual( {}, self.bpm.m_break_points_by_code )
+        self.bpm.enable_breakpoint( [bp.m_id], False )
+        self.assertIn( self.key( 'B.__init__' ), self.bpm.m_break_points_by_code )
+        self.bpm.delete_breakpoint( [bp.m_id], False )
+        self.assertEqual( {}, self.bpm.m_break_points_by_code )
+
+
+class TestBreakPointFilters( TestCase ):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp( suffix='.py' )
+        os.write( fd, SOURCE.encode() )
+        os.close( fd )
+        self.filename = winlower( self.filename )
+
+        self.bpm = CBreakPointsManager()
+        self.bp = self.bpm.set_breakpoint( self.filename, as_unicode(''), 4, True, as_unicode(''), as_unicode('utf-8') )
+
+    def tearDown(self):
+        os.unlink( self.filename )
+
+    def hits( self, n ):
+        return [ i + 1 for i in range( n ) if self.bp.count_hit() ]
+
+    def testNoFilter( self ):
+        self.assertFalse( self.bp.has_filter() )
+        self.assertEqual( [1, 2, 3], self.hits( 3 ) )
+        self.assertEqual( 3, self.bp.m_hit_count )
+
+    def testIgnoreAndEvery( self ):
+        self.bpm.set_breakpoint_filter( [self.bp.m_id], False, 3, 0, 1.0 )
+        self.assertEqual( [4, 5], self.hits( 5 ) )
+
+        self.bpm.set_breakpoint_filter( [], True, 0, 4, 1.0 )
+        self.assertEqual( [4, 8], self.hits( 10 ) )
+        self.assertEqual( 10, self.bp.m_hit_count )
+
+        self.bpm.set_breakpoint_filter( [], True, 5, 2, 1.0 )
+        self.assertEqual( [6, 8, 10], self.hits( 10 ) )
+
+    def testProbability( self ):
+        self.bpm.set_breakpoint_filter( [self.bp.m_id], False, 0, 0, 0.25 )
+        n = len( self.hits( 4000 ) )
+        self.assertTrue( 700 < n < 1300 )
+
+    def testBadFilter( self ):
+        self.assertRaises( BadArgument, self.bpm.set_breakpoint_filter, [], True, -1, 0, 1.0 )
+        self.assertRaises( BadArgument, self.bpm.set_breakpoint_filter, [], True, 0, 0, 0.0 )
+        self.assertRaises( BadArgument, self.bpm.set_breakpoint_filter, [], True, 0, 'x', 1.0 )
+
+    def testLogpoint( self ):
+        self.assertFalse( self.bp.is_logpoint() )
+        lp = self.bpm.set_breakpoint( self.filename, as_unicode(''), 8, True, as_unicode(''), as_unicode('utf-8'), [ as_unicode('self.b'), as_unicode('1 + 1') ] )
+        self.assertTrue( lp.is_logpoint() )
+        self.assertEqual( [2], [ eval( c ) for c in lp.m_log_codes[ 1: ] ] )
+        self.assertRaises( SyntaxError, self.bpm.set_breakpoint, self.filename, as_unicode(''), 8, True, as_unicode(''), as_unicode('utf-8'), [ as_unicode('1 +') ] )
@@ -0,0 +1,70 @@
+import gc
+from unittest.case import TestCase
+
+from rpdb.code_cache import CWeakKeyCache
+
+
+def make_code(i):
+    return compile('x = %d' % i, '<test-%d>' % i, 'exec')
+
+
+class TestWeakKeyCache( TestCase ):
+    def testHitsAndMisses( self ):
+        cache = CWeakKeyCache()
+        code = make_code(0)
+
+        self.assertRaises( KeyError, cache.__getitem__, code )
+        self.assertEqual( 'a', cache.setdefault( code, 'a' ) )
+        self.assertEqual( 'a', cache.setdefault( code, 'b' ) )
+        self.assertEqual( 'a', cache[ code ] )
+        self.assertTrue( code in cache )
+
+        stats = cache.get_stats()
+        self.assertEqual( 1, stats[ 'hits' ] )
+        self.assertEqual( 1, stats[ 'misses' ] )
+        self.assertEqual( 1, stats[ 'size' ] )
+
+    def testReleaseUnreachableKeys( self ):
+        cache = CWeakKeyCache()
+        codes = [ make_code(i) for i in range(10) ]
+        for c in codes:
+            cache.setdefault( c, c.co_filename )
+
+        del c
+        del codes[ 5: ]
+        gc.collect()
+
+        self.assertEqual( 5, len( cache ) )
+        self.assertEqual( sorted( [ c.co_filename for c in codes ] ), sorted( cache.values() ) )
+        self.assertEqual( 5, cache.get_stats()[ 'releases' ] )
+
+    def testEvictOldest( self ):
+        cache = CWeakKeyCache( max_size = 3 )
+        codes = [ make_code(i) for i in range(5) ]
+        for c in codes:
+            cache.setdefault( c, c.co_filename )
+
+        self.assertEqual( 3, len( cache ) )
+        self.assertFalse( codes[ 0 ] in cache )
+        self.assertFalse( codes[ 1 ] in cache )
+        self.assertTrue( codes[ 4 ] in cache )
+        self.assertEqual( 2, cache.get_stats()[ 'evictions' ] )
+
+    def testReleaseOutsideLock( self ):
+        cache = CWeakKeyCache( max_size = 1 )
+        codes = [ make_code(i) for i in range(3) ]
+        inserted = []
+
+        class CValue:
+            def __del__( self ):
+                #
+                # An evicted value may run code which is traced and
+                # looks up the cache again.
+                #
+                inserted.append( cache.setdefault( codes[ 2 ], 'c' ) )
+
+        cache.setdefault( codes[ 0 ], CValue() )
+        cache.setdefault( codes[ 1 ], 'b' )
+
+        self.assertEqual( [ 'c' ], inserted )
+        self.assertTrue( codes[ 2 ] in cache )
@@ -0,0 +1,62 @@
+import pickle
+import zlib
+from unittest.case import TestCase
+
+from rpdb.compression import CCompressor, calc_compression_level, COMPRESSION_DICT
+from rpdb.const import DICT_KEY_EXPR, DICT_KEY_NAME, DICT_KEY_REPR, DICT_KEY_IS_VALID, DICT_KEY_TYPE, \
+    DICT_KEY_N_SUBNODES, COMPRESSION_MIN_SIZE, FAST_LINK_MIN_SIZE, FAST_LINK_SPEED, SLOW_LINK_SPEED
+
+
+def make_namespace( n ):
+    rl = []
+    for i in range( n ):
+        rl.append( {
+            DICT_KEY_EXPR: '(locals())["v%d"]' % i,
+            DICT_KEY_NAME: 'v%d' % i,
+            DICT_KEY_REPR: repr( i * 1000 ),
+            DICT_KEY_IS_VALID: True,
+            DICT_KEY_TYPE: 'int',
+            DICT_KEY_N_SUBNODES: 0
+            } )
+
+    return pickle.dumps( (0, 1, 'client', (1, rl, None)), 2 )
+
+
+class TestCompression( TestCase ):
+    def testLevel( self ):
+        self.assertEqual( 0, calc_compression_level( COMPRESSION_MIN_SIZE - 1, None ) )
+        self.assertEqual( 1, calc_compression_level( COMPRESSION_MIN_SIZE, None ) )
+        self.assertEqual( 0, calc_compression_level( FAST_LINK_MIN_SIZE - 1, FAST_LINK_SPEED ) )
+        self.assertEqual( 1, calc_compression_level( FAST_LINK_MIN_SIZE, FAST_LINK_SPEED ) )
+        self.assertEqual( 6, calc_compression_level( COMPRESSION_MIN_SIZE, SLOW_LINK_SPEED ) )
+        self.assertEqual( 9, calc_compression_level( COMPRESSION_MIN_SIZE, SLOW_LINK_SPEED - 1 ) )
+
+    def testPresetDictionary( self ):
+        sender = CCompressor()
+        receiver = CCompressor()
+
+        s = make_namespace( 10 )
+        (fcompress, data) = sender.compress( s, SLOW_LINK_SPEED )
+        self.assertTrue( fcompress )
+        self.assertTrue( len( data ) < len( zlib.compress( s, 9 ) ) )
+        self.assertEqual( s, receiver.decompress( fcompress, data ) )
+
+        self.assertEqual( (False, b'x'), sender.compress( b'x', SLOW_LINK_SPEED ) )
+        self.assertEqual( b'x', receiver.decompress( False, b'x' ) )
+
+        stats = (2, 1, len( s ) + 1, len( data ) + 1)
+        self.assertEqual( (None, stats, (0, 0, 0, 0)), sender.get_stats() )
+        self.assertEqual( (None, (0, 0, 0, 0), stats), receiver.get_stats() )
+
+    def testLinkSpeed( self ):
+        c = CCompressor()
+        s = make_namespace( 10 )
+
+        c.record_transfer( FAST_LINK_SPEED * 2, 1.0 )
+        self.assertEqual( (False, s), c.compress( s ) )
+
+        c.record_transfer( 1024, 1.0 )
+        c.record_transfer( 1024, 1.0 )
+        c.record_transfer( 1024, 1.0 )
+        self.assertTrue( c.get_link_speed() < FAST_LINK_SPEED )
+        self.assertTrue( c.compress( s )[ 0 ] )
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.case import TestCase
+
+from rpdb.const import POSIX
+from rpdb.crypto import derive_key, calc_key_id, load_key_cache, save_key_cache, load_key_secret, KDF_HASH, KDF_SALT, \
+    KDF_ITERATIONS, MAX_CACHED_KEYS, KEY_SECRET_EXT
+from rpdb.utils import as_unicode, as_bytes
+
+PWD = as_unicode('secret')
+
+
+@unittest.skipUnless( os.name == POSIX, 'The key cache is only kept on Posix systems' )
+class TestKeyCache( TestCase ):
+    def setUp( self ):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join( self.folder, 'settings', 'keys' )
+
+    def tearDown( self ):
+        shutil.rmtree( self.folder )
+
+    def key_id( self, pwd ):
+        (secret, fcreated) = load_key_secret( self.path )
+        return calc_key_id( pwd, secret )
+
+    def testDerive( self ):
+        key = hashlib.pbkdf2_hmac( KDF_HASH, as_bytes( PWD ), KDF_SALT, KDF_ITERATIONS )
+
+        self.assertEqual( key, derive_key( PWD, self.path ) )
+        self.assertEqual( 0, os.stat( self.path ).st_mode & int( '077', 8 ) )
+        self.assertEqual( 0, os.stat( self.path + KEY_SECRET_EXT ).st_mode & int( '077', 8 ) )
+        self.assertEqual( { self.key_id( PWD ): key.hex() }, load_key_cache( self.path ) )
+
+        #
+        # The cached key is used.
+        #
+        save_key_cache( { self.key_id( PWD ): '00' * 4 }, self.path )
+        self.assertEqual( as_bytes( '\x00' ) * 4, derive_key( PWD, self.path ) )
+
+    def testSecret( self ):
+        (secret, fcreated) = load_key_secret( self.path )
+        self.assertTrue( fcreated )
+        self.assertEqual( (secret, False), load_key_secret( self.path ) )
+
+        #
+        # Without the secret the id of a key can not be calculated.
+        #
+        other_path = os.path.join( self.folder, 'other', 'keys' )
+        self.assertNotEqual( self.key_id( PWD ), calc_key_id( PWD, load_key_secret( other_path )[ 0 ] ) )
+
+    def testCacheOlderThanSecret( self ):
+        save_key_cache( { 'old': '00' * 4 }, self.path )
+
+        derive_key( PWD, self.path )
+        self.assertEqual( [ self.key_id( PWD ) ], list( load_key_cache( self.path ).keys() ) )
+
+    def testUnsafePermissions( self ):
+        save_key_cache( { self.key_id( PWD ): '00' * 4 }, self.path )
+        os.chmod( self.path, int( '0644', 8 ) )
+
+        self.assertEqual( {}, load_key_cache( self.path ) )
+        self.assertEqual( 32, len( derive_key( PWD, self.path ) ) )
+
+    def testSize( self ):
+        for i in range( MAX_CACHED_KEYS + 2 ):
+            derive_key( as_unicode( 'pwd%d' % i ), self.path )
+
+        cache = load_key_cache( self.path )
+        self.assertEqual( MAX_CACHED_KEYS, len( cache ) )
+        self.assertFalse( self.key_id( as_unicode( 'pwd0' ) ) in cache )
+        self.assertTrue( self.key_id( as_unicode( 'pwd%d' % (MAX_CACHED_KEYS + 1) ) ) in cache )
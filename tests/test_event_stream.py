@@ -0,0 +1,95 @@
+import queue
+import socket
+import threading
+from unittest.case import TestCase
+
+import rpdb.event_stream
+from rpdb.event_stream import CEventPusher
+
+TIMEOUT = 5
+
+
+class CFakeEventQueue:
+    def __init__(self):
+        self.m_lock = threading.Condition()
+        self.m_events = []
+
+    def fire(self, *events):
+        with self.m_lock:
+            self.m_events.extend(events)
+            self.m_lock.notify_all()
+
+    def notify(self):
+        with self.m_lock:
+            self.m_lock.notify_all()
+
+    def wait_for_event(self, timeout, event_index, n_receivers = 1):
+        with self.m_lock:
+            if event_index >= len(self.m_events):
+                self.m_lock.wait(timeout)
+
+            return (len(self.m_events), self.m_events[event_index:])
+
+
+class TestEventPusher( TestCase ):
+    def setUp( self ):
+        self.events = CFakeEventQueue()
+        self.pusher = CEventPusher( self.events.wait_for_event, self.events.notify )
+        self.pushed = queue.Queue()
+
+    def tearDown( self ):
+        self.pusher.stop()
+
+    def receive( self, event_index ):
+        """
+        Return the events pushed up to event_index.
+        """
+
+        events = []
+        while True:
+            (n, sel) = self.pushed.get( timeout = TIMEOUT )
+            events.extend( sel )
+            if n >= event_index:
+                self.assertEqual( event_index, n )
+                return events
+
+    def testPush( self ):
+        self.pusher.subscribe( self.pushed.put, 0 )
+        self.events.fire( 'a', 'b' )
+        self.assertEqual( [ 'a', 'b' ], self.receive( 2 ) )
+
+        self.events.fire( 'c' )
+        self.assertEqual( [ 'c' ], self.receive( 3 ) )
+
+    def testResume( self ):
+        self.events.fire( 'a', 'b', 'c' )
+        self.pusher.subscribe( self.pushed.put, 2 )
+        self.assertEqual( [ 'c' ], self.receive( 3 ) )
+
+    def testWindow( self ):
+        window = rpdb.event_stream.EVENT_PUSH_WINDOW
+        rpdb.event_stream.EVENT_PUSH_WINDOW = 2
+
+        try:
+            sid = self.pusher.subscribe( self.pushed.put, 0 )
+            self.events.fire( 'a', 'b', 'c', 'd', 'e' )
+            self.assertEqual( [ 'a', 'b' ], self.receive( 2 ) )
+            self.assertRaises( queue.Empty, self.pushed.get, timeout = 0.2 )
+
+            self.assertTrue( self.pusher.ack( sid, 2 ) )
+            self.assertEqual( [ 'c', 'd' ], self.receive( 4 ) )
+
+        finally:
+            rpdb.event_stream.EVENT_PUSH_WINDOW = window
+
+    def testClosedSubscriber( self ):
+        def push( r ):
+            raise socket.error
+
+        sid = self.pusher.subscribe( push, 0 )
+        other = self.pusher.subscribe( self.pushed.put, 0 )
+        self.events.fire( 'a' )
+
+        self.assertEqual( [ 'a' ], self.receive( 1 ) )
+        self.assertFalse( self.pusher.ack( sid, 1 ) )
+        self.assertTrue( self.pusher.ack( other, 1 ) )
@@ -0,0 +1,41 @@
+from unittest.case import TestCase
+
+from rpdb.logpoints import CLogBuffer
+
+
+class TestLogBuffer( TestCase ):
+    def testBatches( self ):
+        lb = CLogBuffer( max_records = 10 )
+        for i in range( 5 ):
+            lb.append( (0.0, 1, 0, i, [ str(i) ]) )
+
+        records, dropped = lb.pop_records( 3 )
+        self.assertEqual( [0, 1, 2], [ r[3] for r in records ] )
+        self.assertEqual( 0, dropped )
+
+        records, dropped = lb.pop_records( 3 )
+        self.assertEqual( [3, 4], [ r[3] for r in records ] )
+        self.assertEqual( 0, len( lb ) )
+
+    def testDropOldest( self ):
+        lb = CLogBuffer( max_records = 3 )
+        for i in range( 5 ):
+            lb.append( (0.0, 1, 0, i, []) )
+
+        records, dropped = lb.pop_records( 10 )
+        self.assertEqual( [2, 3, 4], [ r[3] for r in records ] )
+        self.assertEqual( 2, dropped )
+        self.assertEqual( ([], 0), lb.pop_records( 10 ) )
+
+    def testNotifyWhenEmpty( self ):
+        notified = []
+        lb = CLogBuffer()
+        lb.set_notify( lambda: notified.append( True ) )
+
+        lb.append( (0.0, 1, 0, 1, []) )
+        lb.append( (0.0, 1, 0, 2, []) )
+        self.assertEqual( 1, len( notified ) )
+
+        lb.pop_records( 10 )
+        lb.append( (0.0, 1, 0, 3, []) )
+        self.assertEqual( 2, len( notified ) )
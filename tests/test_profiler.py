@@ -0,0 +1,80 @@
+import threading
+import time
+from unittest.case import TestCase
+
+from rpdb.exceptions import BadArgument
+from rpdb.profiler import CSamplingProfiler
+from rpdb.rpc import CThread
+
+
+def frame_path( frame ):
+    return frame.f_code.co_filename
+
+
+def parked( event ):
+    event.wait()
+
+
+class TestSamplingProfiler( TestCase ):
+    def setUp( self ):
+        self.event = threading.Event()
+        self.thread = threading.Thread( target = parked, args = ( self.event, ) )
+        self.thread.start()
+        self.profiler = CSamplingProfiler( frame_path )
+
+    def tearDown( self ):
+        self.profiler.stop()
+        self.event.set()
+        self.thread.join()
+
+    def parkedStacks( self, stacks ):
+        return [ s for s in stacks if ';parked (' in s ]
+
+    def testSample( self ):
+        self.profiler.sample()
+        self.profiler.sample()
+
+        (frunning, interval, samples, dropped, stacks) = self.profiler.get_profile()
+        self.assertFalse( frunning )
+        self.assertEqual( 0, dropped )
+
+        lines = self.parkedStacks( stacks )
+        self.assertEqual( 1, len( lines ) )
+
+        (stack, count) = lines[ 0 ].rsplit( ' ', 1 )
+        self.assertEqual( '2', count )
+        self.assertTrue( stack.startswith( '_bootstrap (' ) )
+        self.assertTrue( stack.split( ';' )[ -1 ].startswith( 'wait (' ) )
+
+    def testFinishedDebuggerThread( self ):
+        finished = CThread( target = lambda: None )
+        finished.start()
+        finished.join()
+
+        #
+        # The finished thread is still referenced and its ident is
+        # reused by a user thread.
+        #
+        finished._ident = self.thread.ident
+
+        self.profiler.sample()
+
+        (frunning, interval, samples, dropped, stacks) = self.profiler.get_profile()
+        self.assertEqual( 1, len( self.parkedStacks( stacks ) ) )
+
+    def testTimer( self ):
+        self.profiler.start( 2 )
+        time.sleep( 0.2 )
+        self.assertTrue( self.profiler.is_running() )
+        self.profiler.stop()
+
+        (frunning, interval, samples, dropped, stacks) = self.profiler.get_profile()
+        self.assertFalse( frunning )
+        self.assertEqual( 2, interval )
+        self.assertTrue( samples > 5 )
+        self.assertTrue( len( self.parkedStacks( stacks ) ) > 0 )
+
+    def testBadInterval( self ):
+        self.assertRaises( BadArgument, self.profiler.start, 0 )
+        self.assertRaises( BadArgument, self.profiler.start, 'x' )
+        self.assertFalse( self.profiler.is_running() )
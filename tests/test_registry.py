@@ -0,0 +1,88 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest.case import TestCase
+
+from rpdb.registry import register_server, unregister_server, list_servers, calc_record_path, calc_socket_path, \
+    is_pid_alive, get_process_start_time, RECORD_PID, RECORD_PORT, RECORD_RID, RECORD_FILENAME, RECORD_STATE, \
+    RECORD_TIME, RECORD_EMBEDDED, RECORD_SOCKET, RECORD_START_TIME
+
+
+def make_record( pid, port = 51000 ):
+    return {
+        RECORD_PID: pid,
+        RECORD_PORT: port,
+        RECORD_RID: '1234',
+        RECORD_FILENAME: 'debugme.py',
+        RECORD_STATE: 'running',
+        RECORD_TIME: 0.0,
+        RECORD_EMBEDDED: False,
+        RECORD_SOCKET: None,
+        RECORD_START_TIME: get_process_start_time( pid )
+        }
+
+
+def dead_pid():
+    p = subprocess.Popen( [ sys.executable, '-c', 'pass' ] )
+    p.wait()
+    return p.pid
+
+
+class TestRegistry( TestCase ):
+    def setUp( self ):
+        self.folder = os.path.join( tempfile.mkdtemp(), 'servers' )
+
+    def tearDown( self ):
+        shutil.rmtree( os.path.dirname( self.folder ) )
+
+    def testRegister( self ):
+        self.assertEqual( [], list_servers( self.folder ) )
+
+        record = make_record( os.getpid() )
+        register_server( record, self.folder )
+        self.assertEqual( [ record ], list_servers( self.folder ) )
+
+        record[ RECORD_STATE ] = 'broken'
+        register_server( record, self.folder )
+        self.assertEqual( [ record ], list_servers( self.folder ) )
+        self.assertEqual( 1, len( os.listdir( self.folder ) ) )
+
+        unregister_server( os.getpid(), self.folder )
+        self.assertEqual( [], list_servers( self.folder ) )
+
+    def testStaleRecord( self ):
+        pid = dead_pid()
+        self.assertFalse( is_pid_alive( pid ) )
+
+        register_server( make_record( pid ), self.folder )
+        open( calc_socket_path( pid, self.folder ), 'w' ).close()
+
+        self.assertEqual( [], list_servers( self.folder ) )
+        self.assertEqual( [], os.listdir( self.folder ) )
+
+    def testReusedPid( self ):
+        start_time = get_process_start_time( os.getpid() )
+        if start_time is None:
+            self.skipTest( 'Process start time is not available.' )
+
+        self.assertEqual( start_time, get_process_start_time( os.getpid() ) )
+
+        record = make_record( os.getpid() )
+        record[ RECORD_START_TIME ] = start_time - 1
+        register_server( record, self.folder )
+
+        self.assertEqual( [], list_servers( self.folder ) )
+        self.assertEqual( [], os.listdir( self.folder ) )
+
+    def testMalformedRecord( self ):
+        register_server( make_record( os.getpid() ), self.folder )
+
+        path = calc_record_path( os.getpid() + 1, self.folder )
+        f = open( path, 'w' )
+        f.write( '{"pid": ' )
+        f.close()
+
+        self.assertEqual( 1, len( list_servers( self.folder ) ) )
+        self.assertFalse( os.path.exists( path ) )
@@ -0,0 +1,385 @@
+import base64
+import os
+import queue
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import xmlrpc.client as xmlrpclib
+from unittest.case import TestCase
+
+import rpdb.globals
+from rpdb.const import LOOPBACK, get_interface_compatibility_version
+from rpdb.crypto import CCrypto, CIPHER_AES_GCM, CIPHER_CHACHA20_POLY1305, CIPHER_DES_CBC, get_supported_ciphers, \
+    is_cipher_supported, is_encryption_supported
+from rpdb.debugee import CIOServer
+from rpdb.exceptions import BadArgument, AuthenticationFailure
+from rpdb.rpc import CPwdServerProxy, CLocalTransport, CPooledTransport, CMultiCall, send_frame, recv_frame, recv_exact, \
+    calc_frame_flags, calc_frame_encryption, is_frames_connection, FRAME_COMPRESSED, FRAME_ENCRYPTED, FRAMES_MAGIC, \
+    FRAME_HEADER, MAX_UNAUTHENTICATED_FRAME_SIZE, NO_DIGEST
+from rpdb.utils import as_bytes, as_unicode, calcURL
+
+PWD = as_unicode('frames')
+
+
+class CEchoServer(CIOServer):
+    def export_echo(self, x):
+        return x
+
+    def export_sleep(self, t):
+        time.sleep(t)
+        return t
+
+    def export_sleep_echo(self, x, t):
+        time.sleep(t)
+        return x
+
+    def export_push(self, x):
+        push = self.get_push_callback()
+        if push is None:
+            return False
+
+        push(x)
+        return True
+
+
+class CLegacyServer(CEchoServer):
+    """
+    Server that does not know the framed protocol.
+    """
+
+    handle_frames = None
+
+
+class TestFrames( TestCase ):
+    def testFrameRoundTrip( self ):
+        (a, b) = socket.socketpair()
+        try:
+            digest = as_unicode( '0123456789abcdef' * 2 )
+            send_frame( a, 7, FRAME_COMPRESSED, digest, b'x' * 100000 )
+            send_frame( a, 8, 0, None, b'' )
+
+            self.assertEqual( (7, FRAME_COMPRESSED, digest, b'x' * 100000), recv_frame( b ) )
+            (call_id, flags, digest, payload) = recv_frame( b )
+            self.assertEqual( (8, b''), (call_id, payload) )
+
+            a.close()
+            self.assertRaises( socket.error, recv_frame, b )
+
+        finally:
+            a.close()
+            b.close()
+
+    def testPartialMagicTimeout( self ):
+        (a, b) = socket.socketpair()
+        try:
+            a.sendall( FRAMES_MAGIC[ :2 ] )
+
+            t0 = time.time()
+            self.assertFalse( is_frames_connection( b, timeout = 0.2 ) )
+            self.assertLess( time.time() - t0, 2 )
+            self.assertEqual( None, b.gettimeout() )
+
+            a.sendall( FRAMES_MAGIC[ 2: ] )
+            self.assertTrue( is_frames_connection( b, timeout = 0.2 ) )
+
+        finally:
+            a.close()
+            b.close()
+
+    def downgrade( self, fAllowUnencrypted, ciphers ):
+        crypto = CCrypto( PWD, fAllowUnencrypted, as_unicode('client') )
+        proxy = CPwdServerProxy( crypto, calcURL( LOOPBACK, 1 ) )
+        proxy.m_ciphers = [ CIPHER_AES_GCM, CIPHER_CHACHA20_POLY1305, CIPHER_DES_CBC ]
+
+        r = [ proxy._CPwdServerProxy__downgrade_encryption( c ) for c in ciphers ]
+        return (r, proxy)
+
+    @unittest.skipUnless( is_encryption_supported(), 'Encryption is not supported' )
+    def testDowngrade( self ):
+        (r, proxy) = self.downgrade( False, [ CIPHER_AES_GCM, CIPHER_CHACHA20_POLY1305 ] )
+        self.assertEqual( [ True, False ], r )
+        self.assertTrue( proxy.get_encryption() )
+
+        (r, proxy) = self.downgrade( True, [ CIPHER_AES_GCM, CIPHER_CHACHA20_POLY1305, CIPHER_DES_CBC ] )
+        self.assertEqual( [ True, True, True ], r )
+        self.assertFalse( proxy.get_encryption() )
+
+    def testNoDowngradeOfAcceptedCipher( self ):
+        (r, proxy) = self.downgrade( True, [] )
+        proxy.m_fcipher_pinned = True
+
+        self.assertFalse( proxy._CPwdServerProxy__downgrade_encryption( CIPHER_AES_GCM ) )
+        self.assertEqual( CIPHER_AES_GCM, proxy.m_ciphers[ 0 ] )
+
+    def testPackMessage( self ):
+        client = CCrypto( PWD, True, as_unicode('client') )
+        server = CCrypto( PWD, True, as_unicode('server') )
+
+        args = (as_unicode('echo'), ('a' * 100000,), 0)
+        (fcompress, digest, s) = client.pack_message( args, False )
+        self.assertTrue( fcompress )
+        self.assertEqual( (args, as_unicode('client')), server.unpack_message( False, fcompress, digest, s, fVerifyIndex = False ) )
+
+        (fcompress, digest, msg) = client.do_crypto( args, False )
+        self.assertEqual( (args, as_unicode('client')), server.undo_crypto( False, fcompress, digest, msg, fVerifyIndex = False ) )
+
+    def testFrameCipher( self ):
+        self.assertEqual( False, calc_frame_encryption( calc_frame_flags( False, True ) ) )
+        self.assertEqual( CIPHER_AES_GCM, calc_frame_encryption( calc_frame_flags( CIPHER_AES_GCM, False ) ) )
+        self.assertEqual( True, calc_frame_encryption( FRAME_ENCRYPTED ) )
+        self.assertEqual( CIPHER_DES_CBC, calc_frame_encryption( calc_frame_flags( True, False ) ) )
+
+    @unittest.skipUnless( is_cipher_supported( CIPHER_AES_GCM ), 'AES-GCM is not supported' )
+    def testAEAD( self ):
+        client = CCrypto( PWD, False, as_unicode('client') )
+        server = CCrypto( PWD, False, as_unicode('server') )
+
+        for cipher in get_supported_ciphers():
+            for args in [ (as_unicode('echo'), ('a',), 0), (as_unicode('echo'), ('a' * 100000,), 0) ]:
+                (fcompress, digest, s) = client.pack_message( args, cipher )
+                self.assertEqual( (args, as_unicode('client')), server.unpack_message( cipher, fcompress, digest, s, fVerifyIndex = False ) )
+
+        (fcompress, digest, s) = client.pack_message( args, CIPHER_AES_GCM )
+        self.assertRaises( AuthenticationFailure, server.unpack_message, CIPHER_AES_GCM, not fcompress, digest, s, False )
+
+        other = CCrypto( as_unicode('other'), False, as_unicode('server') )
+        self.assertRaises( AuthenticationFailure, other.unpack_message, CIPHER_AES_GCM, fcompress, digest, s, False )
+
+
+class ServerTestCase( TestCase ):
+    server_class = CEchoServer
+    fFrames = True
+
+    def make_transport( self ):
+        return CLocalTransport()
+
+    def setUp( self ):
+        self.g_server = rpdb.globals.g_server
+
+        self.server = self.server_class( PWD, True, False, as_unicode('server') )
+        rpdb.globals.g_server = self.server
+        self.server.start()
+
+        while self.server.m_port is None or self.server.m_work_queue is None:
+            time.sleep( 0.01 )
+
+        crypto = CCrypto( PWD, True, as_unicode('client') )
+        self.transport = self.make_transport()
+        self.proxy = CPwdServerProxy( crypto, calcURL( LOOPBACK, self.server.m_port ), self.transport, fFrames = self.fFrames )
+
+    def tearDown( self ):
+        self.proxy.close()
+        self.server.stop()
+        rpdb.globals.g_server = self.g_server
+
+
+class TestFramedServer( ServerTestCase ):
+    def testCalls( self ):
+        self.assertEqual( 'abc', self.proxy.echo( 'abc' ) )
+        self.assertEqual( 'x' * 100000, self.proxy.echo( 'x' * 100000 ) )
+        self.assertTrue( self.proxy.m_frames is not None )
+
+        frames = self.proxy.m_frames
+        self.assertEqual( 1, self.proxy.echo( 1 ) )
+        self.assertTrue( frames is self.proxy.m_frames )
+
+    def testConcurrentCalls( self ):
+        self.proxy.echo( 0 )
+
+        t = threading.Thread( target = self.proxy.sleep, args = (1.0,) )
+        t0 = time.time()
+        t.start()
+        time.sleep( 0.1 )
+
+        self.assertEqual( 'fast', self.proxy.echo( 'fast' ) )
+        self.assertTrue( time.time() - t0 < 0.9 )
+
+        t.join()
+
+    def testPush( self ):
+        pushed = queue.Queue()
+        self.proxy.set_push_handler( pushed.put )
+
+        self.assertTrue( self.proxy.push( 'abc' ) )
+        self.assertEqual( 'abc', pushed.get( timeout = 5 ) )
+
+        self.proxy.close()
+        self.assertEqual( None, pushed.get( timeout = 5 ) )
+
+    def testLinkSpeedExcludesCallTime( self ):
+        compressor = self.proxy.m_crypto.get_compressor()
+        record_transfer = compressor.record_transfer
+        transfers = []
+
+        def record( size, duration ):
+            transfers.append( ( size, duration ) )
+            record_transfer( size, duration )
+
+        compressor.record_transfer = record
+
+        data = as_unicode( base64.b64encode( os.urandom( 100000 ) ) )
+        t0 = time.time()
+        self.proxy.sleep_echo( data, 0.5 )
+        call_duration = time.time() - t0
+
+        #
+        # The call took over half a second, including the retry after
+        # the first index was rejected, but the transfers were local.
+        #
+        self.assertGreater( max( [size for ( size, duration ) in transfers] ), len( data ) )
+        for ( size, duration ) in transfers:
+            self.assertLess( duration, call_duration / 2 )
+
+        link_speed = compressor.get_link_speed()
+        self.assertGreater( link_speed, 10 * len( data ) / call_duration )
+
+    def testBadVersion( self ):
+        proxy = xmlrpclib.ServerProxy( calcURL( LOOPBACK, self.server.m_port ) )
+        try:
+            proxy.dispatcher_method( 'RPDB_1_5_0', False, False, '', '' )
+            self.fail( 'BadVersion was not raised' )
+
+        except xmlrpclib.Fault:
+            self.assertIn( 'BadVersion', sys.exc_info()[1].faultString )
+
+        finally:
+            proxy( 'close' )()
+
+    def testUnauthenticatedFrameSize( self ):
+        sock = socket.create_connection( ( LOOPBACK, self.server.m_port ), 5 )
+        try:
+            sock.sendall( FRAMES_MAGIC )
+            send_frame( sock, 0, 0, None, as_bytes( get_interface_compatibility_version() ) )
+            self.assertEqual( FRAMES_MAGIC, recv_exact( sock, len( FRAMES_MAGIC ) ) )
+            recv_frame( sock )
+
+            #
+            # The frame is refused before its payload is sent.
+            #
+            sock.sendall( FRAME_HEADER.pack( MAX_UNAUTHENTICATED_FRAME_SIZE + 1, 1, 0, NO_DIGEST ) )
+            self.assertEqual( b'', sock.recv( 1 ) )
+
+        finally:
+            sock.close()
+
+    def testLargeFrameAfterAuthentication( self ):
+        data = 'x' * ( 2 * MAX_UNAUTHENTICATED_FRAME_SIZE )
+
+        self.assertEqual( 0, self.proxy.echo( 0 ) )
+        self.assertEqual( data, self.proxy.echo( data ) )
+
+    def testServerStopClosesConnection( self ):
+        self.proxy.echo( 0 )
+        frames = self.proxy.m_frames
+
+        self.server.stop()
+
+        t0 = time.time()
+        while not frames.is_closed() and time.time() - t0 < 5:
+            time.sleep( 0.01 )
+
+        self.assertTrue( frames.is_closed() )
+
+
+class TestFramesFallback( ServerTestCase ):
+    server_class = CLegacyServer
+
+    def testCalls( self ):
+        self.assertEqual( 'abc', self.proxy.echo( 'abc' ) )
+        self.assertFalse( self.proxy.m_fFrames )
+        self.assertTrue( self.proxy.m_frames is None )
+        self.assertFalse( self.proxy.push( 'abc' ) )
+
+
+@unittest.skipUnless( hasattr( socket, 'AF_UNIX' ), 'Unix domain sockets are not supported' )
+class TestUnixSocket( ServerTestCase ):
+    def testCalls( self ):
+        while self.server.m_socket_path is None:
+            time.sleep( 0.01 )
+
+        path = self.server.m_socket_path
+        self.proxy.m_path = path
+
+        self.assertEqual( 'x' * 100000, self.proxy.echo( 'x' * 100000 ) )
+        self.assertEqual( socket.AF_UNIX, self.proxy.m_frames.m_sock.family )
+        self.assertEqual( path, self.proxy.m_path )
+
+        self.server.stop()
+        self.assertFalse( os.path.exists( path ) )
+
+    def testFallback( self ):
+        folder = tempfile.mkdtemp()
+        self.addCleanup( shutil.rmtree, folder )
+        self.proxy.m_path = os.path.join( folder, 'missing.sock' )
+
+        self.assertEqual( 'abc', self.proxy.echo( 'abc' ) )
+        self.assertEqual( socket.AF_INET, self.proxy.m_frames.m_sock.family )
+        self.assertTrue( self.proxy.m_path is None )
+
+
+class TestMultiCall( ServerTestCase ):
+    def testBatch( self ):
+        mc = CMultiCall( self.proxy )
+        mc.echo( 'a' )
+        mc.missing( 1 )
+        mc.echo( 'x' * 100000 )
+        mc.multicall( [] )
+
+        rl = mc()
+        self.assertEqual( 4, len( rl ) )
+        self.assertEqual( 'a', rl[ 0 ] )
+        self.assertRaises( Exception, lambda: rl[ 1 ] )
+        self.assertEqual( 'x' * 100000, rl[ 2 ] )
+        self.assertRaises( BadArgument, lambda: rl[ 3 ] )
+
+        self.assertEqual( 0, len( mc() ) )
+
+
+class TestPooledTransport( ServerTestCase ):
+    fFrames = False
+
+    def make_transport( self ):
+        return CPooledTransport( pool_size = 2 )
+
+    def testKeepAlive( self ):
+        self.assertEqual( 'abc', self.proxy.echo( 'abc' ) )
+        self.assertEqual( 1, len( self.transport.m_idle ) )
+        sock = self.transport.m_idle[ 0 ][ 1 ].sock
+
+        self.assertEqual( 'x' * 100000, self.proxy.echo( 'x' * 100000 ) )
+        self.assertEqual( 1, len( self.transport.m_idle ) )
+        self.assertTrue( sock is self.transport.m_idle[ 0 ][ 1 ].sock )
+
+    def testConcurrentCalls( self ):
+        self.proxy.echo( 0 )
+
+        t = threading.Thread( target = self.proxy.sleep, args = (1.0,) )
+        t0 = time.time()
+        t.start()
+        time.sleep( 0.1 )
+
+        self.assertEqual( 'fast', self.proxy.echo( 'fast' ) )
+        self.assertTrue( time.time() - t0 < 0.9 )
+
+        t.join()
+        self.assertEqual( 2, len( self.transport.m_idle ) )
+
+    def testReconnect( self ):
+        self.proxy.echo( 0 )
+        self.transport.m_idle[ 0 ][ 1 ].sock.shutdown( socket.SHUT_RDWR )
+
+        self.assertEqual( 'abc', self.proxy.echo( 'abc' ) )
+        self.assertEqual( 1, len( self.transport.m_idle ) )
+
+    def testIdleTimeout( self ):
+        self.transport.m_idle_timeout = 0
+        self.proxy.echo( 0 )
+        connection = self.transport.m_idle[ 0 ][ 1 ]
+
+        self.proxy.echo( 1 )
+        self.assertTrue( connection.sock is None )
+        self.assertFalse( connection is self.transport.m_idle[ 0 ][ 1 ] )
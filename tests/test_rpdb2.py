@@ -2,7 +2,7 @@
 
 # Python
 import unittest
-import os
+import os, sys, time
 
 # RPDB2
 from tests.utils_func_tests import BaseTestRpdb2, Rpdb2Stdout, dbg
@@ -15,9 +15,9 @@ class TestRpdb2( BaseTestRpdb2 ):
         self.attach()
         self.goAndExit()
 
-        assert os.path.exists( 'tests/f1' )
-        assert os.path.exists( 'tests/done' )
-        assert os.path.exists( 'tests/atexit' )
+        assert self.stepDone( 'f1' )
+        assert self.stepDone( 'done' )
+        assert self.stepDone( 'atexit' )
 
     def testBp( self ):
         self.startPdb2()
@@ -26,14 +26,68 @@ class TestRpdb2( BaseTestRpdb2 ):
         self.breakp( self.bp1Line )
         self.goAndWaitOnBp() # break during definition of f1
         self.goAndWaitOnBp() # break during call of f1
-        assert os.path.exists( 'tests/start' )
-        assert not os.path.exists( 'tests/f1' )
+        assert self.stepDone( 'start' )
+        assert not self.stepDone( 'f1' )
         self.goAndWaitOnBp() # break after call of f2
-        assert os.path.exists( 'tests/f1' )
-        assert os.path.exists( 'tests/f2' )
+        assert self.stepDone( 'f1' )
+        assert self.stepDone( 'f2' )
         self.goAndExit() # run until the end
-        assert os.path.exists('tests/done')
-        assert os.path.exists('tests/atexit')
+        assert self.stepDone( 'done' )
+        assert self.stepDone( 'atexit' )
+
+    def testLogpoint( self ):
+        self.startPdb2()
+        self.attach()
+        self.command( 'lp f2, t; len(t)' )
+        bl = self.command( 'bl', 3 )
+        self.assertIn( "log: t;len(t)", bl )
+        self.goAndExit()
+
+        out = self.rpdb2Stdout.getvalue()
+        self.assertIn( "t = 'a', len(t) = 1", out )
+        self.assertIn( "t = '33', len(t) = 2", out )
+
+    def testProfile( self ):
+        self.startPdb2()
+        self.attach()
+        self.command( 'profile start 2' )
+        time.sleep( 0.5 )
+        self.command( 'profile stop' )
+        state = self.command( 'profile', 1 )
+        self.assertIn( 'Profiler is stopped', state )
+
+        dump = self.command( 'profile dump', 1 )
+        self.assertIn( '<module> (', dump )
+        self.assertIn( 'debugme.py:1);', dump )
+        self.goAndExit()
+
+    def testCompression( self ):
+        self.startPdb2()
+        self.attach()
+        self.breakp( 'f4' )
+        self.goAndWaitOnBp()
+        self.goAndWaitOnBp()
+
+        stats = self.command( 'compression', 2 )
+        self.assertIn( 'Sent ', stats )
+        self.assertIn( 'Received ', stats )
+        self.assertIn( 'Measured link speed', stats )
+
+        self.command( 'bc *' )
+        self.goAndExit()
+
+    def testCodeCache( self ):
+        self.startPdb2()
+        self.attach()
+        self.breakp( 'f4' )
+        self.goAndWaitOnBp()
+
+        stats = self.command( 'codecache', 2 )
+        self.assertIn( 'Code contexts: ', stats )
+        self.assertIn( 'evictions: 0', stats )
+
+        self.command( 'bc *' )
+        self.goAndExit()
 
     def testStack( self ):
         self.startPdb2()
@@ -89,3 +143,11 @@ class XXXTestBreakOnExit(BaseTestRpdb2):
         self.setBreakonexit( False )
         self.goAndExit()
         self.assertEqual( self.rpdb2Stdout.attached, False )
+
+
+@unittest.skipUnless( hasattr( sys, 'monitoring' ), 'sys.monitoring requires Python 3.12' )
+class TestRpdb2Monitoring( TestRpdb2 ):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rpdb2Args = [ '--monitoring' ]
@@ -0,0 +1,72 @@
+from unittest.case import TestCase
+
+from rpdb.const import DICT_KEY_SPEC, DICT_KEY_MAX_DEPTH, DICT_KEY_NLINES, DICT_KEY_EXPR_LIST, DICT_KEY_FILTER_LEVEL, \
+    DICT_KEY_REPR_LIMIT, DICT_KEY_FRAME_INDEX, DICT_KEY_EXCEPTION, DICT_KEY_STACK, DICT_KEY_SOURCE, DICT_KEY_THREADS, \
+    DICT_KEY_NAMESPACE, DICT_KEY_EXPR, DICT_KEY_REPR
+from rpdb.exceptions import BadArgument
+from rpdb.snapshot import CBreakSnapshot, calc_snapshot_spec
+
+
+def make_snapshot( spec, fException = False ):
+    spec = calc_snapshot_spec( spec )
+    namespace = [ { DICT_KEY_EXPR: expr, DICT_KEY_REPR: expr.upper() } for (expr, fExpand) in spec[ DICT_KEY_EXPR_LIST ] ]
+
+    return {
+        DICT_KEY_SPEC: spec,
+        DICT_KEY_FRAME_INDEX: 0,
+        DICT_KEY_EXCEPTION: fException,
+        DICT_KEY_STACK: 'stack',
+        DICT_KEY_SOURCE: 'source',
+        DICT_KEY_THREADS: 'threads',
+        DICT_KEY_NAMESPACE: namespace
+        }
+
+
+class TestBreakSnapshot( TestCase ):
+    def testSpec( self ):
+        spec = calc_snapshot_spec( { DICT_KEY_EXPR_LIST: [ ('locals()', 1) ] } )
+        self.assertEqual( 0, spec[ DICT_KEY_MAX_DEPTH ] )
+        self.assertEqual( [ ('locals()', True) ], spec[ DICT_KEY_EXPR_LIST ] )
+
+        self.assertRaises( BadArgument, calc_snapshot_spec, { DICT_KEY_NLINES: -1 } )
+        self.assertRaises( BadArgument, calc_snapshot_spec, { DICT_KEY_FILTER_LEVEL: 'x' } )
+        self.assertRaises( BadArgument, calc_snapshot_spec, None )
+
+    def testTakeOnce( self ):
+        bs = CBreakSnapshot()
+        bs.set( make_snapshot( { DICT_KEY_NLINES: 5 } ) )
+
+        self.assertEqual( None, bs.take_source_lines( 10, 0, False ) )
+        self.assertEqual( None, bs.take_source_lines( 5, 1, False ) )
+        self.assertEqual( 'source', bs.take_source_lines( 5, 0, False ) )
+        self.assertEqual( None, bs.take_source_lines( 5, 0, False ) )
+
+        self.assertEqual( None, bs.take_stack( True ) )
+        self.assertEqual( 'stack', bs.take_stack( False ) )
+        self.assertEqual( None, bs.take_stack( False ) )
+
+    def testTruncatedStack( self ):
+        bs = CBreakSnapshot()
+        bs.set( make_snapshot( { DICT_KEY_MAX_DEPTH: 2 } ) )
+        self.assertEqual( None, bs.take_stack( False ) )
+
+    def testNamespace( self ):
+        el = [ ('locals()', True), ('globals()', True) ]
+        bs = CBreakSnapshot()
+        bs.set( make_snapshot( { DICT_KEY_EXPR_LIST: el, DICT_KEY_FILTER_LEVEL: 1 } ) )
+
+        self.assertEqual( ({}, el), bs.take_namespace( el, 2, 0, False, 128 ) )
+        self.assertEqual( ({}, el), bs.take_namespace( el, 1, 0, False, 256 ) )
+
+        (rd, nl) = bs.take_namespace( [ ('locals()', True), ('locals()["x"]', True) ], 1, 0, False, 128 )
+        self.assertEqual( [ 'locals()' ], list( rd.keys() ) )
+        self.assertEqual( 'LOCALS()', rd[ 'locals()' ][ DICT_KEY_REPR ] )
+        self.assertEqual( [ ('locals()["x"]', True) ], nl )
+
+        (rd, nl) = bs.take_namespace( el, 1, 0, False, 128 )
+        self.assertEqual( [ 'globals()' ], list( rd.keys() ) )
+        self.assertEqual( [ ('locals()', True) ], nl )
+
+        bs.set( make_snapshot( { DICT_KEY_EXPR_LIST: el } ) )
+        bs.clear()
+        self.assertEqual( ({}, el), bs.take_namespace( el, 0, 0, False, 128 ) )
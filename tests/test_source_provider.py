@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+from unittest.case import TestCase
+
+from rpdb.source_provider import CSourceCache, CSourceFile
+
+
+class TestSourceFile( TestCase ):
+    def testLines( self ):
+        sf = CSourceFile( 'a = 1\r\nb = 2\n\nc = 3', 'utf-8', True )
+
+        self.assertEqual( 4, sf.get_line_count() )
+        self.assertEqual( 'a = 1\n', sf.get_line( 1 ) )
+        self.assertEqual( 'b = 2\n', sf.get_line( 2 ) )
+        self.assertEqual( '\n', sf.get_line( 3 ) )
+        self.assertEqual( 'c = 3\n', sf.get_line( 4 ) )
+        self.assertEqual( '', sf.get_line( 5 ) )
+        self.assertEqual( '', sf.get_line( 0 ) )
+
+    def testRange( self ):
+        sf = CSourceFile( 'a = 1\nb = 2\n\nc = 3', 'utf-8', True )
+
+        self.assertEqual( [ 'b = 2\n', '\n' ], sf.get_lines( 2, 2 ) )
+        self.assertEqual( [ '\n', 'c = 3\n' ], sf.get_lines( 3 ) )
+        self.assertEqual( [ 'c = 3\n' ], sf.get_lines( 4, 10 ) )
+        self.assertEqual( [], sf.get_lines( 5 ) )
+        self.assertEqual( [], sf.get_lines( 1, 0 ) )
+        self.assertEqual( [ sf.get_line( i ) for i in range( 1, 5 ) ], sf.get_lines( 1 ) )
+
+    def testFindLines( self ):
+        sf = CSourceFile( 'f(1)\nx = 1\nf(2); f(3)\nf', 'utf-8', True )
+
+        self.assertEqual( [ 1, 3 ], sf.find_lines( 'f(' ) )
+        self.assertEqual( [ 1, 3, 4 ], sf.find_lines( 'f' ) )
+        self.assertEqual( [], sf.find_lines( 'g(' ) )
+
+    def testTrailingNewline( self ):
+        sf = CSourceFile( 'a = 1\n', 'utf-8', True )
+
+        self.assertEqual( 2, sf.get_line_count() )
+        self.assertEqual( '\n', sf.get_line( 2 ) )
+
+
+class TestSourceCache( TestCase ):
+    def setUp( self ):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.folder )
+
+    def write( self, name, source ):
+        path = os.path.join( self.folder, name )
+        f = open( path, 'w' )
+        f.write( source )
+        f.close()
+        return path
+
+    def testHitsAndMisses( self ):
+        cache = CSourceCache()
+        path = self.write( 'a.py', 'x = 1\n' )
+
+        sf = cache.get( path )
+        self.assertTrue( sf is cache.get( path ) )
+        self.assertEqual( 'x = 1\n', sf.get_line( 1 ) )
+
+        stats = cache.get_stats()
+        self.assertEqual( (1, 1, 1), (stats[ 'hits' ], stats[ 'misses' ], stats[ 'size' ]) )
+
+    def testRevalidate( self ):
+        cache = CSourceCache()
+        path = self.write( 'a.py', 'x = 1\n' )
+        self.assertEqual( 'x = 1\n', cache.get( path ).get_line( 1 ) )
+
+        self.write( 'a.py', 'x = 22\n' )
+        self.assertEqual( 'x = 22\n', cache.get( path ).get_line( 1 ) )
+        self.assertEqual( 1, cache.get_stats()[ 'invalidations' ] )
+
+    def testInvalidate( self ):
+        cache = CSourceCache()
+        a = self.write( 'a.py', 'a = 1\n' )
+        b = self.write( 'b.py', 'b = 1\n' )
+
+        sa = cache.get( a )
+        sb = cache.get( b )
+        cache.invalidate( a )
+
+        self.assertFalse( sa is cache.get( a ) )
+        self.assertTrue( sb is cache.get( b ) )
+
+    def testEviction( self ):
+        a = self.write( 'a.py', 'a = 1\n' * 1000 )
+        b = self.write( 'b.py', 'b = 1\n' * 1000 )
+        c = self.write( 'c.py', 'c = 1\n' * 1000 )
+
+        cache = CSourceCache( max_bytes = 2 * CSourceCache().get( a ).m_size )
+        cache.get( a )
+        cache.get( b )
+        cache.get( a )
+        cache.get( c )
+
+        stats = cache.get_stats()
+        self.assertEqual( (2, 1), (stats[ 'size' ], stats[ 'evictions' ]) )
+        self.assertTrue( stats[ 'bytes' ] <= stats[ 'max_bytes' ] )
+
+        cache.get( a )
+        self.assertEqual( 2, cache.get_stats()[ 'hits' ] )
+
+        cache.get( b )
+        self.assertEqual( 4, cache.get_stats()[ 'misses' ] )
+
+    def testOverBudget( self ):
+        cache = CSourceCache( max_bytes = 1 )
+        path = self.write( 'a.py', 'x = 1\n' )
+
+        sf = cache.get( path )
+        self.assertTrue( sf is cache.get( path ) )
+        self.assertEqual( 0, cache.get_stats()[ 'evictions' ] )
@@ -0,0 +1,70 @@
+import os
+import sysconfig
+from unittest.case import TestCase
+
+from rpdb.exceptions import BadArgument
+from rpdb.trace_filter import CTraceFilter, CThreadFilter
+
+
+class TestTraceFilter( TestCase ):
+    def testNoRules( self ):
+        tf = CTraceFilter()
+        self.assertFalse( tf.is_excluded( '/app/models.py' ) )
+
+    def testGlobAndPrefix( self ):
+        tf = CTraceFilter( [ ('exclude', '*/vendor/*'), ('exclude', '/opt/lib/') ] )
+        self.assertTrue( tf.is_excluded( '/app/vendor/six.py' ) )
+        self.assertTrue( tf.is_excluded( '/opt/lib/json/decoder.py' ) )
+        self.assertFalse( tf.is_excluded( '/app/models.py' ) )
+
+    def testLastRuleWins( self ):
+        tf = CTraceFilter( [ ('exclude', '/app/'), ('include', '/app/views/*') ] )
+        self.assertTrue( tf.is_excluded( '/app/models.py' ) )
+        self.assertFalse( tf.is_excluded( '/app/views/index.py' ) )
+
+        tf.set_rules( [ ('include', '/app/views/*'), ('exclude', '/app/') ] )
+        self.assertTrue( tf.is_excluded( '/app/views/index.py' ) )
+
+    def testStdlibAlias( self ):
+        tf = CTraceFilter( [ ('exclude', '<stdlib>') ] )
+        stdlib = sysconfig.get_paths()[ 'stdlib' ]
+        self.assertTrue( tf.is_excluded( os.path.join( os.path.abspath( stdlib ), 'json', 'decoder.py' ) ) )
+        self.assertFalse( tf.is_excluded( '/app/models.py' ) )
+
+    def testStdlibAliasLeavesSitePackages( self ):
+        tf = CTraceFilter( [ ('exclude', '<stdlib>') ] )
+        stdlib = os.path.abspath( sysconfig.get_paths()[ 'stdlib' ] )
+        purelib = os.path.abspath( sysconfig.get_paths()[ 'purelib' ] )
+
+        self.assertFalse( tf.is_excluded( os.path.join( purelib, 'requests', 'api.py' ) ) )
+        self.assertFalse( tf.is_excluded( os.path.join( stdlib, 'site-packages', 'requests', 'api.py' ) ) )
+
+        tf.set_rules( [ ('exclude', '<site-packages>') ] )
+        self.assertTrue( tf.is_excluded( os.path.join( stdlib, 'site-packages', 'requests', 'api.py' ) ) )
+
+    def testRulesRoundTrip( self ):
+        rules = [ ('exclude', '<site-packages>'), ('include', '*/mypackage/*') ]
+        tf = CTraceFilter( [ list(r) for r in rules ] )
+        self.assertEqual( rules, tf.get_rules() )
+
+    def testBadRules( self ):
+        self.assertRaises( BadArgument, CTraceFilter, [ ('ignore', '*') ] )
+        self.assertRaises( BadArgument, CTraceFilter, [ ('exclude', '') ] )
+        self.assertRaises( BadArgument, CTraceFilter, [ 'exclude' ] )
+
+
+class TestThreadFilter( TestCase ):
+    def testAllSelected( self ):
+        tf = CThreadFilter()
+        self.assertTrue( tf.is_selected( 1234, 'MainThread' ) )
+
+    def testSelectByNameAndTid( self ):
+        tf = CThreadFilter( [ 'worker-1*' ], [ 1234 ] )
+        self.assertTrue( tf.is_selected( 1, 'worker-12' ) )
+        self.assertTrue( tf.is_selected( 1234, 'MainThread' ) )
+        self.assertFalse( tf.is_selected( 1, 'worker-2' ) )
+        self.assertEqual( ( [ 'worker-1*' ], [ 1234 ] ), tf.get_selection() )
+
+    def testBadSelection( self ):
+        self.assertRaises( BadArgument, CThreadFilter, [ '' ], [] )
+        self.assertRaises( BadArgument, CThreadFilter, [], [ 'abc' ] )
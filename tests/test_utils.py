@@ -1,6 +1,11 @@
+import json.decoder
+import os
+import shutil
 import sys
+import tempfile
 from unittest.case import TestCase
 
+import rpdb.source_provider
 import rpdb.utils
 import rpdb2
 
@@ -50,4 +55,92 @@ class TestParseConsoleLaunch( TestCase ):
         fchdir, interpreter, arg = rpdb2.parse_console_launch( 'titi -k -i toto' )
         self.assertEqual( (True, 'titi -k -i toto' ), (fchdir, arg) )
         fchdir, interpreter, arg = rpdb2.parse_console_launch( 'titi -i toto' )
-        self.assertEqual( (True, 'titi -i toto' ), (fchdir, arg) )
\ No newline at end of file
+        self.assertEqual( (True, 'titi -i toto' ), (fchdir, arg) )
+
+class TestHideSessionPassword( TestCase ):
+    SOURCE = 'import rpdb2\nrpdb2.start_embedded_debugger("pwd", True)\nx = 1\nrpdb2.start_embedded_debugger(\n    "pwd",\n    True)\ny = 2\n'
+
+    def hide( self, lineno, nlines ):
+        sf = rpdb.source_provider.CSourceFile( self.SOURCE, 'utf-8', True )
+        lines = sf.get_lines( lineno, nlines )
+        rpdb2.hide_session_password( sf, lineno, lines )
+        return lines
+
+    def testHide( self ):
+        lines = self.hide( 1, -1 )
+
+        self.assertEqual( 'import rpdb2\n', lines[ 0 ] )
+        self.assertEqual( 'rpdb2.start_embedded_debugger("""...Removed-password-from-output...""")\n', lines[ 1 ] )
+        self.assertEqual( 'x = 1\n', lines[ 2 ] )
+        self.assertEqual( 'rpdb2.start_embedded_debugger("""...Removed-password-from-output...\n', lines[ 3 ] )
+        self.assertEqual( '...\n', lines[ 4 ] )
+        self.assertEqual( '...""")\n', lines[ 5 ] )
+        self.assertEqual( 'y = 2\n', lines[ 6 ] )
+
+    def testHideInRange( self ):
+        self.assertEqual( [ '...\n', '...""")\n', 'y = 2\n' ], self.hide( 5, 3 ) )
+        self.assertEqual( [ 'x = 1\n' ], self.hide( 3, 1 ) )
+
+
+class TestPathCache( TestCase ):
+    def setUp( self ):
+        self.folder = tempfile.mkdtemp()
+        self.myisfile = rpdb.utils.myisfile
+        self.calls = []
+
+        def myisfile( path ):
+            self.calls.append( path )
+            return self.myisfile( path )
+
+        rpdb.utils.myisfile = myisfile
+        rpdb.utils.g_path_cache.clear()
+
+    def tearDown( self ):
+        rpdb.utils.myisfile = self.myisfile
+        rpdb.utils.g_path_cache.clear()
+        shutil.rmtree( self.folder )
+
+    def testFindFile( self ):
+        path = os.path.join( self.folder, 'found.py' )
+        open( path, 'w' ).close()
+
+        self.assertEqual( path, rpdb.utils.FindFile( 'found.py', [ self.folder ] ) )
+        n = len( self.calls )
+
+        self.assertEqual( path, rpdb.utils.FindFile( 'found.py', [ self.folder ] ) )
+        self.assertEqual( n, len( self.calls ) )
+
+    def testNegative( self ):
+        self.assertRaises( IOError, rpdb.utils.FindFile, 'missing_rpdb_test.py', [ self.folder ] )
+        n = len( self.calls )
+        self.assertTrue( n > 0 )
+
+        self.assertRaises( IOError, rpdb.utils.FindFile, 'missing_rpdb_test.py', [ self.folder ] )
+        self.assertEqual( n, len( self.calls ) )
+
+        sys.path.append( self.folder )
+        try:
+            self.assertRaises( IOError, rpdb.utils.FindFile, 'missing_rpdb_test.py', [ self.folder ] )
+            self.assertTrue( len( self.calls ) > n )
+
+        finally:
+            sys.path.remove( self.folder )
+
+    def testNegativeExpires( self ):
+        ttl = rpdb.utils.PATH_CACHE_NEGATIVE_TTL
+        rpdb.utils.PATH_CACHE_NEGATIVE_TTL = -1
+
+        try:
+            path = os.path.join( self.folder, 'created.py' )
+            self.assertRaises( IOError, rpdb.utils.FindFile, 'created.py', [ self.folder ] )
+
+            open( path, 'w' ).close()
+            self.assertEqual( path, rpdb.utils.FindFile( 'created.py', [ self.folder ] ) )
+
+        finally:
+            rpdb.utils.PATH_CACHE_NEGATIVE_TTL = ttl
+
+    def testFindFileAsModule( self ):
+        (root, ext) = os.path.splitext( os.path.abspath( json.decoder.__file__ ) )
+        self.assertEqual( root + '.py', rpdb.utils.FindFileAsModule( 'json/decoder.py' ) )
+        self.assertEqual( root + '.py', rpdb.utils.FindFile( 'json/decoder.py', fModules = True ) )
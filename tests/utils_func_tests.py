@@ -1,7 +1,7 @@
 
 # Python
 import unittest, subprocess, threading
-import os, time, sys, re, signal
+import os, time, sys, re, signal, shutil, tempfile
 from io import StringIO
 
 # RPDB2
@@ -40,8 +40,6 @@ DEBUGME=rpdb2.as_unicode('debugme.py')
 RPDB2 = 'rpdb2.py'
 PWD=rpdb2.as_unicode('toto')
 
-STEPS = [ 'tests/%s' % f for f in ('start', 'f1', 'f2', 'f3', 'done') ]
-
 class FakeStdin:
     def __init__(self):
         self.please_stop = False
@@ -184,12 +182,12 @@ class BaseTestRpdb2( unittest.TestCase ):
 
     def setUp(self):
         self.cleanBpFiles()
-        self.cleanStepFiles()
+        self.stepsDir = tempfile.mkdtemp()
         self.console = None
         self.sm = None
         self.fakeStdin = FakeStdin()
         self.rpdb2Stdout = Rpdb2Stdout( dispStdout=False )
-        kwargs = {}
+        kwargs = { 'env': dict( os.environ, DEBUGME_STEPS_DIR = self.stepsDir ) }
         pythonCmdLine = [ PYTHON, '-u', RPDB2, '-d'] + self.rpdb2Args
         rid = rpdb.utils.generate_rid()
         rpdb.session_manager.create_pwd_file( rid, PWD )
@@ -203,10 +201,9 @@ class BaseTestRpdb2( unittest.TestCase ):
         self.script = subprocess.Popen( pythonCmdLine, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs )
         self.stdoutDisp = StdoutDisplayer( self.script )
 
-    def cleanStepFiles(self):
-        for fname in STEPS:
-            if os.path.exists( fname ):
-                os.unlink( fname )
+    def stepDone(self, step):
+        '''Return True if debugme.py reached step.'''
+        return os.path.exists( os.path.join( self.stepsDir, step ) )
 
     def cleanBpFiles(self):
         bpldir = os.path.dirname( rpdb.session_manager.calc_bpl_filename( '' ) )
@@ -245,7 +242,6 @@ class BaseTestRpdb2( unittest.TestCase ):
 
     def tearDown(self):
         dbg( 'Teardown' )
-        self.cleanStepFiles()
         if self.console:
             if self.rpdb2Stdout.attached:
                 dbg( 'Teardown: Stopping...' )
@@ -264,6 +260,7 @@ class BaseTestRpdb2( unittest.TestCase ):
             dbg( 'Teardown: Console and SM done' )
 
         self.terminateScript()
+        shutil.rmtree( self.stepsDir, ignore_errors = True )
 
 
     #############[ debugger control ]##################
@@ -3880,6 +3880,14 @@ class CNamespaceViewer(wx.Panel, CCaptionManager):
         self.m_globals.set_filter(filter_level)
         self.m_exception.set_filter(filter_level)
 
+        #
+        # The roots of the panes come with the events of the next break
+        # so they are not queried separately.
+        #
+        el = [(p.get_root_expr(), True) for p in [self.m_locals, self.m_globals, self.m_exception]]
+        spec = {rpdb.const.DICT_KEY_EXPR_LIST: el, rpdb.const.DICT_KEY_FILTER_LEVEL: filter_level}
+        self.m_session_manager.set_break_snapshot(spec)
+
 
     def get_local_key(self, _stack):
         '''Arguments: